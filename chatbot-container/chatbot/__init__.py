@@ -1,13 +1,15 @@
 from aiohttp import web
 from chatbot.config import ServiceConfig
-from prometheus_client import CollectorRegistry
 from pydantic_yaml import to_yaml_str
 import logging
 from chatbot.hams import Hams, hams_app_create
+from chatbot.httpclient import http_app_create
 from chatbot.service import service_app_create
 from chatbot.azurebot import azure_app_create
 from .mcp import mcp_app_create
 from chatbot.llmconversationhandler import langchain_app_create
+from chatbot.metrics import metrics_app_create
+from chatbot.tracing import tracing_app_create
 from chatbot import keys
 
 logger = logging.getLogger(__name__)
@@ -22,15 +24,6 @@ def config_app_create(app: web.Application, config: ServiceConfig) -> web.Applic
     return app
 
 
-def metrics_app_create(app: web.Application) -> web.Application:
-    """
-    Create the metrics registry for the service
-    """
-    app[keys.metrics] = CollectorRegistry(auto_describe=True)
-
-    return app
-
-
 def app_init(app: web.Application, config: ServiceConfig):
     """
     Initialize the service with the given configuration file
@@ -41,6 +34,8 @@ def app_init(app: web.Application, config: ServiceConfig):
 
     config_app_create(app, config)
     metrics_app_create(app)
+    tracing_app_create(app, config)
+    http_app_create(app, config)
     hams_app_create(app, config.hams)
     mcp_app_create(app, config)
     service_app_create(app, config)
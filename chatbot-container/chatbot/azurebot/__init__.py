@@ -3,11 +3,13 @@
 
 from botbuilder.core import ActivityHandler, TurnContext
 from botbuilder.schema import ChannelAccount
-from botbuilder.schema import Activity, ActivityTypes
+from botbuilder.schema import Activity, ActivityTypes, ResourceResponse
 from aiohttp import web
 from chatbot import keys
 
 from datetime import datetime
+import asyncio
+import time
 import traceback
 import logging
 
@@ -19,14 +21,24 @@ from botbuilder.core import (
     TurnContext,
 )
 from chatbot.azurebot.webview import AzureBotView
+from chatbot.azurebot.workers import BotWorkers, bot_workers_cleanup
 from chatbot.llmconversationhandler import LLMConversationHandler
-from prometheus_client import REGISTRY, CollectorRegistry, Summary
-import base64
+from chatbot.llmconversationhandler.filestore import FileTooLargeError, StoredFile
+from chatbot.llmconversationhandler.ratelimit import RateLimitExceededError
+from chatbot.llmconversationhandler.turnqueue import ConversationBusyError
+from chatbot.llmconversationhandler.usage import TokenBudgetExceededError
+from chatbot.tracing import Tracer
+from chatbot.metrics import LLM_LATENCY_BUCKETS, current_exemplar, timed
+from prometheus_client import REGISTRY, CollectorRegistry, Histogram
 import aiohttp
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Interval between typing indicators while a reply is being generated.
+# Channels drop the indicator after a few seconds so it must be refreshed.
+TYPING_INTERVAL_SECONDS = 3.0
+
 
 # Catch-all for errors.
 async def on_error(context: TurnContext, error: Exception):
@@ -56,6 +68,38 @@ async def on_error(context: TurnContext, error: Exception):
         await context.send_activity(trace_activity)
 
 
+def activity_identity(activity: Activity) -> str:
+    """
+    Identity of the user sending the activity, which scopes their token budget and cached
+    replies: the Entra ID object id of Teams users, otherwise the channel's id of the user
+    """
+    user = activity.from_property
+    if user is None:
+        return "anonymous"
+    return user.aad_object_id or user.id
+
+
+class TracedBotFrameworkAdapter(BotFrameworkAdapter):
+    """
+    Adapter recording every send to the Bot Connector as a span, typing indicators apart
+    from replies
+    """
+
+    def __init__(self, settings: BotFrameworkAdapterSettings, tracer: Tracer):
+        super().__init__(settings)
+        self.tracer = tracer
+
+    async def send_activities(
+        self, context: TurnContext, activities: list[Activity]
+    ) -> list[ResourceResponse]:
+        typing = all(activity.type == ActivityTypes.typing for activity in activities)
+        with self.tracer.span(
+            "bot.typing" if typing else "bot.send",
+            **{"bot.activities": len(activities)},
+        ):
+            return await super().send_activities(context, activities)
+
+
 class AzureBot(ActivityHandler):
     """
     AzureBot is a bot that handles incoming messages and responds using an AI model.
@@ -64,16 +108,21 @@ class AzureBot(ActivityHandler):
     # See https://aka.ms/about-bot-activity-message to learn more about the message and other activity types.
 
     def __init__(
-        self, app: web.Application, registry: CollectorRegistry | None = REGISTRY
+        self,
+        app: web.Application,
+        max_concurrent_downloads: int = 4,
+        registry: CollectorRegistry | None = REGISTRY,
     ):
         super().__init__()
         self.app = app
+        self.download_semaphore = asyncio.Semaphore(max_concurrent_downloads)
 
         self.prometheus_registry = registry
-        self.chat_metric = Summary(
+        self.chat_metric = Histogram(
             "chat_usage",
-            "Summary of Chat actions",
+            "Latency of Chat actions",
             ["action"],
+            buckets=LLM_LATENCY_BUCKETS,
             registry=registry,
         )
 
@@ -87,48 +136,140 @@ class AzureBot(ActivityHandler):
             turn_context.activity.attachments
             and len(turn_context.activity.attachments) > 0
         ):
-            for attachment in turn_context.activity.attachments:
-                content_url = attachment.content_url
-                content_type = attachment.content_type
-                name = attachment.name if hasattr(attachment, "name") else "attachment"
-                print(
-                    f"Received file attachment: {name}, type: {content_type}, URL: {content_url}"
-                )
-                print(f"Attachment: {attachment}")
-                # Read the file content as bytes
-                # if "http_session" not in self.app:
-                #     self.app["http_session"] = aiohttp.ClientSession()
-                # async with self.app["http_session"].get(content_url) as resp:
-                #     file_bytes = await resp.read()
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(content_url) as resp:
-                        file_bytes = await resp.read()
-
-                await turn_context.send_activity(
-                    f"Received file '{name}' (type: {content_type}). Length ({len(file_bytes)}). Base64 encoded content prepared for attachment."
+            # Download the attachments concurrently, then add them to the conversation in order
+            stored_files = await asyncio.gather(
+                *(
+                    self._download_attachment(turn_context, attachment)
+                    for attachment in turn_context.activity.attachments
                 )
+            )
+            for attachment, stored in zip(
+                turn_context.activity.attachments, stored_files
+            ):
+                if stored is None:
+                    continue
+                name = getattr(attachment, "name", None) or "attachment"
                 await self.app[keys.llmhandler].upload(
-                    turn_context.activity.conversation, name, content_type, file_bytes
+                    turn_context.activity.conversation,
+                    name,
+                    attachment.content_type,
+                    stored,
+                )
+                await turn_context.send_activity(
+                    f"Received file '{name}' (type: {attachment.content_type}). Length ({stored.size})."
                 )
             return
-            # Optionally, you can send the base64 string or process it further here
 
         llmHandler: LLMConversationHandler = self.app[keys.llmhandler]
+        identity = activity_identity(turn_context.activity)
+
+        try:
+            llmHandler.usage.check(identity)
+        except TokenBudgetExceededError as e:
+            logger.warning(f"Bot: {e}")
+            await turn_context.send_activity(
+                "You have used your daily allowance, please try again tomorrow."
+            )
+            return
 
-        with self.chat_metric.labels("on_message").time():
-            llm_reply = await llmHandler.chat(
-                turn_context.activity.conversation,
-                "my-identity",
-                turn_context.activity.text,
+        typing_task = asyncio.create_task(self._keep_typing(turn_context))
+        try:
+            with timed(self.chat_metric.labels("on_message")):
+                start = time.perf_counter()
+                fragments = []
+                async for fragment in llmHandler.chat_stream(
+                    turn_context.activity.conversation,
+                    identity,
+                    turn_context.activity.text,
+                ):
+                    if not fragments:
+                        self.chat_metric.labels("first_token").observe(
+                            time.perf_counter() - start, current_exemplar()
+                        )
+                    fragments.append(fragment)
+        except ConversationBusyError as e:
+            logger.warning(f"Bot: {e}")
+            await turn_context.send_activity(
+                "I am still answering your earlier messages, please wait for my reply."
             )
+            return
+        except RateLimitExceededError as e:
+            logger.warning(f"Bot: {e}")
+            await turn_context.send_activity(
+                "I am busy right now, please try again in a moment."
+            )
+            return
+        finally:
+            typing_task.cancel()
+
+        llm_reply = "".join(fragments)
 
         logger.debug("LLM reply: %s", llm_reply)
-        await turn_context.send_activity(llm_reply)
+        # Nothing is streamed when the message was answered by another message's turn
+        if llm_reply:
+            await turn_context.send_activity(llm_reply)
+
+    async def _download_attachment(
+        self, turn_context: TurnContext, attachment
+    ) -> StoredFile | None:
+        """
+        Stream an attachment into the file store in chunks.
+        Returns None, after telling the user, if the file could not be stored.
+        """
+        content_url = attachment.content_url
+        content_type = attachment.content_type
+        name = getattr(attachment, "name", None) or "attachment"
+        logger.debug(
+            f"Received file attachment: {name}, type: {content_type}, URL: {content_url}"
+        )
+
+        file_store = self.app[keys.llmhandler].file_store
+
+        try:
+            with timed(self.chat_metric.labels("attachment")):
+                async with self.download_semaphore:
+                    async with self.app[keys.http_session].get(content_url) as resp:
+                        resp.raise_for_status()
+                        if (
+                            resp.content_length is not None
+                            and resp.content_length > file_store.config.max_file_bytes
+                        ):
+                            raise FileTooLargeError(
+                                resp.content_length, file_store.config.max_file_bytes
+                            )
+                        stored = await file_store.save_stream(
+                            resp.content.iter_chunked(file_store.config.chunk_size)
+                        )
+        except FileTooLargeError as e:
+            logger.warning(f"Rejected attachment {name}: {e}")
+            await turn_context.send_activity(
+                f"File '{name}' is too large, the limit is {e.max_size} bytes."
+            )
+            return None
+        except (aiohttp.ClientError, TimeoutError) as e:
+            logger.error(f"Failed to download attachment {name}: {e!r}")
+            await turn_context.send_activity(f"Failed to download file '{name}'.")
+            return None
+
+        return stored
+
+    async def _keep_typing(self, turn_context: TurnContext):
+        """
+        Send typing indicators until cancelled so the user sees progress while the
+        model and tools are working
+        """
+        while True:
+            try:
+                await turn_context.send_activity(Activity(type=ActivityTypes.typing))
+            except Exception as e:
+                logger.warning(f"Failed to send typing indicator: {e}")
+                return
+            await asyncio.sleep(TYPING_INTERVAL_SECONDS)
 
     async def on_members_added_activity(
         self, members_added: ChannelAccount, turn_context: TurnContext
     ):
-        with self.chat_metric.labels("on_members_added").time():
+        with timed(self.chat_metric.labels("on_members_added")):
             for member_added in members_added:
                 if member_added.id != turn_context.activity.recipient.id:
                     await turn_context.send_activity("Hello and welcome!")
@@ -142,13 +283,24 @@ def azure_app_create(app: web.Application, config: ServiceConfig) -> web.Applica
     app[keys.botsettings] = BotFrameworkAdapterSettings(
         config.bot.app_id, config.bot.app_password.get_secret_value()
     )
-    app[keys.botadapter] = BotFrameworkAdapter(app[keys.botsettings])
+    registry = REGISTRY if keys.metrics not in app else app[keys.metrics]
+
+    app[keys.botadapter] = TracedBotFrameworkAdapter(
+        app[keys.botsettings], app.get(keys.tracer) or Tracer()
+    )
 
     app[keys.botadapter].on_turn_error = on_error
 
-    registry = REGISTRY if keys.metrics not in app else app[keys.metrics]
+    app[keys.bot] = AzureBot(
+        app,
+        max_concurrent_downloads=config.myai.files.max_concurrent_downloads,
+        registry=registry,
+    )
 
-    app[keys.bot] = AzureBot(app, registry=registry)
+    app[keys.botworkers] = BotWorkers(
+        app, config.bot, app[keys.bot].on_turn, registry=registry
+    )
+    app.cleanup_ctx.append(bot_workers_cleanup)
 
     app.add_routes([web.view(config.bot.api_path, AzureBotView)])
     logger.info(
@@ -1,9 +1,11 @@
 from aiohttp import web
 from aiohttp.web import Response, json_response, Request
-from chatbot.service.state import Events
+from chatbot.service.state import Events, overloaded, overloadedResponse
 from pydantic import BaseModel, ValidationError
 import logging
-from botbuilder.schema import Activity, ActivityTypes
+from botbuilder.core import BotFrameworkAdapter
+from botbuilder.schema import Activity, ActivityTypes, DeliveryModes
+from chatbot.azurebot.workers import BotWorkers, authenticate
 from chatbot import keys
 from http import HTTPStatus
 
@@ -31,7 +33,7 @@ class AzureBotView(web.View):
         }
 
         reply = json_response(status=HTTPStatus.OK, headers=headers)
-        print(f"Reply: {reply}")
+        logger.debug(f"Reply: {reply}")
         return reply
 
     async def post(self) -> Response:
@@ -51,10 +53,36 @@ class AzureBotView(web.View):
         )
         logger.debug(f"Activity: {activity}")
 
-        response = await req.app[keys.botadapter].process_activity(
-            activity, auth_header, req.app[keys.bot].on_turn
-        )
-        logger.debug(f"Response: {response}")
-        if response:
-            return json_response(data=response.body, status=response.status)
-        return Response(status=201)
+        # Only messages start a chat turn, other activities are cheap and always handled
+        if activity.type == ActivityTypes.message and (reason := overloaded(req.app)):
+            return overloadedResponse(req.app, reason)
+
+        adapter: BotFrameworkAdapter = req.app[keys.botadapter]
+        workers: BotWorkers = req.app[keys.botworkers]
+
+        # Invokes and expectReplies carry the reply in the response so are processed inline
+        if (
+            activity.type == ActivityTypes.invoke
+            or activity.delivery_mode == DeliveryModes.expect_replies
+        ):
+            events: Events = req.app[keys.events]
+            with events.turn():
+                response = await adapter.process_activity(
+                    activity, auth_header, req.app[keys.bot].on_turn
+                )
+            logger.debug(f"Response: {response}")
+            if response:
+                return json_response(data=response.body, status=response.status)
+            return Response(status=201)
+
+        try:
+            identity = await authenticate(adapter.settings, activity, auth_header)
+        except PermissionError:
+            return Response(status=HTTPStatus.UNAUTHORIZED)
+
+        # Acknowledge at once, the reply is sent when a worker has processed the activity
+        if workers.is_duplicate(activity):
+            return Response(status=HTTPStatus.OK)
+        if not workers.submit(activity, identity):
+            return overloadedResponse(req.app, "bot_queue")
+        return Response(status=HTTPStatus.OK)
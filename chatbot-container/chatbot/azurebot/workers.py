@@ -0,0 +1,154 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+
+from aiohttp import web
+from botbuilder.core import BotFrameworkAdapterSettings, TurnContext
+from botbuilder.schema import Activity
+from botframework.connector.auth import ClaimsIdentity, JwtTokenValidation
+from chatbot import keys
+from chatbot.config import BotConfig
+from chatbot.llmconversationhandler.cache import TTLCache
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+
+# Activity IDs remembered for deduplication
+DEDUPE_MAX_SIZE = 10000
+
+
+class BotWorkers:
+    """
+    Bounded pool of workers processing bot activities after the request delivering them
+    has been acknowledged, so long turns do not run into the channel timeout and get
+    retried. Replies are sent through the Bot Connector to the conversation of the activity
+    rather than in the response to the request.
+
+    Activities the channel retries are recognised by their ID and processed once.
+    """
+
+    def __init__(
+        self,
+        app: web.Application,
+        config: BotConfig,
+        logic: Callable[[TurnContext], Awaitable],
+        registry: CollectorRegistry | None = REGISTRY,
+    ):
+        self.app = app
+        self.config = config
+        self.logic = logic
+        self.queue: asyncio.Queue[tuple[Activity, ClaimsIdentity]] = asyncio.Queue(
+            maxsize=config.queue_size
+        )
+        self.seen = TTLCache(config.dedupe_ttl, DEDUPE_MAX_SIZE)
+        self.tasks: list[asyncio.Task] = []
+
+        self.activities_metric = Counter(
+            "bot_activities",
+            "Activities received by the bot by what was done with them",
+            ["result"],
+            registry=registry,
+        )
+        self.queue_metric = Gauge(
+            "bot_activity_queue",
+            "Acknowledged activities waiting for a worker",
+            registry=registry,
+        )
+
+    def is_duplicate(self, activity: Activity) -> bool:
+        """Whether the activity was already received, remembering it if not"""
+        if not activity.id:
+            return False
+        key = activity_key(activity)
+        found, _ = self.seen.get(key)
+        if found:
+            logger.info(f"Ignoring retried activity {activity.id}")
+            self.activities_metric.labels("duplicate").inc()
+            return True
+        self.seen.put(key, True)
+        return False
+
+    def submit(self, activity: Activity, identity: ClaimsIdentity) -> bool:
+        """Queue the activity for processing, False if the queue is full"""
+        try:
+            self.queue.put_nowait((activity, identity))
+        except asyncio.QueueFull:
+            self.activities_metric.labels("rejected").inc()
+            # Let the channel retry it once there is room
+            self.seen.entries.pop(activity_key(activity), None)
+            return False
+        self.activities_metric.labels("queued").inc()
+        self.queue_metric.set(self.queue.qsize())
+        return True
+
+    def start(self):
+        self.tasks = [
+            asyncio.create_task(self._work(), name=f"bot-worker-{index}")
+            for index in range(self.config.workers)
+        ]
+
+    async def stop(self):
+        """Finish the queued activities within the drain timeout, then stop the workers"""
+        try:
+            async with asyncio.timeout(self.config.drain_timeout.total_seconds()):
+                await self.queue.join()
+        except TimeoutError:
+            logger.warning(
+                f"Bot: {self.queue.qsize()} activities left unprocessed at shutdown"
+            )
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _work(self):
+        while True:
+            activity, identity = await self.queue.get()
+            self.queue_metric.set(self.queue.qsize())
+            try:
+                with self.app[keys.events].turn():
+                    await self.app[keys.botadapter].process_activity_with_identity(
+                        activity, identity, self.logic
+                    )
+                self.activities_metric.labels("processed").inc()
+            except Exception as e:
+                # Errors in the bot logic are reported to the user by the adapter on_turn_error
+                logger.error(f"Bot: processing activity {activity.id} failed: {e!r}")
+                self.activities_metric.labels("failed").inc()
+            finally:
+                self.queue.task_done()
+
+
+async def authenticate(
+    settings: BotFrameworkAdapterSettings, activity: Activity, auth_header: str
+) -> ClaimsIdentity:
+    """
+    The identity of the channel delivering the activity, validated from the request as the
+    adapter validates it when processing an activity.
+    Raises PermissionError if the request is not authorized.
+    """
+    claims = await JwtTokenValidation.authenticate_request(
+        activity,
+        auth_header,
+        settings.credential_provider,
+        await settings.channel_provider.get_channel_service(),
+        settings.auth_configuration,
+    )
+    if not claims.is_authenticated:
+        raise PermissionError("Request is not authorized")
+    return claims
+
+
+def activity_key(activity: Activity) -> tuple[str | None, str]:
+    """Activity IDs are only unique within a conversation on some channels"""
+    return (activity.conversation.id if activity.conversation else None, activity.id)
+
+
+async def bot_workers_cleanup(app: web.Application):
+    """
+    Run the bot workers for the lifetime of the app
+    """
+    app[keys.botworkers].start()
+    yield
+    await app[keys.botworkers].stop()
@@ -1,6 +1,14 @@
 from .tool import ToolBoxConfig, ToolConfig
 from chatbot.hams.config import HamsConfig
-from pydantic import ConfigDict, Field, BaseModel, SecretStr, field_validator, HttpUrl
+from pydantic import (
+    ConfigDict,
+    Field,
+    BaseModel,
+    SecretStr,
+    field_validator,
+    model_validator,
+    HttpUrl,
+)
 from pydantic_settings import BaseSettings, YamlConfigSettingsSource
 from pydantic_file_secrets import FileSecretsSettingsSource
 from pathlib import Path
@@ -13,6 +21,7 @@ from datetime import timedelta
 
 
 import os
+import tempfile
 
 
 class BotConfig(BaseModel):
@@ -32,6 +41,24 @@ class BotConfig(BaseModel):
         # default=DefaultConfig.APP_PASSWORD,
         description="Microsoft App Password",
     )
+    workers: int = Field(
+        default=8,
+        ge=1,
+        description="Activities processed concurrently in the background after being acknowledged",
+    )
+    queue_size: int = Field(
+        default=100,
+        ge=1,
+        description="Acknowledged activities that may wait for a worker, further activities are rejected with 503",
+    )
+    dedupe_ttl: timedelta = Field(
+        default=timedelta(minutes=10),
+        description="Time activity IDs are remembered so activities retried by the channel are processed once",
+    )
+    drain_timeout: timedelta = Field(
+        default=timedelta(seconds=10),
+        description="Time given on shutdown to finish the activities already acknowledged",
+    )
 
 
 # TODO: Look here in future: https://github.com/pydantic/pydantic/discussions/2928#discussioncomment-4744841
@@ -44,6 +71,65 @@ class WebServerConfig(BaseModel):
     prefix: str = Field(description="Prefix for the name of the resources")
 
 
+class HttpClientConfig(BaseModel):
+    """
+    Configuration for the shared outbound HTTP connection pools
+    """
+
+    pool_size: int = Field(
+        default=100, description="Maximum number of open connections in the pool"
+    )
+    per_host: int = Field(
+        default=20, description="Maximum number of open connections to a single host"
+    )
+    keepalive: timedelta = Field(
+        default=timedelta(seconds=30),
+        description="Time idle connections are kept open for reuse",
+    )
+    max_keepalive: int | None = Field(
+        default=None,
+        description="Maximum number of idle connections the model client keeps open for reuse, the pool size if not set",
+    )
+    timeout: timedelta = Field(
+        default=timedelta(seconds=60), description="Total timeout for a request"
+    )
+
+
+class TracingConfig(BaseModel):
+    """
+    Tracing of the steps of chat turns. Span latencies are always recorded as metrics, the
+    exporter selects where the OpenTelemetry spans are sent
+    """
+
+    exporter: Literal["none", "global", "console", "file", "otlp"] = Field(
+        default="none",
+        description="Where spans are exported: nowhere, the globally configured OpenTelemetry tracer provider, the console, a file of JSON spans or an OTLP collector",
+    )
+    path: Path | None = Field(
+        default=None, description="File the spans are appended to by the file exporter"
+    )
+    endpoint: HttpUrl | None = Field(
+        default=None,
+        description="OTLP/HTTP traces endpoint, defaults to the OTEL_EXPORTER_OTLP_* environment",
+    )
+    service_name: str = Field(
+        default="chatbot", description="Service name of the exported spans"
+    )
+    sample_ratio: float = Field(
+        default=1.0,
+        ge=0,
+        le=1,
+        description="Fraction of turns whose spans are exported",
+    )
+
+    @model_validator(mode="after")
+    def validate_exporter_settings(self) -> Self:
+        """Validate that the file exporter has a path"""
+        if self.exporter == "file" and self.path is None:
+            raise ValueError("path is required when exporter is 'file'")
+        return self
+
+
 # Define a timing object to capture time between event processing
 class EventConfig(BaseModel):
     """
@@ -55,6 +141,36 @@ class EventConfig(BaseModel):
     )
     chunkDuration: timedelta = Field(description="Duration of events")
     checkTime: timedelta = Field(description="Time between checking for new events")
+    maxTurns: int = Field(
+        default=50,
+        ge=1,
+        description="Chat turns in flight after which the service takes no more load",
+    )
+    maxQueuedRequests: int = Field(
+        default=20,
+        ge=1,
+        description="LLM calls waiting for the rate limiter after which the service takes no more load",
+    )
+    maxLoopLag: timedelta = Field(
+        default=timedelta(milliseconds=500),
+        description="Event loop lag after which the service takes no more load",
+    )
+    lagInterval: timedelta = Field(
+        default=timedelta(milliseconds=250),
+        description="Time between measurements of the event loop lag",
+    )
+    blockingDebug: bool = Field(
+        default=False,
+        description="Log the stack of callbacks holding the event loop past the blocking threshold, can be switched through HaMS",
+    )
+    blockingThreshold: timedelta = Field(
+        default=timedelta(milliseconds=100),
+        description="Time a callback may hold the event loop before it is reported in blocking debug mode",
+    )
+    retryAfter: timedelta = Field(
+        default=timedelta(seconds=1),
+        description="Retry-After sent with requests rejected when the service is over capacity",
+    )
 
 
 class AIPromptConfig(BaseModel):
@@ -63,6 +179,189 @@ class AIPromptConfig(BaseModel):
     )
 
 
+class CheckpointerConfig(BaseModel):
+    """
+    Configuration for the conversation checkpointer (storage of conversation state between turns)
+    """
+
+    backend: Literal["memory", "sqlite"] = Field(
+        default="memory",
+        description="Storage backend: 'memory' (per pod) or 'sqlite' (file backed, survives restarts when on a volume)",
+    )
+    path: Path | None = Field(
+        default=None,
+        description="Path of the SQLite database file, required for the sqlite backend",
+    )
+    max_threads: int = Field(
+        default=1000,
+        description="Maximum number of conversations retained, least recently used are evicted first",
+    )
+    idle_ttl: timedelta = Field(
+        default=timedelta(hours=24),
+        description="Conversations idle for longer than this are evicted",
+    )
+    max_bytes: int = Field(
+        default=256 * 1024 * 1024,
+        description="Cap on the stored size of all conversations, least recently used are evicted to stay below it",
+    )
+    max_checkpoints_per_thread: int = Field(
+        default=4,
+        ge=2,
+        description="Number of most recent checkpoints kept per conversation, older history is pruned",
+    )
+
+    @model_validator(mode="after")
+    def validate_backend_settings(self) -> Self:
+        """Validate that the sqlite backend has somewhere to store its data"""
+        if self.backend == "sqlite" and self.path is None:
+            raise ValueError("path is required when checkpointer backend is 'sqlite'")
+        return self
+
+
+class ContextConfig(BaseModel):
+    """
+    Configuration for fitting the conversation history into the model context window
+    """
+
+    reserve_tokens: int = Field(
+        default=1024,
+        description="Tokens of the context length kept free for the model response",
+    )
+    summarise: bool = Field(
+        default=True,
+        description="Summarise turns dropped from the context instead of discarding them",
+    )
+    drop_consumed_files: bool = Field(
+        default=True,
+        description="Replace uploaded file payloads with a placeholder once the model has answered them",
+    )
+    chars_per_token: float = Field(
+        default=4.0,
+        description="Characters per token used to estimate message sizes",
+    )
+
+
+class FileStoreConfig(BaseModel):
+    """
+    Configuration for storage of files uploaded to conversations
+    """
+
+    path: Path = Field(
+        default=Path(tempfile.gettempdir()) / "chatbot-files",
+        description="Directory holding uploaded files, named by the SHA-256 of their content",
+    )
+    max_file_bytes: int = Field(
+        default=20 * 1024 * 1024,
+        description="Largest file accepted, larger uploads are rejected while downloading",
+    )
+    max_bytes: int = Field(
+        default=1024 * 1024 * 1024,
+        description="Total size of the store, least recently used files no conversation refers to are evicted first",
+    )
+    encoded_cache_bytes: int = Field(
+        default=64 * 1024 * 1024,
+        description="Memory used to keep the base64 encoding of recently sent files",
+    )
+    chunk_size: int = Field(
+        default=64 * 1024, description="Size of the chunks files are downloaded in"
+    )
+    max_concurrent_downloads: int = Field(
+        default=4, description="Maximum number of attachments downloaded at once"
+    )
+
+
+class ResponseCacheConfig(BaseModel):
+    """
+    Configuration for the cache of replies to repeated prompts
+    """
+
+    enabled: bool = Field(
+        default=False,
+        description="Whether replies are cached, cached replies ignore the earlier conversation so only enable for bots answering standalone questions",
+    )
+    mode: Literal["exact", "semantic"] = Field(
+        default="exact",
+        description="Match prompts exactly once normalised, or also by embedding similarity",
+    )
+    ttl: timedelta = Field(
+        default=timedelta(minutes=10),
+        description="Time to cache replies for, reduced to the shortest cache_ttl of the tools used",
+    )
+    max_size: int = Field(default=1000, description="Maximum number of cached replies")
+    similarity: float = Field(
+        default=0.95,
+        ge=0,
+        le=1,
+        description="Cosine similarity needed for a semantic match",
+    )
+    embedding_model: str | None = Field(
+        default=None,
+        description="Embedding model of the model provider used in semantic mode",
+    )
+
+    @model_validator(mode="after")
+    def validate_mode_settings(self) -> Self:
+        """Validate that semantic mode has an embedding model"""
+        if self.mode == "semantic" and self.embedding_model is None:
+            raise ValueError("embedding_model is required when mode is 'semantic'")
+        return self
+
+
+class TurnQueueConfig(BaseModel):
+    """
+    Serialisation of the turns of each conversation
+    """
+
+    max_pending: int = Field(
+        default=10,
+        ge=1,
+        description="Prompts that may wait for the turn of a conversation, further prompts are rejected",
+    )
+    coalesce_max: int = Field(
+        default=5,
+        ge=1,
+        description="Most waiting prompts answered together in one turn",
+    )
+    coalesce_window: timedelta = Field(
+        default=timedelta(0),
+        description="Time a turn waits for further rapid fire prompts before starting",
+    )
+
+
+class ModelPriceConfig(BaseModel):
+    """
+    Price of the tokens of a model, used to estimate the cost of model calls
+    """
+
+    input: float = Field(ge=0, description="Price of a million prompt tokens")
+    output: float = Field(ge=0, description="Price of a million completion tokens")
+    cached_input: float | None = Field(
+        default=None,
+        ge=0,
+        description="Price of a million prompt tokens read from the provider prompt cache, the prompt price if not set",
+    )
+
+
+class UsageConfig(BaseModel):
+    """
+    Accounting of the tokens used by each model and identity, and daily token budgets
+    """
+
+    prices: dict[str, ModelPriceConfig] = Field(
+        default_factory=dict,
+        description="Token prices by model (or deployment), calls of models without a price are not costed",
+    )
+    daily_tokens: int | None = Field(
+        default=None,
+        ge=1,
+        description="Tokens each identity may use per day (UTC), unlimited if not set",
+    )
+    identity_daily_tokens: dict[str, int] = Field(
+        default_factory=dict,
+        description="Daily token budgets of particular identities, overriding daily_tokens",
+    )
+
+
 class MyAiConfig(BaseModel):
     """
     Configuration for the MyAI bot
@@ -76,6 +375,126 @@ class MyAiConfig(BaseModel):
         description="Default configuration for tool execution, including limits and enabled status",
     )
 
+    checkpointer: CheckpointerConfig = Field(
+        default_factory=CheckpointerConfig,
+        description="Storage of conversation state between turns",
+    )
+
+    context: ContextConfig = Field(
+        default_factory=ContextConfig,
+        description="Management of the conversation history sent to the model",
+    )
+
+    files: FileStoreConfig = Field(
+        default_factory=FileStoreConfig,
+        description="Storage of files uploaded to conversations",
+    )
+
+    response_cache: ResponseCacheConfig = Field(
+        default_factory=ResponseCacheConfig,
+        description="Cache of replies to repeated prompts",
+    )
+
+    turns: TurnQueueConfig = Field(
+        default_factory=TurnQueueConfig,
+        description="Serialisation of the turns of each conversation",
+    )
+
+    usage: UsageConfig = Field(
+        default_factory=UsageConfig,
+        description="Token and cost accounting, and daily token budgets",
+    )
+
+
+class ModelTierConfig(BaseModel):
+    """
+    A model the router can send turns to. Tiers are listed cheapest first and the last tier
+    is the flagship model used for everything the cheaper tiers do not fit.
+    """
+
+    name: str = Field(description="Name of the tier, used in logs and metrics")
+    model: str = Field(description="Model of the model provider used by the tier")
+    max_prompt_tokens: int | None = Field(
+        default=None,
+        description="Largest user prompt routed to the tier, no limit when not set",
+    )
+    max_context_tokens: int | None = Field(
+        default=None,
+        description="Largest conversation (system prompt, summary and history) routed to the tier, no limit when not set",
+    )
+
+
+class FallbackModelConfig(BaseModel):
+    """
+    A model of another provider that calls fail over to, using the credentials of that
+    provider from the aiclient configuration
+    """
+
+    model_provider: Literal["azure_openai", "google_genai"] = Field(
+        description="Provider of the fallback model"
+    )
+    model: str = Field(description="The model (or deployment) of the provider")
+
+
+class ResilienceConfig(BaseModel):
+    """
+    Retries, circuit breaking, failover and hedging of model calls
+    """
+
+    max_retries: int = Field(
+        default=2,
+        ge=0,
+        description="Retries of a call failing with a timeout, 429 or 5xx before failing over",
+    )
+    backoff: timedelta = Field(
+        default=timedelta(milliseconds=500),
+        description="Delay before the first retry, doubled (with jitter) on each retry",
+    )
+    backoff_max: timedelta = Field(
+        default=timedelta(seconds=8), description="Longest delay between retries"
+    )
+    failure_threshold: int = Field(
+        default=5,
+        ge=1,
+        description="Consecutive failures of a provider opening its circuit",
+    )
+    reset_timeout: timedelta = Field(
+        default=timedelta(seconds=30),
+        description="Time a circuit stays open before a call is let through again",
+    )
+    fallbacks: list[FallbackModelConfig] = Field(
+        default=[],
+        description="Models calls fail over to, in order, when the primary provider fails or its circuit is open",
+    )
+    hedge: bool = Field(
+        default=False,
+        description="Send a second request when a call has not answered within the p95 latency of the provider. Hedged calls are not streamed",
+    )
+    hedge_min_delay: timedelta = Field(
+        default=timedelta(seconds=1),
+        description="Shortest delay before a request is hedged",
+    )
+
+
+class RateLimitConfig(BaseModel):
+    """
+    Client side limits of the model deployment quota
+    """
+
+    requests_per_minute: int | None = Field(
+        default=None, ge=1, description="Requests per minute, no limit when not set"
+    )
+    tokens_per_minute: int | None = Field(
+        default=None,
+        ge=1,
+        description="Prompt and response tokens per minute, no limit when not set",
+    )
+    max_queue: int = Field(
+        default=100,
+        ge=1,
+        description="Model calls that may wait for the limiter, further calls fail",
+    )
+
 
 class LangchainConfig(BaseModel):
     """
@@ -88,7 +507,7 @@ class LangchainConfig(BaseModel):
 
     httpx_verify_ssl: str | bool = Field(
         default=True,
-        description="Whether to verify SSL certificates for HTTP requests, can be a boolean or a path to a CA bundle",
+        description="Whether to verify SSL certificates for HTTP requests, can be a boolean or a path to a CA bundle. Applies to Azure OpenAI only, Gemini connects over gRPC",
     )
 
     # Azure OpenAI settings
@@ -144,6 +563,26 @@ class LangchainConfig(BaseModel):
         default=True, description="Whether to stream responses from the model"
     )
 
+    models: list[ModelTierConfig] = Field(
+        default=[],
+        description="Models to route turns between, cheapest first. When empty every turn uses model",
+    )
+
+    prompt_cache_key: bool = Field(
+        default=False,
+        description="Send a prompt_cache_key derived from the system prompt so Azure OpenAI routes requests sharing it to the same prompt cache, requires an api version supporting it",
+    )
+
+    resilience: ResilienceConfig = Field(
+        default_factory=ResilienceConfig,
+        description="Retries, circuit breaking, failover and hedging of model calls",
+    )
+
+    rate_limit: RateLimitConfig = Field(
+        default_factory=RateLimitConfig,
+        description="Client side rate limits of the model deployment",
+    )
+
     model_config = ConfigDict(extra="forbid")
 
     @field_validator("model_provider")
@@ -176,8 +615,16 @@ class ServiceConfig(BaseSettings):
     myai: MyAiConfig = Field(description="MyAI bot configuration")
 
     webservice: WebServerConfig = Field(description="Web server configuration")
+    http: HttpClientConfig = Field(
+        default_factory=HttpClientConfig,
+        description="Outbound HTTP connection pool configuration",
+    )
     hams: HamsConfig = Field(description="Health and monitoring configuration")
     events: EventConfig = Field(description="Process costs for events")
+    tracing: TracingConfig = Field(
+        default_factory=TracingConfig,
+        description="Tracing of the steps of chat turns",
+    )
 
     model_config = {
         "secrets_nested_subdir": True  # Prevents additional fields not defined in the model
@@ -20,6 +20,30 @@ class McpConfig(BaseModel):
     transport: TransportEnum
     prompts: list[str] = []
 
+    timeout: timedelta = Field(
+        default=timedelta(seconds=10),
+        description="Time allowed to discover the tools, resources and prompts of the server, to wait for a session and for health checks",
+    )
+
+    sessions: int = Field(
+        default=2, ge=1, description="Number of long lived sessions held to the server"
+    )
+
+    health_interval: timedelta = Field(
+        default=timedelta(seconds=30),
+        description="Interval between pings checking each session is healthy",
+    )
+
+    reconnect_backoff: timedelta = Field(
+        default=timedelta(seconds=1),
+        description="Initial delay before reconnecting a failed session, doubled on each failure",
+    )
+
+    reconnect_backoff_max: timedelta = Field(
+        default=timedelta(seconds=60),
+        description="Maximum delay before reconnecting a failed session",
+    )
+
 
 class ToolConfig(BaseModel):
     """Configuration for tool execution."""
@@ -40,6 +64,21 @@ class ToolConfig(BaseModel):
         description="Current count of running instances for each tool",
     )
 
+    cacheable: bool = Field(
+        default=True,
+        description="Whether results may be cached, set false for tools with side effects",
+    )
+
+    cache_ttl: timedelta | None = Field(
+        default=None,
+        description="Time to cache results of identical calls for, caching is disabled when not set",
+    )
+
+    cache_size: int = Field(
+        default=256,
+        description="Maximum number of cached results for the tool",
+    )
+
 
 class ToolBoxConfig(BaseModel):
     """Configuration for tool execution."""
@@ -52,3 +91,8 @@ class ToolBoxConfig(BaseModel):
     )
 
     mcps: list[McpConfig] = Field(description="MCP configuration")
+
+    refresh_interval: timedelta | None = Field(
+        default=timedelta(minutes=5),
+        description="Interval between refreshes of the MCP tool catalogue, refresh is disabled when not set",
+    )
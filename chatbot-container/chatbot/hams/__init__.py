@@ -6,8 +6,7 @@ import signal
 import asyncio
 from prometheus_async import aio
 from prometheus_client import REGISTRY, CollectorRegistry, Counter
-from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
-from prometheus_client import Summary
+from prometheus_client.exposition import choose_encoder
 from prometheus_client import Info
 import importlib.metadata
 
@@ -39,12 +38,12 @@ async def hams_app_cleanup(app: web.Application):
 
     logger.info("Executing startup scripts")
     logger.debug(f"prestart = {app[keys.config].hams.checks}")
-    await app[keys.config].hams.checks.run_preflights()
+    await app[keys.config].hams.checks.run_preflights(app.get(keys.http_session))
 
     yield
 
     logger.info("HaMS: cleaning up")
-    await app[keys.config].hams.checks.run_shutdowns()
+    await app[keys.config].hams.checks.run_shutdowns(app.get(keys.http_session))
     await runner.cleanup()
 
 
@@ -71,12 +70,11 @@ class CustomMetricsView(web.View):
     async def get(self):
         metrics: CollectorRegistry = self.request.app[keys.metrics]
 
-        global_metrics = generate_latest(REGISTRY)
-        custom_metrics = generate_latest(metrics)
+        # OpenMetrics (which carries the exemplars) when the scraper asks for it
+        encoder, content_type = choose_encoder(self.request.headers.get("Accept", ""))
 
         return web.Response(
-            body=global_metrics + custom_metrics,
-            # content_type=CONTENT_TYPE_LATEST,
+            body=encoder(metrics), headers={"Content-Type": content_type}
         )
 
 
@@ -89,6 +87,47 @@ class MonitorView(web.View):
         return web.json_response(response, status=200)
 
 
+class LoopLagView(web.View):
+    """
+    Event loop lag and the recent reports of callbacks blocking the loop.
+    POST {"debug": true|false} switches blocking debug mode on or off.
+    """
+
+    async def get(self):
+        hams: Hams = self.request.app[keys.hams]
+        monitor = hams.app[keys.events].loopLag
+
+        response = {
+            "lag": monitor.lag,
+            "debug": monitor.debug,
+            "threshold": monitor.threshold,
+            "reports": list(monitor.reports),
+        }
+        return web.json_response(response, status=200)
+
+    async def post(self):
+        hams: Hams = self.request.app[keys.hams]
+        monitor = hams.app[keys.events].loopLag
+
+        try:
+            debug = (await self.request.json())["debug"]
+        except (ValueError, KeyError, TypeError):
+            return web.json_response(
+                {"error": "Expected a JSON body with a boolean 'debug'"}, status=400
+            )
+        if not isinstance(debug, bool):
+            return web.json_response(
+                {"error": "Expected a JSON body with a boolean 'debug'"}, status=400
+            )
+
+        try:
+            monitor.setDebug(debug)
+        except RuntimeError as e:
+            return web.json_response({"error": str(e)}, status=409)
+
+        return web.json_response({"debug": monitor.debug}, status=200)
+
+
 class ShutdownView(web.View):
     async def post(self):
 
@@ -136,7 +175,12 @@ class Hams:
         return True
 
     def ready(self) -> bool:
-        return self.app[keys.events].spareCapacity()
+        queuedRequests = (
+            self.app[keys.llmhandler].rate_limiter.queued
+            if keys.llmhandler in self.app
+            else 0
+        )
+        return self.app[keys.events].spareCapacity(queuedRequests)
 
 
 def hams_app_create(base_app: web.Application, config: HamsConfig) -> web.Application:
@@ -162,6 +206,7 @@ def hams_app_create(base_app: web.Application, config: HamsConfig) -> web.Applic
             web.view(f"/{hams.config.prefix}/ready", ReadyView),
             web.view(f"/{hams.config.prefix}/monitor", MonitorView),
             web.view(f"/{hams.config.prefix}/custommetrics", CustomMetricsView),
+            web.view(f"/{hams.config.prefix}/looplag", LoopLagView),
             web.view(f"/{hams.config.prefix}/metrics", aio.web.server_stats),
             web.view(f"/{hams.config.prefix}/shutdown", ShutdownView),
         ]
@@ -18,12 +18,12 @@ class HamsCheck(ABC, BaseModel):
     name: str = Field(description="Name of the check")
     description: str = Field(description="Description of the check")
 
-    async def check(self) -> bool:
+    async def check(self, session: aiohttp.ClientSession | None = None) -> bool:
         """
         Safe check to run the check
         """
         try:
-            check_response = await self.run_check()
+            check_response = await self.run_check(session)
             logger.info(
                 f"Check[{self.name}]: {"PASSED" if check_response else "FAILED"}"
             )
@@ -34,7 +34,7 @@ class HamsCheck(ABC, BaseModel):
             return False
 
     @abstractmethod
-    async def run_check(self) -> bool:
+    async def run_check(self, session: aiohttp.ClientSession | None = None) -> bool:
         pass
 
 
@@ -54,16 +54,22 @@ class HttpCheck(HamsCheck):
         default=HttpMethodEnum.get, description="HTTP method to use"
     )
 
-    async def run_check(self) -> bool:
+    async def run_check(self, session: aiohttp.ClientSession | None = None) -> bool:
         logger.debug(f"HttpCheck[{self.name}]: {self.http} == {self.returncode}")
 
-        async with aiohttp.ClientSession() as session:
-            if self.method == HttpMethodEnum.get:
-                async with session.get(str(self.http)) as response:
-                    return response.status == self.returncode
-            elif self.method == HttpMethodEnum.post:
-                async with session.post(str(self.http)) as response:
-                    return response.status == self.returncode
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                return await self.request(session)
+
+        return await self.request(session)
+
+    async def request(self, session: aiohttp.ClientSession) -> bool:
+        if self.method == HttpMethodEnum.get:
+            async with session.get(str(self.http)) as response:
+                return response.status == self.returncode
+        elif self.method == HttpMethodEnum.post:
+            async with session.post(str(self.http)) as response:
+                return response.status == self.returncode
 
 
 CheckType = HttpCheck  # Replaced Union[HttpCheck] with HttpCheck as it's the only type
@@ -83,7 +89,9 @@ class HamsChecks(BaseModel):
     preflights: list[CheckType] = Field(description="Preflight checks")
     shutdowns: list[CheckType] = Field(description="Shutdown checks")
 
-    async def run_checks(self, checks: list[CheckType]) -> bool:
+    async def run_checks(
+        self, checks: list[CheckType], session: aiohttp.ClientSession | None = None
+    ) -> bool:
         """
         Run the checks with timeouts and fail counting
         Will reply True if all checks pass
@@ -91,7 +99,7 @@ class HamsChecks(BaseModel):
         """
         remaining_attempts = self.fails
         while remaining_attempts > 0:
-            if all([await check.check() for check in checks]):
+            if all([await check.check(session) for check in checks]):
                 return True
             remaining_attempts -= 1
             if remaining_attempts > 0:
@@ -101,11 +109,11 @@ class HamsChecks(BaseModel):
 
         raise Exception("Checks failed")
 
-    async def run_preflights(self):
-        results = await self.run_checks(self.preflights)
+    async def run_preflights(self, session: aiohttp.ClientSession | None = None):
+        results = await self.run_checks(self.preflights, session)
 
-    async def run_shutdowns(self):
-        results = await self.run_checks(self.shutdowns)
+    async def run_shutdowns(self, session: aiohttp.ClientSession | None = None):
+        results = await self.run_checks(self.shutdowns, session)
 
 
 class HamsConfig(BaseModel):
@@ -0,0 +1,46 @@
+import logging
+
+import aiohttp
+from aiohttp import web
+from chatbot import keys
+from chatbot.config import HttpClientConfig, ServiceConfig
+
+logger = logging.getLogger(__name__)
+
+
+def create_client_session(config: HttpClientConfig) -> aiohttp.ClientSession:
+    """
+    Create a client session with a connection pool sized from the configuration
+    """
+    connector = aiohttp.TCPConnector(
+        limit=config.pool_size,
+        limit_per_host=config.per_host,
+        keepalive_timeout=config.keepalive.total_seconds(),
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=config.timeout.total_seconds()),
+    )
+
+
+async def http_session_cleanup(app: web.Application):
+    """
+    Hold the shared client session open for the lifetime of the app
+    """
+    app[keys.http_session] = create_client_session(app[keys.config].http)
+    logger.info("HTTP: client session opened")
+
+    yield
+
+    await app[keys.http_session].close()
+    logger.info("HTTP: client session closed")
+
+
+def http_app_create(app: web.Application, config: ServiceConfig) -> web.Application:
+    """
+    Add the shared outbound HTTP session to the app.
+    This must be created before apps that use the session during startup (eg HaMS preflights)
+    """
+    app.cleanup_ctx.append(http_session_cleanup)
+
+    return app
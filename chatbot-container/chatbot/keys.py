@@ -10,9 +10,21 @@ webservice = aiohttp.web.AppKey("webservice")
 botsettings = aiohttp.web.AppKey("botsettings")
 botadapter = aiohttp.web.AppKey("botadapter")
 bot = aiohttp.web.AppKey("bot")
+botworkers = aiohttp.web.AppKey("botworkers")
+
+# Shared outbound HTTP connection pools
+http_session = aiohttp.web.AppKey("http_session")
+llm_http_client = aiohttp.web.AppKey("llm_http_client")
+llm_sync_http_client = aiohttp.web.AppKey("llm_sync_http_client")
 
 # The key for the Gemini service, used to store and retrieve Gemini-related data
 # and configurations in the aiohttp application context.
 llmhandler = aiohttp.web.AppKey("myai")
 
 mcpobjects = aiohttp.web.AppKey("mcptools")
+mcpclient = aiohttp.web.AppKey("mcpclient")
+mcpmetrics = aiohttp.web.AppKey("mcpmetrics")
+tool_refresher = aiohttp.web.AppKey("tool_refresher")
+
+# Spans of the steps of chat turns
+tracer = aiohttp.web.AppKey("tracer")
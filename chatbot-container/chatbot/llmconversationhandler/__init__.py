@@ -1,30 +1,57 @@
-import base64
+import asyncio
+import hashlib
+import json
 from typing import Any
-from collections.abc import Sequence, Callable  # For List and Callable
-from chatbot.config import MyAiConfig, ServiceConfig
+from collections.abc import AsyncIterator, Sequence, Callable  # For List and Callable
+from chatbot.config import LangchainConfig, MyAiConfig, ServiceConfig
 from aiohttp import web
 from chatbot import keys
 import logging
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
 from chatbot.llmconversationhandler import toolregistry
-from chatbot.mcp import MCPObjects
+from chatbot.llmconversationhandler.checkpointer import (
+    SqliteSaver,
+    create_checkpointer,
+)
+from chatbot.llmconversationhandler.context import ContextWindow, summary_message
+from chatbot.llmconversationhandler.ratelimit import RateLimiter
+from chatbot.llmconversationhandler.responsecache import ResponseCache
+from chatbot.llmconversationhandler.turnqueue import Turn, TurnQueue
+from chatbot.llmconversationhandler.usage import UsageLedger
+from chatbot.llmconversationhandler.resilience import (
+    ResilienceMetrics,
+    ResilienceState,
+    ResilientChatModel,
+)
+from chatbot.llmconversationhandler.filestore import (
+    FileStore,
+    StoredFile,
+    file_reference,
+)
+from chatbot.mcp import MCPObjects, rediscover
+from chatbot.metrics import LLM_LATENCY_BUCKETS, TOKEN_BUCKETS, timed
+from chatbot.tracing import Tracer
 from langchain_core.tools.structured import StructuredTool
 import langgraph
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.prebuilt import ToolNode, tools_condition
 from langchain_core.runnables import RunnableConfig
+from langchain_core.utils.function_calling import convert_to_openai_tool
 
 
 from langchain_core.messages import (
+    AnyMessage,
+    BaseMessage,
+    ToolMessage,
     HumanMessage,
     SystemMessage,
     AIMessage,
+    RemoveMessage,
 )
 from botbuilder.schema import ConversationAccount
 from langchain_core.language_models import BaseChatModel
+from langchain_core.embeddings import Embeddings
 
-from prometheus_client import REGISTRY, CollectorRegistry, Summary
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram
 from chatbot.tools import mytools
 from langchain.chat_models import init_chat_model
 import httpx
@@ -54,52 +81,254 @@ async def bind_tools_when_ready(app: web.Application):
     mcpObjects: MCPObjects = app[keys.mcpobjects]
 
     llmHandler.register_tools(mcpObjects.tools)
+    llmHandler.mcp_tool_names = {tool.name for tool in mcpObjects.tools}
+    llmHandler.mcp_prompts = mcpObjects.prompts
 
     llmHandler.bind_tools()
 
     llmHandler.compile()
 
+    refresh_interval = app[keys.config].myai.toolbox.refresh_interval
+    if refresh_interval and app[keys.config].myai.toolbox.mcps:
+        app[keys.tool_refresher] = asyncio.create_task(
+            refresh_tools(app, refresh_interval.total_seconds())
+        )
+
+
+async def refresh_tools(app: web.Application, interval: float):
+    """
+    Periodically rediscover the MCP tools and update the graph when the catalogue changes
+    """
+    llmHandler: LLMConversationHandler = app[keys.llmhandler]
+
+    logger.info(f"Tool refresh: every {interval}s")
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            mcpObjects = await rediscover(app)
+            llmHandler.update_tools(mcpObjects.tools)
+            llmHandler.update_prompts(mcpObjects.prompts)
+        except Exception as e:
+            llmHandler.tool_refresh_metric.labels("failed").inc()
+            logger.error(f"Tool refresh failed: {e!r}")
+
+
+async def stop_tool_refresher(app: web.Application):
+    """
+    Stop the tool refresher on shutdown
+    """
+    if keys.tool_refresher in app:
+        app[keys.tool_refresher].cancel()
+
+
+async def close_checkpointer(app: web.Application):
+    """
+    Release the checkpointer storage on shutdown
+    """
+    llmHandler: LLMConversationHandler = app[keys.llmhandler]
+
+    if isinstance(llmHandler.memory, SqliteSaver):
+        llmHandler.memory.close()
+
+
+async def close_llm_http_client(app: web.Application):
+    """
+    Close the pooled connections to the model provider on shutdown
+    """
+    await app[keys.llm_http_client].aclose()
+    app[keys.llm_sync_http_client].close()
+
 
 def langchain_app_create(app: web.Application, config: ServiceConfig):
     """
     Initialize the AI client and add it to the aiohttp application context.
     """
     httpx_client = httpx.Client(verify=config.aiclient.httpx_verify_ssl)
+    # Long lived pool shared by all async model calls so connections (and TLS sessions) are reused
+    httpx_async_client = httpx.AsyncClient(
+        verify=config.aiclient.httpx_verify_ssl,
+        limits=httpx.Limits(
+            max_connections=config.http.pool_size,
+            max_keepalive_connections=config.http.max_keepalive
+            or config.http.pool_size,
+            keepalive_expiry=config.http.keepalive.total_seconds(),
+        ),
+        timeout=config.aiclient.timeout,
+    )
+    app[keys.llm_http_client] = httpx_async_client
+    app[keys.llm_sync_http_client] = httpx_client
+    app.on_cleanup.append(close_llm_http_client)
+
+    registry = REGISTRY if keys.metrics not in app else app[keys.metrics]
+
+    # Circuit breakers are per provider so are shared by all the tiers
+    resilience = ResilienceState(
+        config.aiclient.resilience, ResilienceMetrics(registry=registry)
+    )
+
+    # Cheapest first, the last tier is the flagship model
+    tiers = {
+        tier.name: create_resilient_model(
+            config.aiclient, tier.model, httpx_client, httpx_async_client, resilience
+        )
+        for tier in config.aiclient.models
+    }
+    model = (
+        list(tiers.values())[-1]
+        if tiers
+        else create_resilient_model(
+            config.aiclient,
+            config.aiclient.model,
+            httpx_client,
+            httpx_async_client,
+            resilience,
+        )
+    )
+
+    # use bind_tools_when_ready to move some of the constructions funtions to an async runtime
+    app.on_startup.append(bind_tools_when_ready)
+    app.on_cleanup.append(close_checkpointer)
+    app.on_cleanup.append(stop_tool_refresher)
+
+    embeddings = None
+    if config.myai.response_cache.mode == "semantic":
+        embeddings = create_embeddings(
+            config.aiclient,
+            config.myai.response_cache.embedding_model,
+            httpx_client,
+            httpx_async_client,
+        )
 
-    match config.aiclient.model_provider:
+    llmHandler = LLMConversationHandler(
+        config.myai,
+        config.aiclient,
+        model,
+        registry=registry,
+        embeddings=embeddings,
+        tiers=tiers or None,
+        tracer=app.get(keys.tracer),
+    )
+    llmHandler.register_tools(mytools)
+
+    app[keys.llmhandler] = llmHandler
+
+
+def create_model(
+    config: LangchainConfig,
+    model: str,
+    httpx_client: httpx.Client,
+    httpx_async_client: httpx.AsyncClient,
+) -> BaseChatModel:
+    """
+    Chat model of the model provider.
+    The httpx clients are used by the Azure OpenAI models, Gemini uses its own gRPC channel
+    """
+    match config.model_provider:
         case "google_genai":
             from langchain_google_genai import ChatGoogleGenerativeAI
 
-            model = ChatGoogleGenerativeAI(
-                model=config.aiclient.model,
-                google_api_key=config.aiclient.google_api_key.get_secret_value(),
-                http_client=httpx_client,
+            # The Gemini client keeps its own long lived gRPC channel rather than using httpx,
+            # so the httpx clients and httpx_verify_ssl do not apply. gRPC takes a CA bundle
+            # from GRPC_DEFAULT_SSL_ROOTS_FILE_PATH and cannot skip verification
+            if config.httpx_verify_ssl is not True:
+                logger.warning(
+                    "httpx_verify_ssl does not apply to google_genai, set GRPC_DEFAULT_SSL_ROOTS_FILE_PATH for a CA bundle"
+                )
+            return ChatGoogleGenerativeAI(
+                model=model,
+                google_api_key=config.google_api_key.get_secret_value(),
+                disable_streaming=not config.streaming,
+                timeout=config.timeout,
+                # Retried by ResilientChatModel
+                max_retries=0,
             )
         case "azure_openai":
             from langchain_openai import AzureChatOpenAI
 
             # https://python.langchain.com/api_reference/openai/llms/langchain_openai.llms.azure.AzureOpenAI.html#langchain_openai.llms.azure.AzureOpenAI.http_client
-            model = AzureChatOpenAI(
-                model=config.aiclient.model,
-                azure_endpoint=str(config.aiclient.azure_endpoint),
-                api_version=config.aiclient.azure_api_version,
-                api_key=config.aiclient.azure_api_key.get_secret_value(),
+            return AzureChatOpenAI(
+                model=model,
+                azure_endpoint=str(config.azure_endpoint),
+                api_version=config.azure_api_version,
+                api_key=config.azure_api_key.get_secret_value(),
                 http_client=httpx_client,
+                http_async_client=httpx_async_client,
+                disable_streaming=not config.streaming,
+                # Report usage (including cached tokens) when streaming
+                stream_usage=True,
+                timeout=config.timeout,
+                # Retried by ResilientChatModel
+                max_retries=0,
             )
         case _:
-            raise ValueError(
-                f"Unsupported model provider: {config.aiclient.model_provider}"
+            raise ValueError(f"Unsupported model provider: {config.model_provider}")
+
+
+def create_resilient_model(
+    config: LangchainConfig,
+    model: str,
+    httpx_client: httpx.Client,
+    httpx_async_client: httpx.AsyncClient,
+    state: ResilienceState,
+) -> ResilientChatModel:
+    """
+    Chat model of the model provider failing over to the configured fallback models
+    """
+    providers = [
+        (
+            config.model_provider,
+            create_model(config, model, httpx_client, httpx_async_client),
+        )
+    ]
+    for fallback in config.resilience.fallbacks:
+        providers.append(
+            (
+                fallback.model_provider,
+                create_model(
+                    config.model_copy(
+                        update={"model_provider": fallback.model_provider}
+                    ),
+                    fallback.model,
+                    httpx_client,
+                    httpx_async_client,
+                ),
             )
+        )
+    return ResilientChatModel(providers, config.resilience, config.timeout, state)
 
-    # use bind_tools_when_ready to move some of the constructions funtions to an async runtime
-    app.on_startup.append(bind_tools_when_ready)
 
-    registry = REGISTRY if keys.metrics not in app else app[keys.metrics]
+def create_embeddings(
+    config: LangchainConfig,
+    model: str,
+    httpx_client: httpx.Client,
+    httpx_async_client: httpx.AsyncClient,
+) -> Embeddings:
+    """
+    Embedding model of the model provider, used by the semantic response cache
+    """
+    match config.model_provider:
+        case "google_genai":
+            from langchain_google_genai import GoogleGenerativeAIEmbeddings
 
-    llmHandler = LLMConversationHandler(config.myai, model, registry=registry)
-    llmHandler.register_tools(mytools)
+            # Over gRPC like the chat model, without the httpx clients
+            return GoogleGenerativeAIEmbeddings(
+                model=model, google_api_key=config.google_api_key.get_secret_value()
+            )
+        case "azure_openai":
+            from langchain_openai import AzureOpenAIEmbeddings
 
-    app[keys.llmhandler] = llmHandler
+            return AzureOpenAIEmbeddings(
+                model=model,
+                azure_endpoint=str(config.azure_endpoint),
+                api_version=config.azure_api_version,
+                api_key=config.azure_api_key.get_secret_value(),
+                http_client=httpx_client,
+                http_async_client=httpx_async_client,
+            )
+        case _:
+            raise ValueError(
+                f"Unsupported embedding model provider: {config.model_provider}"
+            )
 
 
 class LLMConversationHandler:
@@ -112,6 +341,7 @@ class LLMConversationHandler:
 
     Attributes:
         config (GeminiConfig): Configuration for the AI
+        aiclient_config (LangchainConfig): Configuration for the model client
         client (genai.Client): The AI client eg Gemini for making requests
         function_registry (toolutils.FunctionRegistry): Registry for tools that can be called by the AI
     """
@@ -119,25 +349,120 @@ class LLMConversationHandler:
     def __init__(
         self,
         config: MyAiConfig,
-        client: BaseChatModel,
+        aiclient_config: LangchainConfig,
+        client: BaseChatModel | ResilientChatModel,
         registry: CollectorRegistry | None = REGISTRY,
+        embeddings: Embeddings | None = None,
+        tiers: dict[str, BaseChatModel | ResilientChatModel] | None = None,
+        tracer: Tracer | None = None,
     ):
         self.config = config
+        self.aiclient_config = aiclient_config
+        self.tracer = tracer or Tracer(registry=registry)
         self.function_registry = toolregistry.ToolRegistry(
-            config.toolbox, registry=registry
+            config.toolbox, registry=registry, tracer=self.tracer
         )
         self.client = client
-        self.llm_summary_metric = Summary(
-            "llm_usage", "Summary of LLM usage", registry=registry
+        # Models the router sends turns to, cheapest first. The last is the flagship model
+        self.tiers: dict[str, BaseChatModel | ResilientChatModel] = tiers or {
+            aiclient_config.model: client
+        }
+        self.tier_configs = {tier.name: tier for tier in aiclient_config.models}
+        self.flagship = list(self.tiers)[-1]
+        # The models with tools bound
+        self.clients: dict[str, Any] = dict(self.tiers)
+        # The cheapest model without tools bound, used for housekeeping calls such as summaries
+        self.base_client = next(iter(self.tiers.values()))
+        self.context_window = ContextWindow(
+            aiclient_config.context_length, config.context
+        )
+        self.file_store = FileStore(config.files, registry=registry)
+        self.rate_limiter = RateLimiter(aiclient_config.rate_limit, registry=registry)
+        self.turn_queue = TurnQueue(config.turns, registry=registry)
+        self.usage = UsageLedger(config.usage, registry=registry)
+        self.llm_usage_metric = Histogram(
+            "llm_usage",
+            "Latency of LLM calls",
+            buckets=LLM_LATENCY_BUCKETS,
+            registry=registry,
+        )
+        self.context_tokens_metric = Histogram(
+            "llm_context_tokens",
+            "Estimated prompt tokens sent to the LLM per call",
+            buckets=TOKEN_BUCKETS,
+            registry=registry,
+        )
+        self.context_summary_metric = Histogram(
+            "llm_context_summary",
+            "Time spent summarising older turns",
+            buckets=LLM_LATENCY_BUCKETS,
+            registry=registry,
+        )
+        self.tool_refresh_metric = Counter(
+            "tool_catalogue_refreshes",
+            "Refreshes of the MCP tool catalogue by outcome",
+            ["result"],
+            registry=registry,
+        )
+        # Names of the registered tools provided by MCP servers
+        self.mcp_tool_names: set[str] = set()
+        self.response_cache = ResponseCache(
+            config.response_cache, embeddings=embeddings, registry=registry
+        )
+        # Hash of the tool catalogue and system prompt of the compiled graph
+        self.catalogue = ""
+        # Prompts of the MCP servers, added to the system prompt
+        self.mcp_prompts: dict[str, dict[str, list[HumanMessage | AIMessage]]] = {}
+        # System messages starting every model call, built when the graph is compiled
+        self.system_prefix: list[SystemMessage] = []
+        # Extra arguments for every model call
+        self.invoke_kwargs: dict[str, Any] = {}
+        self.route_metric = Counter(
+            "llm_routes",
+            "Model calls by the model tier chosen and the reason for choosing it",
+            ["model", "reason"],
+            registry=registry,
+        )
+        self.model_latency_metric = Histogram(
+            "llm_model_latency",
+            "Latency of LLM calls by model tier",
+            ["model"],
+            buckets=LLM_LATENCY_BUCKETS,
+            registry=registry,
+        )
+        self.model_tokens_metric = Counter(
+            "llm_model_tokens",
+            "Tokens used by model tier",
+            ["model", "type"],
+            registry=registry,
+        )
+        self.input_tokens_metric = Counter(
+            "llm_input_tokens",
+            "Prompt tokens sent to the LLM",
+            registry=registry,
+        )
+        self.cached_tokens_metric = Counter(
+            "llm_cached_input_tokens",
+            "Prompt tokens the LLM provider read from its prompt cache",
+            registry=registry,
+        )
+        self.cached_ratio_metric = Histogram(
+            "llm_cached_token_ratio",
+            "Fraction of the prompt tokens of each LLM call read from the prompt cache",
+            buckets=(0, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 1),
+            registry=registry,
         )
 
         # Initialize the graph
         workflow = StateGraph(AgentState)
-        workflow.add_node("chatbot", self._call_llm)
-        # workflow.add_node("my_tools", self._call_tool)
-
-        workflow.add_edge(START, "chatbot")
-        workflow.add_edge("my_tools", "chatbot")
+        workflow.add_node("context", self.trace_node("context", self._manage_context))
+        workflow.add_node("router", self._route)
+        workflow.add_node("chatbot", self.trace_node("chatbot", self._call_llm))
+
+        workflow.add_edge(START, "context")
+        workflow.add_edge("context", "router")
+        workflow.add_edge("router", "chatbot")
+        workflow.add_edge("my_tools", "context")
         workflow.add_edge("chatbot", END)
 
         # Add edges
@@ -152,7 +477,22 @@ class LLMConversationHandler:
 
         self.workflow = workflow
 
-        self.memory = MemorySaver()
+        # Conversations evicted from the checkpointer no longer hold their files
+        self.memory = create_checkpointer(
+            config.checkpointer,
+            registry=registry,
+            tracer=self.tracer,
+            on_delete_thread=self.file_store.release_thread,
+        )
+
+    def trace_node(self, name: str, node: Callable) -> Callable:
+        """Wrap an async graph node so each invocation is recorded as a span"""
+
+        async def traced(state: AgentState, config: RunnableConfig) -> dict:
+            with self.tracer.span(f"node.{name}"):
+                return await node(state, config)
+
+        return traced
 
     @staticmethod
     def get_graph_config(conversation: ConversationAccount, **kwargs) -> RunnableConfig:
@@ -167,51 +507,242 @@ class LLMConversationHandler:
             dict: Configuration for the graph
         """
 
-        config_dict = {"configurable": {"thread_id": conversation.id, **kwargs}}
-        print(f"Graph config: {config_dict}")
-        # return config_dict
         return RunnableConfig(configurable={"thread_id": conversation.id, **kwargs})
-        return RunnableConfig(config_dict)
 
-    async def _call_llm(self, state: AgentState) -> dict:
+    async def _manage_context(self, state: AgentState, config: RunnableConfig) -> dict:
+        """
+        Node to keep the conversation within the model context window.
+        Consumed file payloads are replaced by placeholders and the oldest turns that do not fit
+        are removed from the state, folded into the rolling summary when enabled.
+        Files no longer in the conversation are released from the file store.
+        """
+        thread_id = config["configurable"]["thread_id"]
+        messages = state["messages"]
+        summary = state.get("summary", "")
+        update_messages = []
+
+        if self.config.context.drop_consumed_files:
+            replacements = self.context_window.strip_consumed_files(messages)
+            if replacements:
+                replaced = {message.id: message for message in replacements}
+                self.file_store.release(
+                    [message for message in messages if message.id in replaced],
+                    thread_id,
+                )
+                messages = [replaced.get(message.id, message) for message in messages]
+                update_messages.extend(replacements)
+
+        reserved = self.context_window.count_messages(self.system_prefix)
+        if summary:
+            reserved += self.context_window.count(summary_message(summary))
+        dropped, kept = self.context_window.fit(messages, reserved=reserved)
+
+        if not dropped:
+            return {"messages": update_messages} if update_messages else {}
+
+        logger.info(f"Context: dropping {len(dropped)} of {len(messages)} messages")
+        self.file_store.release(dropped, thread_id)
+
+        update = {}
+        if self.config.context.summarise:
+            # Summaries are written by the cheapest tier and count against its quota and
+            # the daily budget of the identity like any other model call
+            model = next(iter(self.tiers))
+            identity = config["configurable"].get("identity") or "anonymous"
+            estimated = (
+                self.context_window.count_messages(dropped)
+                + self.config.context.reserve_tokens
+            )
+            await self.rate_limiter.acquire(thread_id, estimated)
+            with (
+                self.tracer.span("llm.summary", **{"llm.model": model}) as span,
+                timed(self.context_summary_metric),
+            ):
+                response = await self.context_window.summarise(
+                    self.base_client, summary, dropped
+                )
+            self._record_usage(model, response, span, estimated, identity)
+            update["summary"] = response.text()
+
+        update["messages"] = update_messages + [
+            RemoveMessage(id=message.id) for message in dropped
+        ]
+        return update
+
+    async def _call_llm(self, state: AgentState, config: RunnableConfig) -> dict:
         """
         Node to call the language model.
         """
         messages = state["messages"]
-        with self.llm_summary_metric.time():
-            response = await self.client.ainvoke(messages)
+        if summary := state.get("summary"):
+            messages = [summary_message(summary)] + messages
+        # The system prefix is the same object on every call so providers can cache it
+        messages = self.system_prefix + messages
+
+        # Files are only read back from the store for the prompt, the state keeps the references
+        messages = await self.file_store.materialise(messages)
+
+        prompt_tokens = self.context_window.count_messages(messages)
+        self.context_tokens_metric.observe(prompt_tokens)
+
+        model = state.get("model") or self.flagship
+        if model not in self.clients:
+            model = self.flagship
+
+        thread_id = config["configurable"]["thread_id"]
+        identity = config["configurable"].get("identity") or "anonymous"
+        response = await self._invoke(
+            model, messages, thread_id, identity, prompt_tokens
+        )
+
+        # An empty reply from a cheaper tier is taken as low confidence and asked again of the flagship
+        if (
+            model != self.flagship
+            and not response.tool_calls
+            and not message_text(response.content).strip()
+        ):
+            logger.info(f"Router: empty reply from {model}, escalating")
+            self.route_metric.labels(self.flagship, "low_confidence").inc()
+            response = await self._invoke(
+                self.flagship, messages, thread_id, identity, prompt_tokens
+            )
+
         # The response from ainvoke is already an AIMessage if no tool calls,
         # or an AIMessage with tool_calls if tools are called.
-        # We append it to the list of messages to be included in the state.
+        # add_messages appends it to the conversation held in the state.
+        return {"messages": [response]}
 
-        # TODO: Check do we append existing messages or just the response?
+    async def _invoke(
+        self,
+        model: str,
+        messages: Sequence[BaseMessage],
+        thread_id: str,
+        identity: str,
+        prompt_tokens: int,
+    ) -> AIMessage:
+        """Call the model of the tier within the rate limits, recording its latency and usage"""
+        # The deployment quota counts the tokens the response may use as well as the prompt
+        estimated = prompt_tokens + self.config.context.reserve_tokens
+        await self.rate_limiter.acquire(thread_id, estimated)
+
+        with (
+            self.tracer.span("llm", **{"llm.model": model}) as span,
+            timed(self.llm_usage_metric, self.model_latency_metric.labels(model)),
+        ):
+            response = await self.clients[model].ainvoke(messages, **self.invoke_kwargs)
+            span.set_attribute("llm.tool_calls", len(response.tool_calls))
+        self._record_usage(model, response, span, estimated, identity)
+        return response
+
+    def _record_usage(
+        self,
+        model: str,
+        response: AIMessage,
+        span: Any,
+        estimated: int,
+        identity: str,
+    ):
+        """
+        Record the token usage of a call to the model of the tier: on its span and metrics,
+        in the rate limiter against the estimate it acquired and in the usage ledger
+        """
+        self._observe_usage(response)
 
-        # print(f"LLM response: {response}")
-        # print(f"messages: {messages}")
-        return {"messages": messages + [response]}
+        usage = getattr(response, "usage_metadata", None)
+        if not usage:
+            return
+        span.set_attributes(
+            {
+                "llm.input_tokens": usage.get("input_tokens", 0),
+                "llm.output_tokens": usage.get("output_tokens", 0),
+            }
+        )
+        self.rate_limiter.reconcile(estimated, usage.get("total_tokens", 0))
+        self.model_tokens_metric.labels(model, "input").inc(
+            usage.get("input_tokens", 0)
+        )
+        self.model_tokens_metric.labels(model, "output").inc(
+            usage.get("output_tokens", 0)
+        )
+        tier = self.tier_configs.get(model)
+        self.usage.record(model, tier.model if tier else model, identity, usage)
 
-    async def _call_tool(self, *args, **kwargs) -> dict:
+    def _route(self, state: AgentState) -> dict:
         """
-        Node to execute tool calls.
+        Node choosing the model tier for the next model call
         """
+        model, reason = self.choose_model(state)
+        self.route_metric.labels(model, reason).inc()
+        logger.debug(f"Router: {model} ({reason})")
+        return {"model": model}
 
-        print(f"ToolNode called with args: {args}, kwargs: {kwargs}")
-
-        logger.error(f"State is {state}")
+    def choose_model(self, state: AgentState) -> tuple[str, str]:
+        """
+        The model tier for the next model call and the reason for choosing it.
+        Turns go to the cheapest tier whose prompt and context limits they fit, and calls
+        following tool use go to the flagship model.
+        """
+        if len(self.tiers) == 1:
+            return self.flagship, "default"
 
+        messages = state["messages"]
+        if messages and isinstance(messages[-1], ToolMessage):
+            return self.flagship, "tool_use"
+
+        prompt_tokens = self.context_window.count(messages[-1]) if messages else 0
+        context_tokens = self.context_window.count_messages(
+            self.system_prefix
+        ) + self.context_window.count_messages(messages)
+        if summary := state.get("summary"):
+            context_tokens += self.context_window.count(summary_message(summary))
+
+        for name in list(self.tiers)[:-1]:
+            tier = self.tier_configs.get(name)
+            if tier is None:
+                return name, "simple"
+            if (
+                tier.max_prompt_tokens is None
+                or prompt_tokens <= tier.max_prompt_tokens
+            ) and (
+                tier.max_context_tokens is None
+                or context_tokens <= tier.max_context_tokens
+            ):
+                return name, "simple"
+
+        return self.flagship, "complex"
+
+    def _observe_usage(self, response: AIMessage):
+        """Record the prompt tokens of the call and how many were read from the provider cache"""
+        usage = getattr(response, "usage_metadata", None)
+        if not usage or not usage.get("input_tokens"):
+            return
+        cached = usage.get("input_token_details", {}).get("cache_read", 0) or 0
+        self.input_tokens_metric.inc(usage["input_tokens"])
+        self.cached_tokens_metric.inc(cached)
+        self.cached_ratio_metric.observe(cached / usage["input_tokens"])
+
+    async def _call_tool(self, state: AgentState, config: RunnableConfig) -> dict:
+        """
+        Node to execute tool calls.
+        The calls of the last AI message run concurrently through the ToolRegistry, which
+        applies the tool limits and timeouts and turns failures into error ToolMessages.
+        """
         messages = state["messages"]
         last_message = messages[-1]
         if not isinstance(last_message, AIMessage) or not last_message.tool_calls:
             # Should not happen if routed correctly
             logger.error("Call tool node received state without tool calls.")
-            # todo: Handle this case more gracefully, maybe raise an exception or return an error message
             return {}
 
         tool_responses = await self.function_registry.perform_tool_actions(
-            last_message.tool_calls
+            last_message.tool_calls, config
         )
-        # Append tool responses to the messages list
-        return {"messages": messages + tool_responses}
+        # Tool results are sent with every later model call of the conversation
+        for tool_call, response in zip(last_message.tool_calls, tool_responses):
+            self.usage.record_tool(
+                tool_call["name"], self.context_window.count(response)
+            )
+        return {"messages": tool_responses}
 
     def _should_call_tool(self, state: AgentState) -> str:
         """
@@ -229,7 +760,7 @@ class LLMConversationHandler:
         return langgraph.graph.END  # is also an option if imported
 
     def bind_tools(self):
-        """Binds the tools to the client and initializes the ToolNode.
+        """Binds the tools to the client and adds the tool node, which executes them via the ToolRegistry.
         This is seperated out as some of the tool elements (eg MCP) are not available until the async runtime is available.
         """
 
@@ -237,27 +768,195 @@ class LLMConversationHandler:
 
         logger.info(f"Binding tools: {[tool.name for tool in all_tools]}")
 
-        self.client = self.client.bind_tools(all_tools)
-        self.toolnode = ToolNode(tools=all_tools)
+        self.clients = {
+            name: model.bind_tools(all_tools) for name, model in self.tiers.items()
+        }
+        self.client = self.clients[self.flagship]
+
+        if "my_tools" not in self.workflow.nodes:
+            self.workflow.add_node(
+                "my_tools", self.trace_node("tools", self._call_tool)
+            )
+
+    def update_tools(self, tools: Sequence[StructuredTool]) -> bool:
+        """Replace the MCP tools with a newly discovered catalogue.
+        Tools that were added, removed or changed are updated in the ToolRegistry, then the
+        tools are bound to the client again and a newly compiled graph replaces the current one.
+        The graph nodes read the clients and the ToolRegistry when they run, so turns already
+        running use the new catalogue from their next model or tool call. A call the model made
+        to a tool removed since is answered with an error ToolMessage and the turn continues.
+
+        Returns:
+            bool: whether the catalogue changed
+        """
+        discovered = {}
+        for tool in tools:
+            if self.function_registry.is_configured(tool.name):
+                discovered[tool.name] = tool
+            else:
+                logger.warning(
+                    f"Tool refresh: ignoring {tool.name}, it is not defined in the toolbox configuration"
+                )
+
+        removed = self.mcp_tool_names - discovered.keys()
+        changed = [
+            tool
+            for name, tool in discovered.items()
+            if name not in self.mcp_tool_names
+            or convert_to_openai_tool(tool)
+            != convert_to_openai_tool(self.function_registry.registry[name].tool)
+        ]
+
+        if not removed and not changed:
+            self.tool_refresh_metric.labels("unchanged").inc()
+            return False
+
+        logger.info(
+            f"Tool refresh: adding or updating {[tool.name for tool in changed]}, removing {sorted(removed)}"
+        )
+        for name in removed:
+            self.function_registry.unregister_tool(name)
+        self.function_registry.register_tools(changed)
+        self.mcp_tool_names = set(discovered)
 
-        # self.workflow.add_node("my_tools", self._call_tool)
-        self.workflow.add_node("my_tools", self.toolnode)
+        self.bind_tools()
+        self.compile()
+
+        self.tool_refresh_metric.labels("changed").inc()
+        return True
 
     def compile(self) -> StateGraph:
         """
         Compiles the graph with the current configuration.
-        This is essentiall as we want to add some tools and generate the ToolNode dynamically.
+        This is essentiall as we want to add some tools and generate the tool node dynamically.
         This is useful if you want to change the graph dynamically.
         """
 
         self.graph = self.workflow.compile(checkpointer=self.memory)
+        self.system_prefix = self.build_system_prefix()
+        self.catalogue = self.catalogue_hash()
+        if self.aiclient_config.prompt_cache_key:
+            self.invoke_kwargs = {"prompt_cache_key": self.catalogue[:32]}
 
-        print(self.graph.get_graph().draw_ascii())
+        # Drawing the graph is slow, and holds up the event loop when the tools are refreshed
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Graph:\n{self.graph.get_graph().draw_ascii()}")
 
         logger.info("Graph compiled successfully.")
 
         return self.graph
 
+    def system_prompt(self) -> str:
+        """
+        The system instructions followed by the MCP prompts, in a stable order
+        """
+        sections = [prompt.text for prompt in self.config.system_instruction]
+        for server in sorted(self.mcp_prompts):
+            for name in sorted(self.mcp_prompts[server]):
+                sections.extend(
+                    message_text(message.content)
+                    for message in self.mcp_prompts[server][name]
+                )
+        return "\n\n".join(section for section in sections if section)
+
+    def build_system_prefix(self) -> list[SystemMessage]:
+        """
+        The system messages prepended to every model call.
+        They are built once so every call sends a byte identical prefix, which providers
+        (Gemini implicit caching, Azure OpenAI prompt caching) serve from their prompt cache.
+        """
+        system_prompt = self.system_prompt()
+        if not system_prompt:
+            return []
+        return [SystemMessage(content=system_prompt, id="system-prefix")]
+
+    def update_prompts(
+        self, prompts: dict[str, dict[str, list[HumanMessage | AIMessage]]]
+    ) -> bool:
+        """Replace the MCP prompts, recompiling if the system prompt changed
+
+        Returns:
+            bool: whether the system prompt changed
+        """
+        previous = self.system_prompt()
+        self.mcp_prompts = prompts
+        if self.system_prompt() == previous:
+            return False
+
+        logger.info("Prompt refresh: system prompt changed")
+        self.compile()
+        return True
+
+    def catalogue_hash(self) -> str:
+        """
+        Hash of the tool catalogue and system prompt, which scopes cached replies
+        """
+        catalogue = {
+            "system": self.system_prompt(),
+            "tools": sorted(
+                (
+                    convert_to_openai_tool(tool)
+                    for tool in self.function_registry.all_tools()
+                ),
+                key=lambda tool: tool["function"]["name"],
+            ),
+        }
+        return hashlib.sha256(
+            json.dumps(catalogue, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    async def _cached_reply(
+        self, graph_config: RunnableConfig, identity: str, prompt: str
+    ) -> str | None:
+        """
+        The cached reply to the prompt, recorded in the conversation as if the model had answered
+        """
+        if not self.response_cache.enabled:
+            return None
+
+        reply = await self.response_cache.lookup(identity, self.catalogue, prompt)
+        if reply is None:
+            return None
+
+        logger.debug("Reply served from the response cache")
+        await self.graph.aupdate_state(
+            graph_config,
+            {"messages": [HumanMessage(content=prompt), AIMessage(content=reply)]},
+            as_node="chatbot",
+        )
+        return reply
+
+    async def _cache_reply(
+        self, identity: str, prompt: str, messages: Sequence[AnyMessage]
+    ):
+        """
+        Cache the reply that ends the messages when every tool used for it allows caching.
+        The reply is cached no longer than the shortest cache_ttl of those tools.
+        """
+        if not self.response_cache.enabled or not messages:
+            return
+        reply = messages[-1]
+        if not isinstance(reply, AIMessage) or reply.tool_calls:
+            return
+
+        ttl = None
+        for message in reversed(messages):
+            if isinstance(message, HumanMessage):
+                break
+            if not isinstance(message, AIMessage):
+                continue
+            for tool_call in message.tool_calls:
+                declaration = self.function_registry.registry.get(tool_call["name"])
+                if declaration is None or not declaration.definition.cacheable:
+                    return
+                tool_ttl = declaration.definition.cache_ttl
+                if tool_ttl is not None:
+                    ttl = tool_ttl if ttl is None else min(ttl, tool_ttl)
+
+        await self.response_cache.store(
+            identity, self.catalogue, prompt, message_text(reply.content), ttl
+        )
+
     def register_tools(self, tools: Sequence[StructuredTool]):
         """Registers the tools with the client."""
         self.function_registry.register_tools(tools)
@@ -267,31 +966,30 @@ class LLMConversationHandler:
         conversation: ConversationAccount,
         name: str,
         mime_type: str,
-        file_bytes: bytes,
+        stored: StoredFile,
     ) -> None:
-        """Uploads a file to the AI model messages.
-        This method encodes the file bytes to base64 and prepares it for the AI model.
+        """Adds a file held in the FileStore to the conversation.
+        The conversation state only records a reference to the file, the content is sent to
+        the model with the next prompt. The same file uploaded to several conversations is
+        stored once.
 
         Returns:
             None
         """
-        messages = self.get_conversation(conversation)
-
-        encoded = base64.b64encode(file_bytes).decode("utf-8")
-
-        messages.append(
-            HumanMessage(
-                content=[
-                    {
-                        "type": "file",
-                        "source_type": "base64",
-                        "data": encoded,
-                        "mine_type": mime_type,
-                        "filename": name,
-                    }
-                ]
+        graph_config = self.get_graph_config(conversation)
+
+        self.file_store.add_reference(stored.sha256, conversation.id)
+        # Added between turns so a running turn does not overwrite it
+        async with self.turn_queue.exclusive(conversation.id):
+            await self.graph.aupdate_state(
+                graph_config,
+                {
+                    "messages": [
+                        HumanMessage(content=[file_reference(name, mime_type, stored)])
+                    ]
+                },
+                as_node="chatbot",
             )
-        )
 
         logger.debug("File added to conversation but not sent to LLM yet.")
         return None
@@ -304,6 +1002,11 @@ class LLMConversationHandler:
         It handles tool calls made by the model, executes the corresponding tool,
         and returns the final response from the model.
 
+        Turns of a conversation run one at a time. Prompts arriving while a turn runs are
+        answered together by the next turn, and each of their callers receives its reply.
+
+        Raises TokenBudgetExceededError if the identity has used its daily token budget.
+
         Args:
             conversation (Conversation): The conversation context
             identity (str): The identity of the user or bot in the conversation
@@ -312,17 +1015,40 @@ class LLMConversationHandler:
         Returns:
             str: text response for the bot
         """
-
+        self.usage.check(identity)
+
+        with self.tracer.span("turn", **{"chat.conversation": conversation.id}) as span:
+            async with self.turn_queue.turn(conversation.id, prompt) as turn:
+                span.set_attribute("chat.coalesced", turn.coalesced)
+                if turn.coalesced:
+                    return turn.reply
+                turn.reply = await self._chat_turn(conversation, identity, turn)
+                return turn.reply
+
+    async def _chat_turn(
+        self, conversation: ConversationAccount, identity: str, turn: Turn
+    ) -> str:
+        """Run a turn answering the prompts of the turn, returning the text response"""
         graph_config = self.get_graph_config(conversation, identity=identity)
         logger.debug(f"Graph config: {graph_config}")
 
-        graph_input = {"messages": [HumanMessage(content=prompt)]}
+        prompt = turn_prompt(turn)
+        if prompt is not None:
+            cached = await self._cached_reply(graph_config, identity, prompt)
+            if cached is not None:
+                return cached
+
+        graph_input = {
+            "messages": [HumanMessage(content=prompt) for prompt in turn.prompts]
+        }
 
         # Invoke the graph
         final_graph_state = await self.graph.ainvoke(graph_input, config=graph_config)
 
         # Extract the final messages from the graph's output state
         final_messages = final_graph_state["messages"]
+        if prompt is not None:
+            await self._cache_reply(identity, prompt, final_messages)
 
         # The last message in the final_messages list should be the AI's response
         final_response_message = final_messages[-1] if final_messages else None
@@ -339,3 +1065,127 @@ class LLMConversationHandler:
                 f"Unexpected final response type from graph: {type(final_response_message)}"
             )
             return "Sorry, I encountered an error processing your request."
+
+    async def chat_stream(
+        self, conversation: ConversationAccount, identity: str, prompt: str
+    ) -> AsyncIterator[str]:
+        """Make a chat request to the AI model and stream the reply as it is generated.
+        Text fragments produced by the chatbot node are yielded as soon as the model emits them,
+        including across tool round-trips. If the model did not stream (eg streaming is disabled
+        in the config) the final reply is yielded as a single fragment once the graph completes.
+
+        Turns of a conversation run one at a time. Prompts arriving while a turn runs are
+        answered together by the next turn, which is streamed to the first of their callers
+        only; the others yield nothing as the reply has already been sent to the conversation.
+
+        Raises TokenBudgetExceededError if the identity has used its daily token budget.
+
+        Args:
+            conversation (Conversation): The conversation context
+            identity (str): The identity of the user or bot in the conversation
+            prompt (str): Prompt from the user
+
+        Yields:
+            str: fragments of the text response for the bot
+        """
+        self.usage.check(identity)
+
+        # The turn span is only current while the next fragment is produced, never across
+        # a yield, so the caller can close the stream early from another context
+        with self.tracer.start_span(
+            "turn", **{"chat.conversation": conversation.id}
+        ) as span:
+            async with self.turn_queue.turn(conversation.id, prompt) as turn:
+                span.set_attribute("chat.coalesced", turn.coalesced)
+                if turn.coalesced:
+                    return
+                fragments = []
+                stream = self._chat_stream_turn(conversation, identity, turn)
+                try:
+                    while True:
+                        with self.tracer.current(span):
+                            try:
+                                fragment = await anext(stream)
+                            except StopAsyncIteration:
+                                break
+                        fragments.append(fragment)
+                        yield fragment
+                finally:
+                    await stream.aclose()
+                turn.reply = "".join(fragments)
+
+    async def _chat_stream_turn(
+        self, conversation: ConversationAccount, identity: str, turn: Turn
+    ) -> AsyncIterator[str]:
+        """Run a turn answering the prompts of the turn, streaming the text response"""
+        graph_config = self.get_graph_config(conversation, identity=identity)
+        logger.debug(f"Graph config: {graph_config}")
+
+        prompt = turn_prompt(turn)
+        if prompt is not None:
+            cached = await self._cached_reply(graph_config, identity, prompt)
+            if cached is not None:
+                yield cached
+                return
+
+        graph_input = {
+            "messages": [HumanMessage(content=prompt) for prompt in turn.prompts]
+        }
+
+        streamed = False
+
+        async for event in self.graph.astream_events(
+            graph_input, config=graph_config, version="v2"
+        ):
+            if event["event"] != "on_chat_model_stream":
+                continue
+            if event.get("metadata", {}).get("langgraph_node") != "chatbot":
+                continue
+
+            text = message_text(event["data"]["chunk"].content)
+            if text:
+                streamed = True
+                yield text
+
+        if streamed and (prompt is None or not self.response_cache.enabled):
+            return
+
+        final_graph_state = await self.graph.aget_state(graph_config)
+        final_messages = final_graph_state.values.get("messages", [])
+        if prompt is not None:
+            await self._cache_reply(identity, prompt, final_messages)
+
+        if streamed:
+            return
+
+        final_response_message = final_messages[-1] if final_messages else None
+
+        if isinstance(final_response_message, AIMessage):
+            yield message_text(final_response_message.content)
+        else:
+            logger.error(
+                f"Unexpected final response type from graph: {type(final_response_message)}"
+            )
+            yield "Sorry, I encountered an error processing your request."
+
+
+def turn_prompt(turn: Turn) -> str | None:
+    """
+    The prompt of a turn answering a single prompt, which can be answered from the
+    response cache, or None for a turn answering several
+    """
+    return turn.prompts[0] if len(turn.prompts) == 1 else None
+
+
+def message_text(content: str | list) -> str:
+    """
+    Extract the text from message content, which is either a plain string or a list of content blocks
+    """
+    if isinstance(content, str):
+        return content
+
+    return "".join(
+        block if isinstance(block, str) else block.get("text", "")
+        for block in content
+        if isinstance(block, str) or block.get("type") == "text"
+    )
@@ -0,0 +1,44 @@
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any
+
+
+class TTLCache:
+    """
+    Least recently used cache where entries also expire after a time to live
+    """
+
+    def __init__(self, ttl: timedelta, max_size: int):
+        self.ttl = ttl.total_seconds()
+        self.max_size = max_size
+        # key -> (expiry time, value), ordered least recently used first
+        self.entries: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Any) -> tuple[bool, Any]:
+        """Returns (found, value) for the key"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+
+        expiry, value = entry
+        if expiry < time.monotonic():
+            del self.entries[key]
+            return False, None
+
+        self.entries.move_to_end(key)
+        return True, value
+
+    def put(self, key: Any, value: Any, ttl: timedelta | None = None) -> None:
+        """Store the value, expiring after the ttl given or else the ttl of the cache"""
+        expiry = time.monotonic() + (self.ttl if ttl is None else ttl.total_seconds())
+        self.entries[key] = (expiry, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
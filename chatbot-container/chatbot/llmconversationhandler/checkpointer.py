@@ -0,0 +1,642 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from collections.abc import AsyncIterator, Callable, Iterator, Sequence
+from typing import Any
+
+from chatbot.config import CheckpointerConfig
+from chatbot.tracing import Tracer
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.memory import InMemorySaver
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+
+# Minimum time between eviction sweeps of the sqlite backend
+SQLITE_EVICTION_INTERVAL_SECONDS = 30
+
+
+class CheckpointerMetrics:
+    """Prometheus metrics shared by the checkpointer backends"""
+
+    def __init__(self, registry: CollectorRegistry | None = REGISTRY):
+        self.threads = Gauge(
+            "checkpointer_threads",
+            "Number of conversations held by the checkpointer",
+            registry=registry,
+        )
+        self.bytes = Gauge(
+            "checkpointer_bytes",
+            "Stored size of all conversations held by the checkpointer",
+            registry=registry,
+        )
+        self.evictions = Counter(
+            "checkpointer_evictions",
+            "Conversations evicted from the checkpointer",
+            ["reason"],
+            registry=registry,
+        )
+
+
+class BoundedMemorySaver(InMemorySaver):
+    """
+    In-memory checkpointer with bounded memory use.
+
+    Only the most recent checkpoints of each conversation are kept and whole
+    conversations are evicted when idle for longer than the TTL, or least recently
+    used first when the thread count or stored byte size exceeds its cap.
+    """
+
+    def __init__(
+        self,
+        config: CheckpointerConfig,
+        registry: CollectorRegistry | None = REGISTRY,
+        tracer: Tracer | None = None,
+        on_delete_thread: Callable[[str], None] | None = None,
+    ):
+        super().__init__()
+        self.config = config
+        self.metrics = CheckpointerMetrics(registry)
+        self.tracer = tracer or Tracer()
+        # Called with the ID of each thread deleted or evicted, to release what it held
+        self.on_delete_thread = on_delete_thread
+
+        # thread ID -> last access time, ordered least recently used first
+        self.thread_access: OrderedDict[str, float] = OrderedDict()
+        self.thread_bytes: dict[str, int] = defaultdict(int)
+        # thread ID -> keys into self.blobs / self.writes so eviction does not scan everything
+        self.thread_blob_keys: dict[str, set] = defaultdict(set)
+        self.thread_write_keys: dict[str, set] = defaultdict(set)
+
+    def _touch(self, thread_id: str):
+        self.thread_access[thread_id] = time.monotonic()
+        self.thread_access.move_to_end(thread_id)
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        thread_id = config["configurable"]["thread_id"]
+        if thread_id not in self.thread_access:
+            return None
+        self._touch(thread_id)
+        return super().get_tuple(config)
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+
+        for channel, version in new_versions.items():
+            key = (thread_id, checkpoint_ns, channel, version)
+            self.thread_blob_keys[thread_id].add(key)
+            self.thread_bytes[thread_id] += len(self.blobs[key][1])
+        saved, saved_metadata, _ = self.storage[thread_id][checkpoint_ns][
+            checkpoint["id"]
+        ]
+        self.thread_bytes[thread_id] += len(saved[1]) + len(saved_metadata[1])
+
+        self._touch(thread_id)
+        self._prune_thread(thread_id, checkpoint_ns)
+        self._evict(current=thread_id)
+
+        return next_config
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        outer_key = (thread_id, checkpoint_ns, checkpoint_id)
+
+        before = sum(len(w[2][1]) for w in self.writes.get(outer_key, {}).values())
+        super().put_writes(config, writes, task_id, task_path)
+        after = sum(len(w[2][1]) for w in self.writes.get(outer_key, {}).values())
+
+        self.thread_write_keys[thread_id].add(outer_key)
+        self.thread_bytes[thread_id] += after - before
+        self._touch(thread_id)
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        with self.tracer.span("checkpoint.load"):
+            return await super().aget_tuple(config)
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        with self.tracer.span("checkpoint.write"):
+            return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        with self.tracer.span("checkpoint.write"):
+            return await super().aput_writes(config, writes, task_id, task_path)
+
+    def _prune_thread(self, thread_id: str, checkpoint_ns: str):
+        """Drop all but the most recent checkpoints and the blobs only they referenced"""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.config.max_checkpoints_per_thread:
+            return
+
+        ordered = sorted(checkpoints.keys())
+        stale = ordered[: -self.config.max_checkpoints_per_thread]
+
+        for checkpoint_id in stale:
+            saved, saved_metadata, _ = checkpoints.pop(checkpoint_id)
+            self.thread_bytes[thread_id] -= len(saved[1]) + len(saved_metadata[1])
+            outer_key = (thread_id, checkpoint_ns, checkpoint_id)
+            if outer_key in self.writes:
+                self.thread_bytes[thread_id] -= sum(
+                    len(w[2][1]) for w in self.writes.pop(outer_key).values()
+                )
+                self.thread_write_keys[thread_id].discard(outer_key)
+
+        referenced = set()
+        for saved, _, _ in checkpoints.values():
+            for channel, version in self.serde.loads_typed(saved)[
+                "channel_versions"
+            ].items():
+                referenced.add((thread_id, checkpoint_ns, channel, version))
+
+        for key in list(self.thread_blob_keys[thread_id]):
+            if key[1] == checkpoint_ns and key not in referenced:
+                self.thread_bytes[thread_id] -= len(self.blobs.pop(key)[1])
+                self.thread_blob_keys[thread_id].discard(key)
+
+    def _evict(self, current: str | None = None):
+        """Evict idle threads and then least recently used threads until within the caps"""
+        expiry = time.monotonic() - self.config.idle_ttl.total_seconds()
+        while self.thread_access:
+            thread_id, last_access = next(iter(self.thread_access.items()))
+            if last_access >= expiry or thread_id == current:
+                break
+            self.delete_thread(thread_id)
+            self.metrics.evictions.labels("idle").inc()
+
+        while len(self.thread_access) > 1 and (
+            len(self.thread_access) > self.config.max_threads
+            or sum(self.thread_bytes.values()) > self.config.max_bytes
+        ):
+            thread_id = next(iter(self.thread_access))
+            if thread_id == current:
+                break
+            self.delete_thread(thread_id)
+            self.metrics.evictions.labels("capacity").inc()
+
+        self.metrics.threads.set(len(self.thread_access))
+        self.metrics.bytes.set(sum(self.thread_bytes.values()))
+
+    def delete_thread(self, thread_id: str) -> None:
+        self.storage.pop(thread_id, None)
+        for key in self.thread_write_keys.pop(thread_id, set()):
+            self.writes.pop(key, None)
+        for key in self.thread_blob_keys.pop(thread_id, set()):
+            self.blobs.pop(key, None)
+        self.thread_bytes.pop(thread_id, None)
+        self.thread_access.pop(thread_id, None)
+        if self.on_delete_thread is not None:
+            self.on_delete_thread(thread_id)
+        logger.debug(f"Checkpointer: deleted thread {thread_id}")
+
+
+class SqliteSaver(BaseCheckpointSaver[int]):
+    """
+    Checkpointer storing conversations in a SQLite database file.
+
+    Conversation state survives pod restarts (and can be picked up by another
+    replica sharing the volume) and the pod heap only holds the turn in flight.
+    The same retention rules as BoundedMemorySaver apply: recent checkpoints only,
+    idle TTL, thread count and byte caps.
+    """
+
+    def __init__(
+        self,
+        config: CheckpointerConfig,
+        registry: CollectorRegistry | None = REGISTRY,
+        tracer: Tracer | None = None,
+        on_delete_thread: Callable[[str], None] | None = None,
+    ):
+        super().__init__()
+        self.config = config
+        self.metrics = CheckpointerMetrics(registry)
+        self.tracer = tracer or Tracer()
+        # Called with the ID of each thread deleted or evicted, to release what it held
+        self.on_delete_thread = on_delete_thread
+        self.lock = threading.Lock()
+        self.last_eviction = 0.0
+
+        self.conn = sqlite3.connect(str(config.path), check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    thread_id TEXT NOT NULL,
+                    checkpoint_ns TEXT NOT NULL DEFAULT '',
+                    checkpoint_id TEXT NOT NULL,
+                    parent_checkpoint_id TEXT,
+                    type TEXT,
+                    checkpoint BLOB,
+                    metadata_type TEXT,
+                    metadata BLOB,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+                )
+                """
+            )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS writes (
+                    thread_id TEXT NOT NULL,
+                    checkpoint_ns TEXT NOT NULL DEFAULT '',
+                    checkpoint_id TEXT NOT NULL,
+                    task_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    channel TEXT NOT NULL,
+                    type TEXT,
+                    value BLOB,
+                    task_path TEXT NOT NULL DEFAULT '',
+                    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+                )
+                """
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS checkpoints_updated_at ON checkpoints (thread_id, updated_at)"
+            )
+
+        logger.info(f"Checkpointer: sqlite database at {config.path}")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _row_to_tuple(
+        self, thread_id: str, checkpoint_ns: str, row: tuple
+    ) -> CheckpointTuple:
+        (
+            checkpoint_id,
+            parent_checkpoint_id,
+            type_,
+            checkpoint,
+            metadata_type,
+            metadata,
+        ) = row
+        writes = self.conn.execute(
+            "SELECT task_id, channel, type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? "
+            "ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint=self.serde.loads_typed((type_, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_checkpoint_id,
+                    }
+                }
+                if parent_checkpoint_id
+                else None
+            ),
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed((value_type, value)))
+                for task_id, channel, value_type, value in writes
+            ],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        select = (
+            "SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata "
+            "FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+        )
+
+        with self.lock:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self.conn.execute(
+                    select + " AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self.conn.execute(
+                    select + " ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+
+            if row is None:
+                return None
+            return self._row_to_tuple(thread_id, checkpoint_ns, row)
+
+    def list(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> Iterator[CheckpointTuple]:
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, "
+            "checkpoint, metadata_type, metadata FROM checkpoints"
+        )
+        clauses = []
+        params = []
+        if config:
+            clauses.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (
+                checkpoint_ns := config["configurable"].get("checkpoint_ns")
+            ) is not None:
+                clauses.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                clauses.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            clauses.append("checkpoint_id < ?")
+            params.append(before_checkpoint_id)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+
+            results = []
+            for thread_id, checkpoint_ns, *row in rows:
+                if limit is not None and len(results) >= limit:
+                    break
+                checkpoint_tuple = self._row_to_tuple(thread_id, checkpoint_ns, row)
+                if filter and not all(
+                    checkpoint_tuple.metadata.get(key) == value
+                    for key, value in filter.items()
+                ):
+                    continue
+                results.append(checkpoint_tuple)
+
+        yield from results
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        type_, serialized_checkpoint = self.serde.dumps_typed(checkpoint)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(
+            get_checkpoint_metadata(config, metadata)
+        )
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint["id"],
+                    config["configurable"].get("checkpoint_id"),
+                    type_,
+                    serialized_checkpoint,
+                    metadata_type,
+                    serialized_metadata,
+                    time.time(),
+                ),
+            )
+            self._prune_thread(thread_id, checkpoint_ns)
+
+        self._maybe_evict()
+
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            value_type, serialized_value = self.serde.dumps_typed(value)
+            rows.append(
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint_id,
+                    task_id,
+                    WRITES_IDX_MAP.get(channel, idx),
+                    channel,
+                    value_type,
+                    serialized_value,
+                    task_path,
+                )
+            )
+
+        # Special channels (negative index) overwrite, regular writes are only stored once
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [row for row in rows if row[4] < 0],
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [row for row in rows if row[4] >= 0],
+            )
+
+    def _prune_thread(self, thread_id: str, checkpoint_ns: str):
+        """Drop all but the most recent checkpoints of the thread (called with the lock held)"""
+        stale = self.conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+            (thread_id, checkpoint_ns, self.config.max_checkpoints_per_thread),
+        ).fetchall()
+        if not stale:
+            return
+        params = [
+            (thread_id, checkpoint_ns, checkpoint_id) for (checkpoint_id,) in stale
+        ]
+        self.conn.executemany(
+            "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            params,
+        )
+        self.conn.executemany(
+            "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            params,
+        )
+
+    def _maybe_evict(self):
+        if time.monotonic() - self.last_eviction < SQLITE_EVICTION_INTERVAL_SECONDS:
+            return
+        self.last_eviction = time.monotonic()
+        self.evict()
+
+    def evict(self):
+        """Evict idle threads and then least recently used threads until within the caps"""
+        expiry = time.time() - self.config.idle_ttl.total_seconds()
+
+        with self.lock:
+            threads = self.conn.execute(
+                "SELECT c.thread_id, MAX(c.updated_at), "
+                "SUM(LENGTH(c.checkpoint) + LENGTH(c.metadata)) + "
+                "COALESCE((SELECT SUM(LENGTH(w.value)) FROM writes w WHERE w.thread_id = c.thread_id), 0) "
+                "FROM checkpoints c GROUP BY c.thread_id ORDER BY MAX(c.updated_at)"
+            ).fetchall()
+
+        total_bytes = sum(size for _, _, size in threads)
+        remaining = len(threads)
+        for thread_id, updated_at, size in threads:
+            if updated_at < expiry:
+                reason = "idle"
+            elif remaining > self.config.max_threads or (
+                total_bytes > self.config.max_bytes and remaining > 1
+            ):
+                reason = "capacity"
+            else:
+                break
+            self.delete_thread(thread_id)
+            self.metrics.evictions.labels(reason).inc()
+            total_bytes -= size
+            remaining -= 1
+
+        self.metrics.threads.set(remaining)
+        self.metrics.bytes.set(total_bytes)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,)
+            )
+            self.conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+        if self.on_delete_thread is not None:
+            self.on_delete_thread(thread_id)
+        logger.debug(f"Checkpointer: deleted thread {thread_id}")
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        with self.tracer.span("checkpoint.load"):
+            return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        results = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in results:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        with self.tracer.span("checkpoint.write"):
+            return await asyncio.to_thread(
+                self.put, config, checkpoint, metadata, new_versions
+            )
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        with self.tracer.span("checkpoint.write"):
+            return await asyncio.to_thread(
+                self.put_writes, config, writes, task_id, task_path
+            )
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+def create_checkpointer(
+    config: CheckpointerConfig,
+    registry: CollectorRegistry | None = REGISTRY,
+    tracer: Tracer | None = None,
+    on_delete_thread: Callable[[str], None] | None = None,
+) -> BaseCheckpointSaver:
+    """
+    Create the checkpointer backend selected in the configuration
+    """
+    match config.backend:
+        case "memory":
+            return BoundedMemorySaver(
+                config,
+                registry=registry,
+                tracer=tracer,
+                on_delete_thread=on_delete_thread,
+            )
+        case "sqlite":
+            return SqliteSaver(
+                config,
+                registry=registry,
+                tracer=tracer,
+                on_delete_thread=on_delete_thread,
+            )
+        case _:
+            raise ValueError(f"Unsupported checkpointer backend: {config.backend}")
@@ -0,0 +1,173 @@
+import logging
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from chatbot.config import ContextConfig
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+)
+from langchain_core.messages.utils import (
+    count_tokens_approximately,
+    get_buffer_string,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Number of per message token counts remembered
+TOKEN_CACHE_SIZE = 10000
+
+# Content block types holding file payloads rather than text
+FILE_BLOCK_TYPES = {"file", "image", "image_url", "media", "audio"}
+
+SUMMARY_INSTRUCTION = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Extend the current summary with the new lines of conversation. Keep names, "
+    "identifiers, numbers, decisions and open questions needed to continue the "
+    "conversation. Reply with the updated summary only."
+)
+
+
+class ContextWindow:
+    """
+    Fits the conversation history into the model context window.
+
+    Token counts are estimated once per message and cached by message id so each
+    call only pays for the messages added since the previous one.
+    """
+
+    def __init__(self, context_length: int, config: ContextConfig):
+        self.context_length = context_length
+        self.config = config
+        self.token_cache: OrderedDict[str, int] = OrderedDict()
+
+    @property
+    def budget(self) -> int:
+        """Tokens available for the prompt"""
+        return max(self.context_length - self.config.reserve_tokens, 0)
+
+    def count(self, message: BaseMessage) -> int:
+        """Estimated number of tokens in the message"""
+        if message.id is None:
+            return count_tokens_approximately(
+                [message], chars_per_token=self.config.chars_per_token
+            )
+
+        tokens = self.token_cache.get(message.id)
+        if tokens is None:
+            tokens = count_tokens_approximately(
+                [message], chars_per_token=self.config.chars_per_token
+            )
+            self.token_cache[message.id] = tokens
+            if len(self.token_cache) > TOKEN_CACHE_SIZE:
+                self.token_cache.popitem(last=False)
+        else:
+            self.token_cache.move_to_end(message.id)
+
+        return tokens
+
+    def count_messages(self, messages: Sequence[BaseMessage]) -> int:
+        return sum(self.count(message) for message in messages)
+
+    def fit(
+        self, messages: Sequence[BaseMessage], reserved: int = 0
+    ) -> tuple[list[BaseMessage], list[BaseMessage]]:
+        """
+        Split the messages into (dropped, kept) where kept are the most recent messages
+        that fit the budget less the reserved tokens.
+        The kept messages always start at a human turn so tool calls are never separated from
+        their results, and the latest human turn is kept even if it alone exceeds the budget.
+        """
+        budget = self.budget - reserved
+
+        start = len(messages)
+        total = 0
+        for index in range(len(messages) - 1, -1, -1):
+            total += self.count(messages[index])
+            if total > budget:
+                break
+            start = index
+
+        last_human = max(
+            (
+                index
+                for index, message in enumerate(messages)
+                if isinstance(message, HumanMessage)
+            ),
+            default=0,
+        )
+        if start > last_human:
+            start = last_human
+        while not isinstance(messages[start], HumanMessage) and start < last_human:
+            start += 1
+
+        return list(messages[:start]), list(messages[start:])
+
+    def strip_consumed_files(
+        self, messages: Sequence[BaseMessage]
+    ) -> list[BaseMessage]:
+        """
+        Replacements (with the same ids) for uploaded files the model has already answered,
+        with the file payload swapped for a short placeholder.
+        A file is answered once a final reply (an AIMessage without tool calls) follows it,
+        so the model still sees the file on the calls following its tool calls.
+        """
+        replacements = []
+        answered = False
+
+        for message in reversed(messages):
+            if isinstance(message, AIMessage):
+                answered = answered or not message.tool_calls
+                continue
+            if not (
+                answered
+                and isinstance(message, HumanMessage)
+                and isinstance(message.content, list)
+            ):
+                continue
+
+            content = [
+                (
+                    {"type": "text", "text": file_placeholder(block)}
+                    if isinstance(block, dict) and block.get("type") in FILE_BLOCK_TYPES
+                    else block
+                )
+                for block in message.content
+            ]
+            if content != message.content:
+                replacements.append(message.model_copy(update={"content": content}))
+                self.token_cache.pop(message.id, None)
+
+        return replacements
+
+    async def summarise(
+        self, client: BaseChatModel, summary: str, dropped: Sequence[BaseMessage]
+    ) -> AIMessage:
+        """
+        Fold the dropped messages into the rolling summary.
+        The response is returned with its usage, its text is the new summary
+        """
+        prompt = [
+            SystemMessage(content=SUMMARY_INSTRUCTION),
+            HumanMessage(
+                content=f"Current summary:\n{summary or '(none)'}\n\n"
+                f"New lines of conversation:\n{get_buffer_string(dropped)}"
+            ),
+        ]
+        response = await client.ainvoke(prompt)
+        logger.debug(f"Summarised {len(dropped)} messages")
+        return response
+
+
+def summary_message(summary: str) -> SystemMessage:
+    """System message carrying the rolling summary of the earlier conversation"""
+    return SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")
+
+
+def file_placeholder(block: dict) -> str:
+    name = block.get("filename") or block.get("name") or "attachment"
+    return f"[File '{name}' was provided earlier and has been removed from the context]"
@@ -0,0 +1,308 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+from collections import OrderedDict, defaultdict
+from collections.abc import AsyncIterable, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+
+from chatbot.config import FileStoreConfig
+from langchain_core.messages import BaseMessage, HumanMessage
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+
+# source_type of content blocks that reference a file held in the FileStore
+STORE_SOURCE_TYPE = "store"
+
+
+class FileTooLargeError(ValueError):
+    """
+    Raised when a file exceeds the configured maximum size
+    """
+
+    def __init__(self, size: int, max_size: int):
+        super().__init__(f"File of {size} bytes exceeds the limit of {max_size} bytes")
+        self.size = size
+        self.max_size = max_size
+
+
+@dataclass(frozen=True)
+class StoredFile:
+    """
+    A file held in the FileStore, addressed by the SHA-256 of its content
+    """
+
+    sha256: str
+    size: int
+
+
+class FileStoreMetrics:
+    """
+    Prometheus metrics for the FileStore
+    """
+
+    def __init__(self, registry: CollectorRegistry | None = REGISTRY):
+        self.files = Gauge(
+            "file_store_files", "Number of files in the file store", registry=registry
+        )
+        self.bytes = Gauge(
+            "file_store_bytes", "Total size of the file store", registry=registry
+        )
+        self.uploads = Counter(
+            "file_store_uploads",
+            "Files saved to the file store, by whether the content was already held",
+            ["result"],
+            registry=registry,
+        )
+        self.evictions = Counter(
+            "file_store_evictions",
+            "Files evicted from the file store",
+            registry=registry,
+        )
+
+
+class FileStore:
+    """
+    Content addressed storage of uploaded files on local disk.
+
+    Files are streamed to disk in chunks so only a single chunk is held in memory, and the
+    conversation state only records a reference to the file. The bytes are read back and
+    encoded when the model is called.
+
+    Files are keyed by the SHA-256 of their content so the same document uploaded to many
+    conversations is held once. Each file counts the conversations referring to it and when
+    the store exceeds its size the least recently used files no conversation refers to are
+    evicted first.
+    """
+
+    def __init__(
+        self, config: FileStoreConfig, registry: CollectorRegistry | None = REGISTRY
+    ):
+        self.config = config
+        self.path = config.path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.metrics = FileStoreMetrics(registry=registry)
+
+        # Size of each file in least recently used order
+        self.files: OrderedDict[str, int] = OrderedDict()
+        # Conversations referring to each file
+        self.references: defaultdict[str, set[str]] = defaultdict(set)
+        # Base64 encodings of recently sent files in least recently used order
+        self.encoded: OrderedDict[str, str] = OrderedDict()
+        self.encoded_bytes = 0
+
+        for file in sorted(
+            (file for file in self.path.iterdir() if not file.name.startswith(".")),
+            key=lambda file: file.stat().st_mtime,
+        ):
+            self.files[file.name] = file.stat().st_size
+        self._update_metrics()
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self.files.values())
+
+    def file_path(self, sha256: str) -> Path:
+        return self.path / sha256
+
+    def _touch(self, sha256: str):
+        if sha256 in self.files:
+            self.files.move_to_end(sha256)
+
+    def _update_metrics(self):
+        self.metrics.files.set(len(self.files))
+        self.metrics.bytes.set(self.total_bytes)
+
+    async def save_stream(self, chunks: AsyncIterable[bytes]) -> StoredFile:
+        """
+        Write the chunks to the store, raising FileTooLargeError as soon as the size limit is exceeded.
+        If the store already holds the content the new copy is discarded.
+        """
+        digest = hashlib.sha256()
+        size = 0
+
+        fd, temp_name = tempfile.mkstemp(dir=self.path, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.config.max_file_bytes:
+                        raise FileTooLargeError(size, self.config.max_file_bytes)
+                    digest.update(chunk)
+                    await asyncio.to_thread(temp_file.write, chunk)
+
+            stored = StoredFile(sha256=digest.hexdigest(), size=size)
+            if stored.sha256 in self.files and self.file_path(stored.sha256).exists():
+                os.unlink(temp_name)
+                self.metrics.uploads.labels("duplicate").inc()
+            else:
+                os.replace(temp_name, self.file_path(stored.sha256))
+                self.metrics.uploads.labels("new").inc()
+        except BaseException:
+            if os.path.exists(temp_name):
+                os.unlink(temp_name)
+            raise
+
+        self.files[stored.sha256] = stored.size
+        self._touch(stored.sha256)
+        self._evict(keep=stored.sha256)
+        self._update_metrics()
+
+        logger.debug(f"Stored file {stored.sha256} ({stored.size} bytes)")
+        return stored
+
+    def add_reference(self, sha256: str, thread_id: str):
+        """Record that the conversation refers to the file"""
+        self.references[sha256].add(thread_id)
+
+    def release(self, messages: Sequence[BaseMessage], thread_id: str):
+        """Release the references the conversation holds through the file blocks in the messages"""
+        for reference in file_references(messages):
+            sha256 = reference["ref"]
+            self.references[sha256].discard(thread_id)
+            if not self.references[sha256]:
+                del self.references[sha256]
+
+    def release_thread(self, thread_id: str):
+        """
+        Release every reference the conversation holds, when it is deleted from the
+        checkpointer. May be called from the checkpointer's worker thread.
+        """
+        for sha256, threads in list(self.references.items()):
+            threads.discard(thread_id)
+            if not threads:
+                self.references.pop(sha256, None)
+
+    def _evict(self, keep: str | None = None):
+        """
+        Evict least recently used files until the store fits its size, preferring files
+        no conversation refers to
+        """
+        total = self.total_bytes
+        if total <= self.config.max_bytes:
+            return
+
+        candidates = [sha256 for sha256 in self.files if sha256 != keep]
+        candidates.sort(key=lambda sha256: bool(self.references.get(sha256)))
+
+        for sha256 in candidates:
+            if total <= self.config.max_bytes:
+                break
+            total -= self.files.pop(sha256)
+            self.references.pop(sha256, None)
+            self._forget_encoding(sha256)
+            self.file_path(sha256).unlink(missing_ok=True)
+            self.metrics.evictions.inc()
+            logger.info(f"Evicted file {sha256} from the file store")
+
+    async def load(self, sha256: str) -> bytes:
+        data = await asyncio.to_thread(self.file_path(sha256).read_bytes)
+        self._touch(sha256)
+        return data
+
+    async def load_base64(self, sha256: str) -> str:
+        """Base64 encoding of the file, memoised so files sent with every prompt are encoded once"""
+        encoded = self.encoded.get(sha256)
+        if encoded is not None:
+            self.encoded.move_to_end(sha256)
+            self._touch(sha256)
+            return encoded
+
+        encoded = base64.b64encode(await self.load(sha256)).decode("utf-8")
+
+        if len(encoded) <= self.config.encoded_cache_bytes:
+            self.encoded[sha256] = encoded
+            self.encoded_bytes += len(encoded)
+            while self.encoded_bytes > self.config.encoded_cache_bytes:
+                self._forget_encoding(next(iter(self.encoded)))
+
+        return encoded
+
+    def _forget_encoding(self, sha256: str):
+        encoded = self.encoded.pop(sha256, None)
+        if encoded is not None:
+            self.encoded_bytes -= len(encoded)
+
+    async def materialise(
+        self, messages: Sequence[BaseMessage]
+    ) -> Sequence[BaseMessage]:
+        """
+        Messages to send to the model, with file references replaced by the base64 encoded file content.
+        The messages held in the conversation state are not modified.
+        """
+        materialised = []
+        for message in messages:
+            if not (
+                isinstance(message, HumanMessage)
+                and isinstance(message.content, list)
+                and any(is_file_reference(block) for block in message.content)
+            ):
+                materialised.append(message)
+                continue
+
+            content = []
+            for block in message.content:
+                if is_file_reference(block):
+                    block = await self.file_block(block)
+                content.append(block)
+            materialised.append(message.model_copy(update={"content": content}))
+
+        return materialised
+
+    async def file_block(self, reference: dict) -> dict:
+        """
+        Base64 file content block for a file reference
+        """
+        try:
+            data = await self.load_base64(reference["ref"])
+        except FileNotFoundError:
+            logger.warning(f"File {reference['ref']} is no longer in the file store")
+            self.files.pop(reference["ref"], None)
+            return {
+                "type": "text",
+                "text": f"[File '{reference.get('filename')}' is no longer available]",
+            }
+
+        return {
+            "type": "file",
+            "source_type": "base64",
+            "data": data,
+            "mime_type": reference.get("mime_type"),
+            "filename": reference.get("filename"),
+        }
+
+
+def file_reference(name: str, mime_type: str, stored: StoredFile) -> dict:
+    """
+    Content block referencing a file in the FileStore
+    """
+    return {
+        "type": "file",
+        "source_type": STORE_SOURCE_TYPE,
+        "ref": stored.sha256,
+        "size": stored.size,
+        "mime_type": mime_type,
+        "filename": name,
+    }
+
+
+def is_file_reference(block) -> bool:
+    return isinstance(block, dict) and block.get("source_type") == STORE_SOURCE_TYPE
+
+
+def file_references(messages: Sequence[BaseMessage]) -> list[dict]:
+    """
+    File reference blocks held in the messages
+    """
+    return [
+        block
+        for message in messages
+        if isinstance(message, HumanMessage) and isinstance(message.content, list)
+        for block in message.content
+        if is_file_reference(block)
+    ]
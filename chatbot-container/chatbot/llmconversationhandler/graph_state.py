@@ -12,6 +12,10 @@ class AgentState(TypedDict):
 
     Attributes:
         messages: The list of messages that have been exchanged in the conversation.
+        summary: Rolling summary of older turns that no longer fit in the context window.
+        model: Name of the model tier the router chose for the next model call.
     """
 
     messages: Annotated[list[BaseMessage], add_messages]
+    summary: str
+    model: str
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from chatbot.config import RateLimitConfig
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+
+# Wait time buckets (seconds) for requests queued by the rate limiter
+RATE_LIMIT_WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class RateLimitExceededError(RuntimeError):
+    """
+    Raised when the rate limiter queue is full
+    """
+
+    def __init__(self, queued: int, retry_after: float):
+        super().__init__(
+            f"{queued} model calls are already waiting for the rate limiter"
+        )
+        self.queued = queued
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Bucket holding up to capacity tokens, refilled continuously at the rate per minute
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until the bucket holds the amount, 0 if it already does"""
+        self.refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+@dataclass
+class Waiter:
+    tokens: int
+    future: asyncio.Future
+
+
+class RateLimiter:
+    """
+    Client side limit of the requests and tokens per minute sent to the model deployment,
+    so requests wait here rather than being throttled by the provider.
+
+    Requests that cannot be sent at once are queued per conversation and the queues are
+    served round robin, so a conversation making many calls (eg tool loops) does not hold
+    up the others. Token counts are estimated before sending and corrected with the usage
+    reported by the model.
+    """
+
+    def __init__(
+        self, config: RateLimitConfig, registry: CollectorRegistry | None = REGISTRY
+    ):
+        self.config = config
+        self.requests = (
+            TokenBucket(config.requests_per_minute)
+            if config.requests_per_minute
+            else None
+        )
+        self.tokens = (
+            TokenBucket(config.tokens_per_minute) if config.tokens_per_minute else None
+        )
+        # Waiters of each conversation, and the conversations in the order they are served
+        self.queues: dict[str, deque[Waiter]] = {}
+        self.order: deque[str] = deque()
+        self.queued = 0
+        self.dispatcher: asyncio.Task | None = None
+
+        self.queue_metric = Gauge(
+            "llm_rate_limit_queue",
+            "Model calls waiting for the rate limiter",
+            registry=registry,
+        )
+        self.wait_metric = Histogram(
+            "llm_rate_limit_wait",
+            "Time model calls waited for the rate limiter",
+            buckets=RATE_LIMIT_WAIT_BUCKETS,
+            registry=registry,
+        )
+        self.rejected_metric = Counter(
+            "llm_rate_limit_rejections",
+            "Model calls rejected because the rate limiter queue was full",
+            registry=registry,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    def _wait_time(self, tokens: int) -> float:
+        return max(
+            self.requests.wait_time(1) if self.requests else 0.0,
+            self.tokens.wait_time(tokens) if self.tokens else 0.0,
+        )
+
+    def _backlog_time(self, tokens: int) -> float:
+        """Estimated seconds until the queued calls and a call of the tokens could be sent"""
+        times = [0.0]
+        if self.requests:
+            self.requests.refill()
+            times.append((self.queued + 1 - self.requests.tokens) / self.requests.rate)
+        if self.tokens:
+            queued_tokens = sum(
+                waiter.tokens for queue in self.queues.values() for waiter in queue
+            )
+            self.tokens.refill()
+            times.append(
+                (queued_tokens + tokens - self.tokens.tokens) / self.tokens.rate
+            )
+        return max(times)
+
+    def _take(self, tokens: int):
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(tokens)
+
+    async def acquire(self, conversation: str, tokens: int):
+        """Wait until a call of the estimated tokens may be sent for the conversation"""
+        if not self.enabled:
+            return
+
+        if not self.queued and self._wait_time(tokens) == 0:
+            self._take(tokens)
+            self.wait_metric.observe(0)
+            return
+
+        if self.queued >= self.config.max_queue:
+            self.rejected_metric.inc()
+            raise RateLimitExceededError(self.queued, self._backlog_time(tokens))
+
+        waiter = Waiter(tokens, asyncio.get_running_loop().create_future())
+        if conversation not in self.queues:
+            self.queues[conversation] = deque()
+            self.order.append(conversation)
+        self.queues[conversation].append(waiter)
+        self._update_queued(1)
+
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch())
+
+        start = time.perf_counter()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            self._discard(conversation, waiter)
+            raise
+        finally:
+            self.wait_metric.observe(time.perf_counter() - start)
+
+    def reconcile(self, estimated: int, actual: int):
+        """Correct the token bucket with the tokens the model reported using"""
+        if self.tokens and actual:
+            self.tokens.refill()
+            self.tokens.tokens -= actual - estimated
+
+    def _discard(self, conversation: str, waiter: Waiter):
+        queue = self.queues.get(conversation)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self._update_queued(-1)
+        if not queue:
+            del self.queues[conversation]
+            self.order.remove(conversation)
+
+    def _update_queued(self, change: int):
+        self.queued += change
+        self.queue_metric.set(self.queued)
+
+    async def _dispatch(self):
+        """Release queued calls round robin across conversations as the buckets refill"""
+        while self.order:
+            conversation = self.order[0]
+            waiter = self.queues[conversation][0]
+
+            # A caller cancelled since it queued may not have removed itself yet
+            if waiter.future.done():
+                self.queues[conversation].popleft()
+                self._update_queued(-1)
+                if not self.queues[conversation]:
+                    del self.queues[conversation]
+                    self.order.popleft()
+                continue
+
+            wait = self._wait_time(waiter.tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            self._take(waiter.tokens)
+            self.queues[conversation].popleft()
+            self._update_queued(-1)
+            waiter.future.set_result(None)
+
+            self.order.popleft()
+            if self.queues[conversation]:
+                self.order.append(conversation)
+            else:
+                del self.queues[conversation]
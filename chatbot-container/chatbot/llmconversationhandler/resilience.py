@@ -0,0 +1,366 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from typing import Any
+
+import httpx
+from chatbot.config import ResilienceConfig
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.config import ensure_config, merge_configs
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+
+# Latencies remembered per provider to estimate the p95 used as the hedge delay
+HEDGE_SAMPLES = 100
+# Latencies needed before requests are hedged
+HEDGE_MIN_SAMPLES = 20
+
+
+class ProvidersUnavailableError(RuntimeError):
+    """
+    Raised when the circuit of every provider is open
+    """
+
+
+class PartialStreamError(RuntimeError):
+    """
+    Raised when a call fails after streaming part of its reply. It is not retried or failed
+    over, as the text already streamed to the user would be sent again.
+    """
+
+
+class StreamWatcher(AsyncCallbackHandler):
+    """
+    Notes whether a call has streamed any text of its reply
+    """
+
+    def __init__(self):
+        self.streamed = False
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if token:
+            self.streamed = True
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Whether the error is a timeout, connection failure, throttling (429) or server error (5xx),
+    which may succeed if retried or sent to another provider
+    """
+    if isinstance(error, (TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+
+    # openai exceptions carry status_code, google api_core exceptions carry code
+    for status in (
+        getattr(error, "status_code", None),
+        getattr(error, "code", None),
+        getattr(getattr(error, "response", None), "status_code", None),
+    ):
+        if isinstance(status, int):
+            return status == 429 or status >= 500
+
+    name = type(error).__name__
+    return "Timeout" in name or "Connection" in name
+
+
+class CircuitBreaker:
+    """
+    Stops requests to a provider after consecutive failures, letting requests through
+    again once the reset timeout has passed. A failure while half open reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        return self.state != "open"
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class ResilienceMetrics:
+    """
+    Prometheus metrics for calls to the model providers
+    """
+
+    def __init__(self, registry: CollectorRegistry | None = REGISTRY):
+        self.requests = Counter(
+            "llm_provider_requests",
+            "Requests to each model provider by result",
+            ["provider", "result"],
+            registry=registry,
+        )
+        self.circuit_open = Gauge(
+            "llm_provider_circuit_open",
+            "Whether the circuit of each model provider is open",
+            ["provider"],
+            registry=registry,
+        )
+        self.failovers = Counter(
+            "llm_provider_failovers",
+            "Calls failed over from each model provider to the next",
+            ["provider"],
+            registry=registry,
+        )
+        self.hedges = Counter(
+            "llm_hedged_requests",
+            "Hedged requests started, and won by the hedge",
+            ["result"],
+            registry=registry,
+        )
+
+
+@dataclass
+class ResilienceState:
+    """
+    Circuit breakers, latencies and metrics shared by all the models of the process
+    """
+
+    config: ResilienceConfig
+    metrics: ResilienceMetrics
+    breakers: dict[str, CircuitBreaker] = field(default_factory=dict)
+    latencies: dict[str, deque[float]] = field(default_factory=dict)
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        return self.breakers.setdefault(
+            provider,
+            CircuitBreaker(
+                self.config.failure_threshold,
+                self.config.reset_timeout.total_seconds(),
+            ),
+        )
+
+    def provider_latencies(self, provider: str) -> deque[float]:
+        return self.latencies.setdefault(provider, deque(maxlen=HEDGE_SAMPLES))
+
+
+class ResilientChatModel:
+    """
+    Chat model calling a primary provider with failover to the others.
+
+    Each request runs with a timeout and is retried with jittered exponential backoff when it
+    fails with a retryable error. Consecutive failures open the circuit of the provider so
+    requests go straight to the next provider until it recovers.
+
+    With hedging enabled a second request is sent (to the next provider if one is available)
+    when the first has not answered within the p95 latency of the provider, and the first
+    reply wins. Hedged requests are not streamed token by token, as two streams would interleave.
+    A streamed request that fails after emitting text is not retried, raising PartialStreamError.
+
+    Call options (eg prompt_cache_key) are passed to the primary provider only.
+    """
+
+    def __init__(
+        self,
+        providers: Sequence[tuple[str, Runnable]],
+        config: ResilienceConfig,
+        timeout: float,
+        state: ResilienceState,
+    ):
+        self.providers = list(providers)
+        self.config = config
+        self.timeout = timeout
+        self.state = state
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs) -> "ResilientChatModel":
+        return ResilientChatModel(
+            [
+                (provider, model.bind_tools(tools, **kwargs))
+                for provider, model in self.providers
+            ],
+            self.config,
+            self.timeout,
+            self.state,
+        )
+
+    async def ainvoke(self, messages: Sequence[BaseMessage], **kwargs) -> AIMessage:
+        available = [
+            (index, provider, model)
+            for index, (provider, model) in enumerate(self.providers)
+            if self.state.breaker(provider).allow()
+        ]
+        if not available:
+            raise ProvidersUnavailableError("The circuit of every provider is open")
+
+        last_error = None
+        for position, (index, provider, model) in enumerate(available):
+            alternate = (
+                available[position + 1] if position + 1 < len(available) else None
+            )
+            try:
+                return await self._call_with_retries(
+                    provider,
+                    model,
+                    alternate,
+                    messages,
+                    kwargs if index == 0 else {},
+                )
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+                if alternate is not None:
+                    logger.warning(
+                        f"Provider {provider} failed ({e!r}), failing over to {alternate[1]}"
+                    )
+                    self.state.metrics.failovers.labels(provider).inc()
+
+        raise last_error
+
+    async def _call_with_retries(
+        self,
+        provider: str,
+        model: Runnable,
+        alternate: tuple[int, str, Runnable] | None,
+        messages: Sequence[BaseMessage],
+        kwargs: dict,
+    ) -> AIMessage:
+        breaker = self.state.breaker(provider)
+        backoff = self.config.backoff.total_seconds()
+
+        for attempt in range(self.config.max_retries + 1):
+            try:
+                return await self._hedged_call(
+                    provider, model, alternate, messages, kwargs
+                )
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.config.max_retries:
+                    raise
+                if not breaker.allow():
+                    logger.warning(f"Provider {provider}: circuit open")
+                    raise
+                delay = backoff * random.uniform(0.5, 1.5)
+                logger.info(
+                    f"Provider {provider} failed ({e!r}), retrying in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+                backoff = min(backoff * 2, self.config.backoff_max.total_seconds())
+
+    def hedge_delay(self, provider: str) -> float | None:
+        """The p95 latency of the provider, or None if requests are not hedged"""
+        if not self.config.hedge:
+            return None
+        latencies = self.state.provider_latencies(provider)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        p95 = sorted(latencies)[int(0.95 * (len(latencies) - 1))]
+        return max(p95, self.config.hedge_min_delay.total_seconds())
+
+    async def _hedged_call(
+        self,
+        provider: str,
+        model: Runnable,
+        alternate: tuple[int, str, Runnable] | None,
+        messages: Sequence[BaseMessage],
+        kwargs: dict,
+    ) -> AIMessage:
+        delay = self.hedge_delay(provider)
+        if delay is None:
+            return await self._call(provider, model, messages, kwargs, stream=True)
+
+        first = asyncio.create_task(
+            self._call(provider, model, messages, kwargs, stream=False)
+        )
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return first.result()
+
+            hedge_provider, hedge_model, hedge_kwargs = provider, model, kwargs
+            if alternate is not None:
+                _, hedge_provider, hedge_model = alternate
+                hedge_kwargs = {}
+            logger.info(f"Provider {provider}: no reply after {delay:.2f}s, hedging")
+            self.state.metrics.hedges.labels("started").inc()
+            second = asyncio.create_task(
+                self._call(
+                    hedge_provider, hedge_model, messages, hedge_kwargs, stream=False
+                )
+            )
+            tasks.add(second)
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.state.metrics.hedges.labels("won").inc()
+                        return task.result()
+
+            return first.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _call(
+        self,
+        provider: str,
+        model: Runnable,
+        messages: Sequence[BaseMessage],
+        kwargs: dict,
+        stream: bool,
+    ) -> AIMessage:
+        breaker = self.state.breaker(provider)
+        # Without callbacks the model does not emit streaming events. Streamed calls keep the
+        # callbacks of the caller, watched to tell whether any of the reply was streamed
+        watcher = StreamWatcher() if stream else None
+        config = (
+            merge_configs(ensure_config(), {"callbacks": [watcher]})
+            if stream
+            else {"callbacks": []}
+        )
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.timeout):
+                response = await model.ainvoke(messages, config=config, **kwargs)
+        except Exception as e:
+            if is_retryable(e):
+                breaker.record_failure()
+                result = "timeout" if isinstance(e, TimeoutError) else "retryable_error"
+            else:
+                result = "error"
+            self.state.metrics.requests.labels(provider, result).inc()
+            self.state.metrics.circuit_open.labels(provider).set(
+                breaker.state == "open"
+            )
+            if watcher is not None and watcher.streamed:
+                raise PartialStreamError(
+                    f"Provider {provider} failed after streaming part of the reply: {e!r}"
+                ) from e
+            raise
+
+        self.state.provider_latencies(provider).append(time.perf_counter() - start)
+        breaker.record_success()
+        self.state.metrics.requests.labels(provider, "success").inc()
+        self.state.metrics.circuit_open.labels(provider).set(0)
+        return response
@@ -0,0 +1,148 @@
+import logging
+import math
+import re
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from dataclasses import dataclass
+
+from chatbot.config import ResponseCacheConfig
+from chatbot.llmconversationhandler.cache import TTLCache
+from langchain_core.embeddings import Embeddings
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+
+def normalise_prompt(prompt: str) -> str:
+    """
+    Canonical form of a prompt: case folded, whitespace collapsed and trailing punctuation removed
+    """
+    return re.sub(r"\s+", " ", prompt.casefold()).strip().rstrip("?!. ")
+
+
+def cosine_similarity(a: list[float], b: list[float]) -> float:
+    dot = math.fsum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(math.fsum(x * x for x in a)) * math.sqrt(
+        math.fsum(y * y for y in b)
+    )
+    return dot / norm if norm else 0.0
+
+
+@dataclass
+class SemanticEntry:
+    scope: tuple[str, str]
+    vector: list[float]
+    reply: str
+    expiry: float
+
+
+class ResponseCache:
+    """
+    Cache of replies to prompts, used to answer repeated questions without calling the model.
+
+    Entries are scoped by the identity of the user and by a hash of the tool catalogue and
+    system prompt, so a change of either invalidates the replies produced before it.
+    Prompts match exactly once normalised or, in semantic mode, when the embedding of the
+    prompt is similar enough to that of a cached prompt.
+    """
+
+    def __init__(
+        self,
+        config: ResponseCacheConfig,
+        embeddings: Embeddings | None = None,
+        registry: CollectorRegistry | None = REGISTRY,
+    ):
+        self.config = config
+        self.embeddings = embeddings
+        self.exact = TTLCache(config.ttl, config.max_size)
+        # Most recently stored last
+        self.semantic: OrderedDict[int, SemanticEntry] = OrderedDict()
+        self._next_id = 0
+
+        if config.mode == "semantic" and embeddings is None:
+            raise ValueError("Semantic response cache requires an embedding model")
+
+        self.lookup_metric = Counter(
+            "response_cache",
+            "Response cache lookups",
+            ["result"],
+            registry=registry,
+        )
+        self.size_metric = Gauge(
+            "response_cache_entries",
+            "Number of replies in the response cache",
+            registry=registry,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.enabled
+
+    async def lookup(self, identity: str, catalogue: str, prompt: str) -> str | None:
+        """The cached reply to the prompt, or None"""
+        scope = (identity, catalogue)
+        normalised = normalise_prompt(prompt)
+
+        found, reply = self.exact.get((scope, normalised))
+        if not found and self.config.mode == "semantic":
+            reply = await self._semantic_lookup(scope, normalised)
+            found = reply is not None
+
+        self.lookup_metric.labels("hit" if found else "miss").inc()
+        return reply if found else None
+
+    async def store(
+        self,
+        identity: str,
+        catalogue: str,
+        prompt: str,
+        reply: str,
+        ttl: timedelta | None = None,
+    ):
+        """Cache the reply to the prompt for the ttl, or the configured ttl if shorter"""
+        ttl = min(ttl, self.config.ttl) if ttl is not None else self.config.ttl
+        if ttl <= timedelta(0):
+            return
+
+        scope = (identity, catalogue)
+        normalised = normalise_prompt(prompt)
+        self.exact.put((scope, normalised), reply, ttl)
+
+        if self.config.mode == "semantic":
+            vector = await self.embeddings.aembed_query(normalised)
+            self.semantic[self._next_id] = SemanticEntry(
+                scope, vector, reply, time.monotonic() + ttl.total_seconds()
+            )
+            self._next_id += 1
+            while len(self.semantic) > self.config.max_size:
+                self.semantic.popitem(last=False)
+
+        self.size_metric.set(len(self.exact))
+
+    async def _semantic_lookup(
+        self, scope: tuple[str, str], normalised: str
+    ) -> str | None:
+        now = time.monotonic()
+        for key in [key for key, entry in self.semantic.items() if entry.expiry < now]:
+            del self.semantic[key]
+
+        candidates = [entry for entry in self.semantic.values() if entry.scope == scope]
+        if not candidates:
+            return None
+
+        vector = await self.embeddings.aembed_query(normalised)
+        similarity, entry = max(
+            (
+                (cosine_similarity(vector, candidate.vector), candidate)
+                for candidate in candidates
+            ),
+            key=lambda match: match[0],
+        )
+        logger.debug(f"Response cache: best semantic match {similarity:.3f}")
+        return entry.reply if similarity >= self.config.similarity else None
+
+    def clear(self):
+        self.exact.clear()
+        self.semantic.clear()
+        self.size_metric.set(0)
@@ -1,13 +1,20 @@
 from dataclasses import dataclass
 from typing import Any
+import inspect
+import json
 from collections.abc import Sequence, Callable  # For List and Callable
 from chatbot.config.tool import ToolBoxConfig
+from chatbot.llmconversationhandler.cache import TTLCache
+from chatbot.metrics import timed
+from chatbot.tracing import Tracer
 from langchain_core.messages.tool import ToolCall, ToolMessage
 from langchain_core.tools.structured import StructuredTool
 import logging
 import asyncio
+from contextlib import AsyncExitStack, asynccontextmanager
 from pydantic_yaml import to_yaml_str
-from prometheus_client import REGISTRY, CollectorRegistry, Summary
+from langchain_core.runnables import RunnableConfig
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram
 
 import io
 from ruamel.yaml import YAML
@@ -17,6 +24,9 @@ yaml = YAML()
 
 logger = logging.getLogger(__name__)
 
+# Latency buckets (seconds) covering in-process tools through to slow MCP calls
+TOOL_LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
 
 @dataclass
 class ToolDefinition:
@@ -25,30 +35,80 @@ class ToolDefinition:
     name: str
     definition: Any
     tool: StructuredTool
+    cache: TTLCache | None = None
+    # Whether the tool reads the RunnableConfig, in which case results depend on the identity
+    reads_config: bool = False
+
+
+def tool_reads_config(tool: StructuredTool) -> bool:
+    """Whether the tool function takes a RunnableConfig argument"""
+    function = getattr(tool, "coroutine", None) or getattr(tool, "func", None)
+    if function is None:
+        return False
+    return any(
+        parameter.annotation in (RunnableConfig, "RunnableConfig")
+        for parameter in inspect.signature(function).parameters.values()
+    )
+
+
+def cache_key(tool_call: ToolCall, identity: str | None) -> str:
+    """Canonical form of the tool call arguments (and identity) used as the cache key"""
+    return json.dumps(
+        [identity, tool_call["args"]],
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
 
 
 class ToolRegistry:
+
     def __init__(
         self,
         toolboxConfig: ToolBoxConfig,
         registry: CollectorRegistry | None = REGISTRY,
+        tracer: Tracer | None = None,
     ):
         self.registry: dict[str, ToolDefinition] = {}
         self.toolboxConfig = toolboxConfig
+        self.tracer = tracer or Tracer()
         # Load the tool definition as dict from the list form (List form is easier to manage in k8s (ie lists enable replace vs change))
         self.tool_definition_dict = {
             tool.name: tool for tool in self.toolboxConfig.tools
         }
+        # Limits are process wide: one semaphore across all tools and one per tool sized from max_instances
+        self.concurrency = asyncio.Semaphore(self.toolboxConfig.max_concurrent)
+        self.tool_semaphores: dict[str, asyncio.Semaphore] = {}
+
         self.prometheus_registry = registry
-        self.tool_usage_metric = Summary(
+        self.tool_usage_metric = Histogram(
             "tool_usage",
-            "Summary of tool usage",
+            "Latency of tool calls",
+            ["tool_name"],
+            buckets=TOOL_LATENCY_BUCKETS,
+            registry=registry,
+        )
+        self.tool_inflight_metric = Gauge(
+            "tool_inflight",
+            "Number of tool calls executing",
             ["tool_name"],
             registry=registry,
         )
+        self.tool_queued_metric = Gauge(
+            "tool_queued",
+            "Number of tool calls waiting for a concurrency slot",
+            ["tool_name"],
+            registry=registry,
+        )
+        self.tool_cache_metric = Counter(
+            "tool_cache",
+            "Tool result cache lookups",
+            ["tool_name", "result"],
+            registry=registry,
+        )
 
     def all_tools(self) -> Sequence[StructuredTool]:
-        print(f"ToolRegistry.all_tools: {self.registry}")
+        logger.debug(f"ToolRegistry.all_tools: {list(self.registry)}")
 
         return [mytool.tool for mytool in self.registry.values()]
 
@@ -72,53 +132,131 @@ class ToolRegistry:
             )
             raise ValueError(f"Tool {tool_name} is not configured")
 
-        print(tool.tool_call_schema)
+        logger.debug(f"Registering tool: {tool_name}")
         # buf = io.StringIO()
         # yaml.dump(tool.tool_call_schema.model_json_schema(), buf)
 
         # logger.info(f"Registering tool: {tool_name} with schema:\n{buf.getvalue()}")
 
+        definition = self.tool_definition_dict[tool_name]
+
         self.registry[tool_name] = ToolDefinition(
             name=tool_name,
             tool=tool,
-            definition=self.tool_definition_dict[tool_name],
+            definition=definition,
+            cache=(
+                TTLCache(definition.cache_ttl, definition.cache_size)
+                if definition.cacheable and definition.cache_ttl
+                else None
+            ),
+            reads_config=tool_reads_config(tool),
+        )
+        self.tool_semaphores.setdefault(
+            tool_name,
+            asyncio.Semaphore(self.tool_definition_dict[tool_name].max_instances),
         )
 
         logger.debug(f"Tool registered: {tool_name}")
 
+    def unregister_tool(self, tool_name: str) -> None:
+        """Removes a tool. Calls already running complete, later calls are answered with an error."""
+        self.registry.pop(tool_name, None)
+        logger.debug(f"Tool unregistered: {tool_name}")
+
+    def is_configured(self, tool_name: str) -> bool:
+        return tool_name in self.tool_definition_dict
+
+    @asynccontextmanager
+    async def _slot(self, tool_name: str):
+        """Hold a concurrency slot of both the tool and the toolbox, waiting for them if needed"""
+        async with AsyncExitStack() as stack:
+            with self.tool_queued_metric.labels(tool_name).track_inprogress():
+                await stack.enter_async_context(self.tool_semaphores[tool_name])
+                await stack.enter_async_context(self.concurrency)
+            yield
+
     async def perform_tool_actions(
-        self, parts: Sequence[ToolCall]
+        self, parts: Sequence[ToolCall], config: RunnableConfig | None = None
     ) -> Sequence[ToolMessage]:
         """Performs actions using the registered tools.
-        Reply back with an array to match what was called
+        Reply back with an array to match what was called.
+        The calls run concurrently within the process wide limits. If the caller is cancelled
+        all outstanding calls are cancelled with it.
+        The config is passed to the tools so they can read the identity of the conversation.
         """
-        semaphore = asyncio.Semaphore(self.toolboxConfig.max_concurrent)
-
-        async def sem_task(tool: ToolCall) -> ToolMessage:
-            async with semaphore:
-                return await self.perform_tool_action(tool)
-
-        tasks = [sem_task(part) for part in parts]
-        return await asyncio.gather(*tasks)
-
-    async def perform_tool_action(self, tool_call: ToolCall) -> ToolMessage:
-        """Performs an action using a single tool call part."""
-
+        async with asyncio.TaskGroup() as group:
+            tasks = [
+                group.create_task(self.perform_tool_action(part, config))
+                for part in parts
+            ]
+
+        return [task.result() for task in tasks]
+
+    async def perform_tool_action(
+        self, tool_call: ToolCall, config: RunnableConfig | None = None
+    ) -> ToolMessage:
+        """Performs an action using a single tool call part.
+        The call waits for a slot of both the tool and the toolbox, then runs with the tool timeout.
+        """
+        with self.tracer.span("tool", **{"tool.name": tool_call["name"]}) as span:
+            message = await self._perform_tool_action(tool_call, config)
+            span.set_attribute("tool.status", message.status)
+            return message
+
+    async def _perform_tool_action(
+        self, tool_call: ToolCall, config: RunnableConfig | None = None
+    ) -> ToolMessage:
         logger.debug(f"Received tool call: {tool_call}")
 
         tool_name = tool_call["name"]
 
-        try:
-            # Get the function from the registry
-            declaration = self.registry.get(tool_name)
+        # Get the function from the registry
+        declaration = self.registry.get(tool_name)
 
-            print(f"registry: {self.registry}")
+        if declaration is None:
+            # The model may call a tool removed by a catalogue refresh during the turn
+            logger.warning(f"Tool {tool_name} is not registered")
+            return ToolMessage(
+                content=f"Error executing tool: {tool_name} is not available, do not call it again",
+                tool_call_id=tool_call["id"],
+                status="error",
+            )
+
+        logger.debug(f"Tool declaration found: {declaration}")
 
-            logger.debug(f"Tool declaration found: {declaration}")
+        timeout = declaration.definition.timeout.total_seconds()
 
-            # Call the function with its arguments
-            with self.tool_usage_metric.labels(tool_name).time():
-                result = await declaration.tool.ainvoke(tool_call["args"])
+        if declaration.cache is not None:
+            identity = (
+                (config or {}).get("configurable", {}).get("identity")
+                if declaration.reads_config
+                else None
+            )
+            key = cache_key(tool_call, identity)
+            found, result = declaration.cache.get(key)
+            self.tool_cache_metric.labels(tool_name, "hit" if found else "miss").inc()
+            if found:
+                logger.debug(f"Tool {tool_name} result served from cache")
+                return ToolMessage(
+                    content=result,
+                    tool_call_id=tool_call["id"],
+                    status="success",
+                )
+
+        try:
+            async with self._slot(tool_name):
+                with (
+                    self.tool_inflight_metric.labels(tool_name).track_inprogress(),
+                    timed(self.tool_usage_metric.labels(tool_name)),
+                ):
+                    # Call the function with its arguments
+                    async with asyncio.timeout(timeout):
+                        result = await declaration.tool.ainvoke(
+                            tool_call["args"], config=config
+                        )
+
+            if declaration.cache is not None:
+                declaration.cache.put(key, result)
 
             return ToolMessage(
                 content=result,
@@ -126,6 +264,13 @@ class ToolRegistry:
                 status="success",
             )
 
+        except TimeoutError:
+            logger.error(f"Tool {tool_name} timed out after {timeout}s")
+            return ToolMessage(
+                content=f"Error executing tool: timed out after {timeout} seconds",
+                tool_call_id=tool_call["id"],
+                status="error",
+            )
         except Exception as e:
             logger.error(f"Error executing tool {tool_name}: {str(e)}")
             return ToolMessage(
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+
+from chatbot.config import TurnQueueConfig
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationBusyError(RuntimeError):
+    """
+    Raised when a conversation already has the maximum number of prompts waiting
+    """
+
+
+@dataclass
+class Turn:
+    """
+    A turn of a conversation, answering one or more prompts
+    """
+
+    prompts: list[str]
+    # Set by the caller running the turn, and passed to the callers whose prompts it answered
+    reply: str | None = None
+    # Whether the prompt was answered by a turn another caller ran
+    coalesced: bool = False
+
+
+@dataclass
+class PendingPrompt:
+    prompt: str
+    # Resolved with the turn that answered the prompt when another caller ran it
+    turn: asyncio.Future
+
+
+@dataclass
+class ConversationQueue:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    pending: list[PendingPrompt] = field(default_factory=list)
+    # Callers waiting for or running a turn, the queue is dropped when there are none
+    users: int = 0
+
+
+class TurnQueue:
+    """
+    Serialises the turns of each conversation so concurrent messages do not race on the
+    conversation state, while turns of different conversations run concurrently.
+
+    Prompts arriving while a turn of the conversation runs wait for it, then the prompts
+    waiting are answered together by a single turn run by the first of their callers. The
+    other callers receive the reply of that turn rather than starting turns of their own.
+    """
+
+    def __init__(
+        self, config: TurnQueueConfig, registry: CollectorRegistry | None = REGISTRY
+    ):
+        self.config = config
+        self.queues: dict[str, ConversationQueue] = {}
+
+        self.pending_metric = Gauge(
+            "conversation_pending_prompts",
+            "Prompts waiting for the turn of their conversation",
+            registry=registry,
+        )
+        self.coalesced_metric = Counter(
+            "conversation_coalesced_prompts",
+            "Prompts answered by a turn started by an earlier prompt",
+            registry=registry,
+        )
+        self.rejected_metric = Counter(
+            "conversation_busy_rejections",
+            "Prompts rejected because their conversation had too many waiting",
+            registry=registry,
+        )
+
+    @asynccontextmanager
+    async def _use(self, thread_id: str) -> AsyncIterator[ConversationQueue]:
+        queue = self.queues.setdefault(thread_id, ConversationQueue())
+        queue.users += 1
+        try:
+            yield queue
+        finally:
+            queue.users -= 1
+            if not queue.users:
+                del self.queues[thread_id]
+
+    @asynccontextmanager
+    async def exclusive(self, thread_id: str) -> AsyncIterator[None]:
+        """Hold the conversation between turns, eg to add messages to its state"""
+        async with self._use(thread_id) as queue, queue.lock:
+            yield
+
+    @asynccontextmanager
+    async def turn(self, thread_id: str, prompt: str) -> AsyncIterator[Turn]:
+        """
+        Wait for the turn of the conversation to answer the prompt.
+        The caller runs the turn, answering all its prompts and setting its reply, unless
+        the turn is coalesced, in which case it holds the reply of the turn that answered it.
+        """
+        async with self._use(thread_id) as queue:
+            if len(queue.pending) >= self.config.max_pending:
+                self.rejected_metric.inc()
+                raise ConversationBusyError(
+                    f"Conversation {thread_id} has {len(queue.pending)} prompts waiting"
+                )
+
+            pending = PendingPrompt(prompt, asyncio.get_running_loop().create_future())
+            queue.pending.append(pending)
+            self.pending_metric.inc()
+
+            try:
+                await queue.lock.acquire()
+            except asyncio.CancelledError:
+                self._discard(queue, pending)
+                raise
+
+            try:
+                if pending.turn.done():
+                    yield pending.turn.result()
+                    return
+
+                if self.config.coalesce_window:
+                    # Let rapid fire messages arrive to be answered with this one
+                    try:
+                        await asyncio.sleep(self.config.coalesce_window.total_seconds())
+                    except asyncio.CancelledError:
+                        self._discard(queue, pending)
+                        raise
+
+                batch = queue.pending[: self.config.coalesce_max]
+                del queue.pending[: len(batch)]
+                self.pending_metric.dec(len(batch))
+                if len(batch) > 1:
+                    logger.debug(
+                        f"Conversation {thread_id}: answering {len(batch)} prompts in one turn"
+                    )
+                    self.coalesced_metric.inc(len(batch) - 1)
+
+                turn = Turn(prompts=[waiting.prompt for waiting in batch])
+                try:
+                    yield turn
+                except BaseException as e:
+                    for waiting in batch[1:]:
+                        waiting.turn.set_exception(e)
+                    raise
+
+                coalesced = Turn(prompts=turn.prompts, reply=turn.reply, coalesced=True)
+                for waiting in batch[1:]:
+                    waiting.turn.set_result(coalesced)
+            finally:
+                queue.lock.release()
+
+    def _discard(self, queue: ConversationQueue, pending: PendingPrompt):
+        if pending in queue.pending:
+            queue.pending.remove(pending)
+            self.pending_metric.dec()
@@ -0,0 +1,144 @@
+import datetime
+import logging
+
+from chatbot.config import UsageConfig
+from langchain_core.messages.ai import UsageMetadata
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+
+# Prices are per million tokens
+PRICE_UNIT_TOKENS = 1_000_000
+
+
+class TokenBudgetExceededError(RuntimeError):
+    """
+    Raised when an identity has used its daily token budget
+    """
+
+    def __init__(self, identity: str, used: int, budget: int):
+        super().__init__(
+            f"Identity {identity} has used {used} of its {budget} tokens today"
+        )
+        self.identity = identity
+        self.used = used
+        self.budget = budget
+
+
+class UsageLedger:
+    """
+    Accounts the tokens used by each model call to the model tier and the identity it was
+    made for, estimating the cost from the configured prices, and the tokens tool results
+    add to the prompts.
+
+    Each identity may be given a daily token budget. Turns of an identity that has used
+    its budget are refused until the next day (UTC), turns already running are completed
+    so a budget may be overrun by the tokens of one turn.
+    """
+
+    def __init__(
+        self, config: UsageConfig, registry: CollectorRegistry | None = REGISTRY
+    ):
+        self.config = config
+        # Tokens used by each identity on the current day
+        self.day = today()
+        self.used: dict[str, int] = {}
+
+        self.tokens_metric = Counter(
+            "llm_identity_tokens",
+            "Tokens used by model tier, identity and type (input, cached input or output)",
+            ["model", "identity", "type"],
+            registry=registry,
+        )
+        self.cost_metric = Counter(
+            "llm_estimated_cost",
+            "Estimated cost of model calls by model tier and identity, in the currency of the configured prices",
+            ["model", "identity"],
+            registry=registry,
+        )
+        self.daily_metric = Gauge(
+            "llm_identity_daily_tokens",
+            "Tokens used today (UTC) by identity",
+            ["identity"],
+            registry=registry,
+        )
+        self.tool_tokens_metric = Counter(
+            "llm_tool_result_tokens",
+            "Estimated prompt tokens added by tool results, by tool",
+            ["tool_name"],
+            registry=registry,
+        )
+        self.rejected_metric = Counter(
+            "llm_budget_rejections",
+            "Turns refused because the identity had used its daily token budget",
+            ["identity"],
+            registry=registry,
+        )
+
+    def budget(self, identity: str) -> int | None:
+        """The daily token budget of the identity, None if unlimited"""
+        return self.config.identity_daily_tokens.get(identity, self.config.daily_tokens)
+
+    def used_today(self, identity: str) -> int:
+        self._roll_over()
+        return self.used.get(identity, 0)
+
+    def check(self, identity: str):
+        """Raise TokenBudgetExceededError if the identity has used its budget for today"""
+        budget = self.budget(identity)
+        if budget is None:
+            return
+        used = self.used_today(identity)
+        if used >= budget:
+            self.rejected_metric.labels(identity).inc()
+            raise TokenBudgetExceededError(identity, used, budget)
+
+    def record(
+        self, tier: str, model: str, identity: str, usage: UsageMetadata
+    ) -> float | None:
+        """
+        Account the usage reported for a call of the model of the tier.
+        Returns the estimated cost, None if the model has no price.
+        """
+        input_tokens = usage.get("input_tokens", 0)
+        output_tokens = usage.get("output_tokens", 0)
+        cached = usage.get("input_token_details", {}).get("cache_read", 0) or 0
+
+        self.tokens_metric.labels(tier, identity, "input").inc(input_tokens - cached)
+        self.tokens_metric.labels(tier, identity, "cached").inc(cached)
+        self.tokens_metric.labels(tier, identity, "output").inc(output_tokens)
+
+        self._roll_over()
+        self.used[identity] = self.used.get(identity, 0) + usage.get(
+            "total_tokens", input_tokens + output_tokens
+        )
+        self.daily_metric.labels(identity).set(self.used[identity])
+
+        price = self.config.prices.get(model)
+        if price is None:
+            return None
+        cached_price = price.input if price.cached_input is None else price.cached_input
+        cost = (
+            (input_tokens - cached) * price.input
+            + cached * cached_price
+            + output_tokens * price.output
+        ) / PRICE_UNIT_TOKENS
+        self.cost_metric.labels(tier, identity).inc(cost)
+        return cost
+
+    def record_tool(self, tool_name: str, tokens: int):
+        """Account the prompt tokens added by a tool result"""
+        self.tool_tokens_metric.labels(tool_name).inc(tokens)
+
+    def _roll_over(self):
+        """Start counting afresh when the day changes"""
+        if (day := today()) != self.day:
+            logger.debug(f"Usage: new day {day}, resetting daily token counts")
+            self.day = day
+            self.used.clear()
+            self.daily_metric.clear()
+
+
+def today() -> datetime.date:
+    return datetime.datetime.now(datetime.timezone.utc).date()
@@ -1,12 +1,17 @@
+import asyncio
 from dataclasses import dataclass, field
 import logging
+import time
 from aiohttp import web
 from chatbot.config import ServiceConfig
+from chatbot.config.tool import McpConfig
+from chatbot.mcp.pool import MCPSessionPools
 from langchain_mcp_adapters.client import MultiServerMCPClient
 from chatbot import keys
 from langchain_core.tools.structured import StructuredTool
 from langchain_core.documents.base import Blob
 from langchain_core.messages import AIMessage, HumanMessage
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +20,108 @@ logger = logging.getLogger(__name__)
 class MCPObjects:
     tools: list[StructuredTool] = field(default_factory=list)
     resources: dict[str, list[Blob]] = field(default_factory=dict)
-    prompts: dict[str, list[HumanMessage | AIMessage]] = field(default_factory=dict)
+    prompts: dict[str, dict[str, list[HumanMessage | AIMessage]]] = field(
+        default_factory=dict
+    )
+    # Names of the tools provided by each server
+    servers: dict[str, list[str]] = field(default_factory=dict)
+    # Servers that failed discovery
+    unavailable: list[str] = field(default_factory=list)
+
+
+@dataclass
+class MCPServerObjects:
+    """
+    Tools, resources and prompts discovered from a single MCP server
+    """
+
+    tools: list[StructuredTool]
+    resources: list[Blob]
+    prompts: dict[str, list[HumanMessage | AIMessage]]
+
+
+class MCPMetrics:
+    """
+    Prometheus metrics for MCP discovery
+    """
+
+    def __init__(self, registry: CollectorRegistry | None = REGISTRY):
+        self.discovery_seconds = Gauge(
+            "mcp_discovery_seconds",
+            "Time taken to discover the tools, resources and prompts of each MCP server",
+            ["server"],
+            registry=registry,
+        )
+        self.discovery_failures = Counter(
+            "mcp_discovery_failures",
+            "Failed discoveries of each MCP server",
+            ["server"],
+            registry=registry,
+        )
+
+
+async def discover_server(
+    client: MultiServerMCPClient | MCPSessionPools, mcp: McpConfig
+) -> MCPServerObjects:
+    """
+    Discover the tools, resources and prompts of a server with all requests made concurrently
+    """
+    async with asyncio.timeout(mcp.timeout.total_seconds()):
+        async with asyncio.TaskGroup() as tg:
+            tools = tg.create_task(client.get_tools(server_name=mcp.name))
+            resources = tg.create_task(client.get_resources(mcp.name))
+            prompts = {
+                prompt: tg.create_task(client.get_prompt(mcp.name, prompt))
+                for prompt in mcp.prompts
+            }
+
+    return MCPServerObjects(
+        tools=tools.result(),
+        resources=resources.result(),
+        prompts={prompt: task.result() for prompt, task in prompts.items()},
+    )
+
+
+async def discover(
+    client: MultiServerMCPClient | MCPSessionPools,
+    mcps: list[McpConfig],
+    metrics: MCPMetrics,
+) -> MCPObjects:
+    """
+    Discover all the MCP servers concurrently.
+    Servers that fail or time out are logged and left out so the service starts with those that responded.
+    """
+
+    async def timed_discover_server(mcp: McpConfig) -> MCPServerObjects:
+        start = time.perf_counter()
+        try:
+            return await discover_server(client, mcp)
+        finally:
+            metrics.discovery_seconds.labels(mcp.name).set(time.perf_counter() - start)
+
+    results = await asyncio.gather(
+        *(timed_discover_server(mcp) for mcp in mcps), return_exceptions=True
+    )
+
+    mcpObjects = MCPObjects()
+    for mcp, result in zip(mcps, results):
+        if isinstance(result, BaseException):
+            if isinstance(result, TimeoutError):
+                logger.error(
+                    f"MCP server {mcp.name} did not respond within {mcp.timeout}"
+                )
+            else:
+                logger.error(f"MCP server {mcp.name} discovery failed: {result!r}")
+            metrics.discovery_failures.labels(mcp.name).inc()
+            mcpObjects.unavailable.append(mcp.name)
+            continue
+
+        mcpObjects.tools.extend(result.tools)
+        mcpObjects.servers[mcp.name] = [tool.name for tool in result.tools]
+        mcpObjects.resources[mcp.name] = result.resources
+        mcpObjects.prompts[mcp.name] = result.prompts
+
+    return mcpObjects
 
 
 async def connect_to_mcp_server(app):
@@ -34,28 +140,63 @@ async def connect_to_mcp_server(app):
         }
     )
 
-    mcpObjects = MCPObjects(
-        tools=await client.get_tools(),
-        resources={
-            mcp.name: await client.get_resources(mcp.name)
-            for mcp in toolbox_config.mcps
-        },
-        prompts={
-            mcp.name: {
-                prompt: await client.get_prompt(mcp.name, prompt)
-                for prompt in mcp.prompts
-            }
-            for mcp in toolbox_config.mcps
-        },
-    )
+    registry = REGISTRY if keys.metrics not in app else app[keys.metrics]
+
+    # Tools are loaded over the pooled sessions so calls reuse them rather than connecting per call
+    pools = MCPSessionPools(client, toolbox_config.mcps, registry=registry)
+    pools.start()
+
+    app[keys.mcpclient] = pools
+    app[keys.mcpmetrics] = MCPMetrics(registry=registry)
 
+    start = time.perf_counter()
+    mcpObjects = await discover(pools, toolbox_config.mcps, app[keys.mcpmetrics])
+
+    logger.info(
+        f"MCP discovery took {time.perf_counter() - start:.2f}s, unavailable servers: {mcpObjects.unavailable}"
+    )
     logger.info(f"MCP Objects = {mcpObjects}")
 
     app[keys.mcpobjects] = mcpObjects
 
 
+async def rediscover(app: web.Application) -> MCPObjects:
+    """
+    Discover the MCP servers again and replace the MCP objects of the app.
+    Servers that are unavailable keep the objects from the previous discovery so a
+    transient failure does not withdraw their tools.
+    """
+    config: ServiceConfig = app[keys.config]
+    previous: MCPObjects = app[keys.mcpobjects]
+
+    mcpObjects = await discover(
+        app[keys.mcpclient], config.myai.toolbox.mcps, app[keys.mcpmetrics]
+    )
+
+    for server in mcpObjects.unavailable:
+        if server not in previous.servers:
+            continue
+        names = set(previous.servers[server])
+        mcpObjects.tools.extend(tool for tool in previous.tools if tool.name in names)
+        mcpObjects.servers[server] = previous.servers[server]
+        mcpObjects.resources[server] = previous.resources.get(server, [])
+        mcpObjects.prompts[server] = previous.prompts.get(server, {})
+
+    app[keys.mcpobjects] = mcpObjects
+    return mcpObjects
+
+
+async def close_mcp_sessions(app: web.Application):
+    """
+    Close the MCP sessions on shutdown
+    """
+    if keys.mcpclient in app:
+        await app[keys.mcpclient].close()
+
+
 def mcp_app_create(app: web.Application, config: ServiceConfig) -> web.Application:
 
     app.on_startup.append(connect_to_mcp_server)
+    app.on_cleanup.append(close_mcp_sessions)
 
     return app
@@ -0,0 +1,237 @@
+import asyncio
+import itertools
+import logging
+import random
+import time
+from collections.abc import Sequence
+
+from chatbot.config.tool import McpConfig
+from langchain_core.documents.base import Blob
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import BaseTool
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.prompts import load_mcp_prompt
+from langchain_mcp_adapters.resources import load_mcp_resources
+from langchain_mcp_adapters.tools import load_mcp_tools
+from mcp import ClientSession
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+
+# Latency buckets (seconds) for requests to MCP servers
+MCP_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class MCPSessionUnavailableError(RuntimeError):
+    """
+    Raised when no session to an MCP server is connected within its timeout
+    """
+
+
+class MCPSessionMetrics:
+    """
+    Prometheus metrics for the MCP session pools
+    """
+
+    def __init__(self, registry: CollectorRegistry | None = REGISTRY):
+        self.sessions = Gauge(
+            "mcp_sessions",
+            "Number of connected sessions to each MCP server",
+            ["server"],
+            registry=registry,
+        )
+        self.connects = Counter(
+            "mcp_session_connects",
+            "Sessions established to each MCP server, including reconnects",
+            ["server"],
+            registry=registry,
+        )
+        self.disconnects = Counter(
+            "mcp_session_disconnects",
+            "Sessions to each MCP server lost or failing to connect",
+            ["server"],
+            registry=registry,
+        )
+        self.requests = Histogram(
+            "mcp_request",
+            "Latency of requests to each MCP server",
+            ["server", "method"],
+            buckets=MCP_LATENCY_BUCKETS,
+            registry=registry,
+        )
+        self.request_failures = Counter(
+            "mcp_request_failures",
+            "Failed requests to each MCP server",
+            ["server", "method"],
+            registry=registry,
+        )
+
+
+class MCPSessionPool:
+    """
+    Pool of long lived sessions to a single MCP server.
+
+    Each session is held open by its own task, which pings the server every health interval
+    and reconnects with exponential backoff (and jitter) when the session fails.
+    Requests are spread across the connected sessions; an MCP session multiplexes concurrent
+    requests so they are not checked out exclusively.
+
+    The pool offers the ClientSession methods used by the langchain MCP adapters so it can be
+    passed to them in place of a session, and tools loaded through it call the server
+    over the pooled sessions instead of opening a session per call.
+    """
+
+    def __init__(
+        self,
+        client: MultiServerMCPClient,
+        config: McpConfig,
+        metrics: MCPSessionMetrics,
+    ):
+        self.client = client
+        self.config = config
+        self.name = config.name
+        self.metrics = metrics
+        self.sessions: list[ClientSession] = []
+        self.connected = asyncio.Event()
+        self.tasks: list[asyncio.Task] = []
+        self._next = itertools.count()
+
+    def start(self):
+        """Start the tasks holding the sessions open"""
+        self.tasks = [
+            asyncio.create_task(self._hold_session(), name=f"mcp-{self.name}-{index}")
+            for index in range(self.config.sessions)
+        ]
+
+    async def close(self):
+        """Close all sessions"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _hold_session(self):
+        backoff = self.config.reconnect_backoff.total_seconds()
+        while True:
+            try:
+                async with self.client.session(self.name) as session:
+                    logger.info(f"MCP server {self.name}: session connected")
+                    self.metrics.connects.labels(self.name).inc()
+                    backoff = self.config.reconnect_backoff.total_seconds()
+                    self._add(session)
+                    try:
+                        await self._check_health(session)
+                    finally:
+                        self._remove(session)
+            except Exception as e:
+                logger.warning(f"MCP server {self.name}: session failed: {e!r}")
+
+            self.metrics.disconnects.labels(self.name).inc()
+            delay = backoff * random.uniform(0.5, 1.5)
+            logger.info(f"MCP server {self.name}: reconnecting in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            backoff = min(
+                backoff * 2, self.config.reconnect_backoff_max.total_seconds()
+            )
+
+    async def _check_health(self, session: ClientSession):
+        """Ping the server until it stops responding"""
+        interval = self.config.health_interval.total_seconds()
+        while True:
+            await asyncio.sleep(interval)
+            async with asyncio.timeout(self.config.timeout.total_seconds()):
+                await session.send_ping()
+
+    def _add(self, session: ClientSession):
+        self.sessions.append(session)
+        self.connected.set()
+        self.metrics.sessions.labels(self.name).set(len(self.sessions))
+
+    def _remove(self, session: ClientSession):
+        self.sessions.remove(session)
+        if not self.sessions:
+            self.connected.clear()
+        self.metrics.sessions.labels(self.name).set(len(self.sessions))
+
+    async def session(self) -> ClientSession:
+        """
+        A connected session, waiting up to the timeout for one to connect.
+        Raises MCPSessionUnavailableError if none connects in time.
+        """
+        timeout = self.config.timeout.total_seconds()
+        try:
+            async with asyncio.timeout(timeout):
+                # The pool may be drained again (eg by a failed ping) before this task resumes
+                while not self.sessions:
+                    await self.connected.wait()
+        except TimeoutError:
+            raise MCPSessionUnavailableError(
+                f"MCP server {self.name}: no session connected within {timeout}s"
+            ) from None
+        return self.sessions[next(self._next) % len(self.sessions)]
+
+    async def request(self, method: str, *args, **kwargs):
+        """Call a ClientSession method on one of the connected sessions"""
+        session = await self.session()
+        start = time.perf_counter()
+        try:
+            return await getattr(session, method)(*args, **kwargs)
+        except Exception:
+            self.metrics.request_failures.labels(self.name, method).inc()
+            raise
+        finally:
+            self.metrics.requests.labels(self.name, method).observe(
+                time.perf_counter() - start
+            )
+
+    async def call_tool(self, *args, **kwargs):
+        return await self.request("call_tool", *args, **kwargs)
+
+    async def list_tools(self, *args, **kwargs):
+        return await self.request("list_tools", *args, **kwargs)
+
+    async def list_resources(self, *args, **kwargs):
+        return await self.request("list_resources", *args, **kwargs)
+
+    async def read_resource(self, *args, **kwargs):
+        return await self.request("read_resource", *args, **kwargs)
+
+    async def get_prompt(self, *args, **kwargs):
+        return await self.request("get_prompt", *args, **kwargs)
+
+
+class MCPSessionPools:
+    """
+    Session pools for all the configured MCP servers.
+    Offers the discovery methods of MultiServerMCPClient, made over the pooled sessions.
+    """
+
+    def __init__(
+        self,
+        client: MultiServerMCPClient,
+        mcps: Sequence[McpConfig],
+        registry: CollectorRegistry | None = REGISTRY,
+    ):
+        self.metrics = MCPSessionMetrics(registry=registry)
+        self.pools = {
+            mcp.name: MCPSessionPool(client, mcp, self.metrics) for mcp in mcps
+        }
+
+    def start(self):
+        for pool in self.pools.values():
+            pool.start()
+
+    async def close(self):
+        await asyncio.gather(*(pool.close() for pool in self.pools.values()))
+
+    async def get_tools(self, *, server_name: str) -> list[BaseTool]:
+        return await load_mcp_tools(self.pools[server_name])
+
+    async def get_resources(self, server_name: str) -> list[Blob]:
+        return await load_mcp_resources(self.pools[server_name])
+
+    async def get_prompt(
+        self, server_name: str, prompt_name: str
+    ) -> list[HumanMessage | AIMessage]:
+        return await load_mcp_prompt(self.pools[server_name], prompt_name)
@@ -0,0 +1,76 @@
+import logging
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from aiohttp import web
+from chatbot import keys
+from opentelemetry import trace
+from prometheus_client import (
+    CollectorRegistry,
+    GCCollector,
+    Histogram,
+    PlatformCollector,
+    ProcessCollector,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Latency buckets (seconds) covering a short completion through to long tool loops.
+# Histograms rather than Summaries so quantiles can be aggregated across replicas
+LLM_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+# Prompt size buckets (tokens) up to the largest context windows
+TOKEN_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072, 262144)
+
+
+def span_exemplar(span: Any) -> dict[str, str] | None:
+    """
+    Exemplar linking an observation to the trace of the span, None if the span is not
+    sampled. Exemplars are exported in the OpenMetrics format only
+    """
+    context = span.get_span_context()
+    if not context.is_valid or not context.trace_flags.sampled:
+        return None
+    return {
+        "trace_id": format(context.trace_id, "032x"),
+        "span_id": format(context.span_id, "016x"),
+    }
+
+
+def current_exemplar() -> dict[str, str] | None:
+    """Exemplar of the current OpenTelemetry span, if any"""
+    return span_exemplar(trace.get_current_span())
+
+
+@contextmanager
+def timed(*histograms: Histogram) -> Iterator[None]:
+    """
+    Observe the duration of the block in the histograms (or their labelled children),
+    with the current trace as exemplar
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        exemplar = current_exemplar()
+        for histogram in histograms:
+            histogram.observe(elapsed, exemplar)
+
+
+def metrics_app_create(app: web.Application) -> web.Application:
+    """
+    Create the metrics registry for the service.
+    The process, platform and garbage collector metrics are collected in the same registry
+    so every metric of the service is exported from it in one pass
+    """
+    registry = CollectorRegistry(auto_describe=True)
+    ProcessCollector(registry=registry)
+    PlatformCollector(registry=registry)
+    GCCollector(registry=registry)
+    app[keys.metrics] = registry
+
+    return app
@@ -3,9 +3,8 @@ import logging
 
 
 from chatbot.service.state import Events
-from chatbot.hams import Hams, hams_app_create
 from chatbot.config import ServiceConfig
-from chatbot.service.webview import ChunkView, LLMChatView
+from chatbot.service.webview import ChunkView, LLMChatView, LLMChatStreamView
 from chatbot.azurebot.webview import AzureBotView
 
 from chatbot import keys
@@ -36,11 +35,13 @@ async def service_coroutine_cleanup(app: web.Application):
     """
 
     app[keys.coroutine] = asyncio.create_task(service_coroutine(app))
+    loopLag = asyncio.create_task(app[keys.events].loopLag.run())
 
     logger.info("Service: coroutine running")
     yield
 
     app[keys.coroutine].cancel()
+    loopLag.cancel()
 
     logger.info("Service: coroutine cleanup")
 
@@ -57,14 +58,11 @@ def service_app_create(app: web.Application, config: ServiceConfig) -> web.Appli
 
     app.cleanup_ctx.append(service_coroutine_cleanup)
 
-    print(
-        f"Service: {app[keys.config].webservice.url.host}:{app[keys.config].webservice.url.port}/{app[keys.config].webservice.prefix}"
-    )
-
     app.add_routes(
         [
             web.view(f"/{config.webservice.prefix}/chunks", ChunkView),
             web.view(f"/{config.webservice.prefix}/llm/chat", LLMChatView),
+            web.view(f"/{config.webservice.prefix}/llm/chat/stream", LLMChatStreamView),
         ]
     )
 
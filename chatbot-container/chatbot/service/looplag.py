@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+
+from chatbot.config import EventConfig
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+
+# Lag buckets (seconds) from scheduling jitter to a loop stalled for seconds
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# Reports of blocked callbacks kept for HaMS
+BLOCKING_REPORTS = 20
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop runs a sleep every lagInterval. A late loop delays
+    every conversation on the pod, so the lag is also an input to admission control.
+
+    In blocking debug mode a watchdog thread checks the measurements as they run. When the
+    loop is held past the blocking threshold it logs the stack of the event loop thread,
+    which shows the callback blocking it (eg a sync HTTP call or CPU heavy work), and
+    keeps the report for HaMS.
+    """
+
+    def __init__(
+        self, config: EventConfig, registry: CollectorRegistry | None = REGISTRY
+    ):
+        self.config = config
+        self.interval = config.lagInterval.total_seconds()
+        self.threshold = config.blockingThreshold.total_seconds()
+        # Seconds the event loop was late waking up at the last measurement
+        self.lag = 0.0
+        # When the current measurement started sleeping, read by the watchdog
+        self.heartbeat = time.monotonic()
+        self.loopThread: int | None = None
+        self.watchdog: threading.Thread | None = None
+        # Set to stop the current watchdog, each watchdog has its own
+        self.stopping = threading.Event()
+        self.reports: deque[dict] = deque(maxlen=BLOCKING_REPORTS)
+
+        self.lagGauge = Gauge(
+            "event_loop_lag_seconds",
+            "Delay of the event loop in running a scheduled callback",
+            registry=registry,
+        )
+        self.lagHistogram = Histogram(
+            "event_loop_lag",
+            "Delay of the event loop in running a scheduled callback",
+            buckets=LOOP_LAG_BUCKETS,
+            registry=registry,
+        )
+        self.blockedCounter = Counter(
+            "event_loop_blocked",
+            "Times the event loop was held past the blocking threshold, counted in blocking debug mode",
+            registry=registry,
+        )
+
+    @property
+    def debug(self) -> bool:
+        return self.watchdog is not None
+
+    async def run(self):
+        """Measure the lag until cancelled, watching for blocking calls in debug mode"""
+        self.loopThread = threading.get_ident()
+        self.setDebug(self.config.blockingDebug)
+        try:
+            while True:
+                self.heartbeat = time.monotonic()
+                start = time.perf_counter()
+                await asyncio.sleep(self.interval)
+                self.lag = max(0.0, time.perf_counter() - start - self.interval)
+                self.lagGauge.set(self.lag)
+                self.lagHistogram.observe(self.lag)
+        finally:
+            self.setDebug(False)
+
+    def setDebug(self, enabled: bool):
+        """
+        Start or stop the watchdog reporting blocking calls.
+        Called on the event loop, so a stopping watchdog is signalled rather than joined
+        and exits at its next poll.
+        """
+        if enabled == self.debug:
+            return
+        if not enabled:
+            self.stopping.set()
+            self.watchdog = None
+            logger.info("Loop lag: blocking debug off")
+            return
+        if self.loopThread is None:
+            raise RuntimeError("The loop lag monitor is not running")
+        self.stopping = threading.Event()
+        self.watchdog = threading.Thread(
+            target=self._watch,
+            args=(self.stopping,),
+            name="loop-watchdog",
+            daemon=True,
+        )
+        self.watchdog.start()
+        logger.info(
+            f"Loop lag: blocking debug on, reporting callbacks holding the loop for over {self.threshold}s"
+        )
+
+    def _watch(self, stopping: threading.Event):
+        poll = max(0.01, self.threshold / 2)
+        reported = None
+        while not stopping.wait(poll):
+            heartbeat = self.heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            # Report each stall once, while the loop is still held so the stack shows the culprit
+            if blocked < self.threshold or heartbeat == reported:
+                continue
+            frame = sys._current_frames().get(self.loopThread)
+            if frame is None:
+                continue
+            reported = heartbeat
+            self._report(blocked, "".join(traceback.format_stack(frame)))
+
+    def _report(self, blocked: float, stack: str):
+        self.blockedCounter.inc()
+        self.reports.append(
+            {
+                "time": datetime.now(timezone.utc).isoformat(),
+                "blocked": round(blocked, 3),
+                "stack": stack,
+            }
+        )
+        logger.warning(
+            f"Loop lag: event loop blocked for at least {blocked:.3f}s in\n{stack}"
+        )
@@ -1,8 +1,12 @@
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
 
+from aiohttp import web
+from chatbot import keys
 from chatbot.config import EventConfig
-from prometheus_client import REGISTRY, CollectorRegistry, Gauge
+from chatbot.service.looplag import LoopLagMonitor
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge
 
 import logging
 
@@ -32,6 +36,18 @@ class Events:
         self.chunkGauge = Gauge(
             "chunk_gauge", "Count of chunks remaining", registry=registry
         )
+        # Chat turns being processed
+        self.turns = 0
+        self.turnsGauge = Gauge(
+            "chat_turns_in_flight", "Chat turns being processed", registry=registry
+        )
+        self.loopLag = LoopLagMonitor(config, registry=registry)
+        self.rejectedCounter = Counter(
+            "admission_rejections",
+            "Requests rejected because the service was over capacity",
+            ["reason"],
+            registry=registry,
+        )
 
     def updateChunk(self, time: datetime) -> int:
         if self.lastTime < time:
@@ -54,5 +70,54 @@ class Events:
         self.chunkGauge.set(self.chunkCount)
         return self.chunkCount
 
-    def spareCapacity(self) -> bool:
-        return self.chunkCount <= self.config.maxChunks
+    @contextmanager
+    def turn(self):
+        """Count a chat turn as in flight while the context is open"""
+        self.turns += 1
+        self.turnsGauge.set(self.turns)
+        try:
+            yield
+        finally:
+            self.turns -= 1
+            self.turnsGauge.set(self.turns)
+
+    def overloaded(self, queuedRequests: int = 0) -> str | None:
+        """The reason the service cannot take more load, or None if it has spare capacity"""
+        if self.chunkCount > self.config.maxChunks:
+            return "chunks"
+        if self.turns >= self.config.maxTurns:
+            return "turns"
+        if queuedRequests >= self.config.maxQueuedRequests:
+            return "queued_requests"
+        if self.loopLag.lag >= self.config.maxLoopLag.total_seconds():
+            return "loop_lag"
+        return None
+
+    def spareCapacity(self, queuedRequests: int = 0) -> bool:
+        return self.overloaded(queuedRequests) is None
+
+
+def overloaded(app: web.Application) -> str | None:
+    """
+    The reason the service cannot take more load, counting the LLM calls waiting for the rate limiter
+    """
+    queuedRequests = (
+        app[keys.llmhandler].rate_limiter.queued if keys.llmhandler in app else 0
+    )
+    return app[keys.events].overloaded(queuedRequests)
+
+
+def overloadedResponse(app: web.Application, reason: str) -> web.Response:
+    """
+    Fast 503 for a request arriving while the service is over capacity
+    """
+    events: Events = app[keys.events]
+    events.rejectedCounter.labels(reason).inc()
+    logger.warning(f"Over capacity ({reason}), rejecting request")
+    return web.json_response(
+        {"error": "Service over capacity", "reason": reason},
+        status=503,
+        headers={
+            "Retry-After": str(max(1, round(events.config.retryAfter.total_seconds())))
+        },
+    )
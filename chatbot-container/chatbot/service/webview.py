@@ -1,10 +1,14 @@
+import json
+import math
 from aiohttp import web
-from chatbot.service.state import Events
+from chatbot.service.state import Events, overloaded, overloadedResponse
 from pydantic import BaseModel, ValidationError
 import logging
 from botbuilder.schema import ConversationAccount
 from chatbot import keys
-
+from chatbot.llmconversationhandler.ratelimit import RateLimitExceededError
+from chatbot.llmconversationhandler.turnqueue import ConversationBusyError
+from chatbot.llmconversationhandler.usage import TokenBudgetExceededError
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -45,6 +49,30 @@ class ChunkView(web.View):
         return web.json_response(reply.model_dump())
 
 
+def budgetExceededResponse() -> web.Response:
+    return web.json_response(
+        {"error": "Daily token budget used, try again tomorrow"}, status=429
+    )
+
+
+def conversationBusyResponse() -> web.Response:
+    return web.json_response(
+        {"error": "Too many messages waiting in the conversation"}, status=429
+    )
+
+
+def retryAfter(e: RateLimitExceededError) -> int:
+    return max(1, math.ceil(e.retry_after))
+
+
+def rateLimitedResponse(e: RateLimitExceededError) -> web.Response:
+    return web.json_response(
+        {"error": "Too many model calls waiting, try again shortly"},
+        status=429,
+        headers={"Retry-After": str(retryAfter(e))},
+    )
+
+
 class LLMChatView(web.View):
     async def get(self):
         try:
@@ -54,18 +82,120 @@ class LLMChatView(web.View):
                 {"error": "Missing 'prompt' query parameter"}, status=400
             )
 
+        if reason := overloaded(self.request.app):
+            return overloadedResponse(self.request.app, reason)
+
         llm_handler = self.request.app[keys.llmhandler]
+        events: Events = self.request.app[keys.events]
 
-        # Create a dummy ConversationAccount for now
+        # Create a dummy ConversationAccount for now unless the caller names a conversation
         # In a real application, this would involve fetching or creating user/session specific details
-        conversation_account = ConversationAccount(id="dummy_conversation_id")
+        conversation_account = ConversationAccount(
+            id=self.request.query.get("conversation", "dummy_conversation_id")
+        )
         identity = "web_user"
 
         try:
-            ai_response = await llm_handler.chat(conversation_account, identity, prompt)
+            with events.turn():
+                ai_response = await llm_handler.chat(
+                    conversation_account, identity, prompt
+                )
             return web.json_response({"response": ai_response})
+        except ConversationBusyError as e:
+            logger.warning(f"LLM chat rejected: {e}")
+            return conversationBusyResponse()
+        except TokenBudgetExceededError as e:
+            logger.warning(f"LLM chat rejected: {e}")
+            return budgetExceededResponse()
+        except RateLimitExceededError as e:
+            logger.warning(f"LLM chat rejected: {e}")
+            return rateLimitedResponse(e)
         except Exception as e:
             logger.error(f"Error during LLM chat: {e}", exc_info=True)
             return web.json_response(
                 {"error": "Error processing LLM request"}, status=500
             )
+
+
+class LLMChatStreamView(web.View):
+    async def get(self):
+        """
+        Stream the LLM reply as Server-Sent Events.
+        Each text fragment is sent as a `data:` event holding {"delta": ...}, followed by
+        a final `end` event (or an `error` event if the chat fails part way through).
+        Turns refused or failing before the first fragment get an error status instead.
+        """
+        try:
+            prompt = self.request.query["prompt"]
+        except KeyError:
+            return web.json_response(
+                {"error": "Missing 'prompt' query parameter"}, status=400
+            )
+
+        if reason := overloaded(self.request.app):
+            return overloadedResponse(self.request.app, reason)
+
+        llm_handler = self.request.app[keys.llmhandler]
+        events: Events = self.request.app[keys.events]
+
+        conversation_account = ConversationAccount(
+            id=self.request.query.get("conversation", "dummy_conversation_id")
+        )
+        identity = "web_user"
+
+        # Refused before the stream starts so the caller sees the status
+        try:
+            llm_handler.usage.check(identity)
+        except TokenBudgetExceededError as e:
+            logger.warning(f"LLM chat stream rejected: {e}")
+            return budgetExceededResponse()
+
+        response = web.StreamResponse(
+            headers={
+                "Content-Type": "text/event-stream",
+                "Cache-Control": "no-cache",
+            }
+        )
+
+        # The stream starts with the first fragment, so a turn refused before it
+        # (conversation busy, rate limited) is answered with a status
+        try:
+            with events.turn():
+                async for delta in llm_handler.chat_stream(
+                    conversation_account, identity, prompt
+                ):
+                    if not response.prepared:
+                        await response.prepare(self.request)
+                    await response.write(
+                        f"data: {json.dumps({'delta': delta})}\n\n".encode()
+                    )
+        except ConversationBusyError as e:
+            logger.warning(f"LLM chat stream rejected: {e}")
+            return conversationBusyResponse()
+        except RateLimitExceededError as e:
+            logger.warning(f"LLM chat stream rejected: {e}")
+            if not response.prepared:
+                return rateLimitedResponse(e)
+            error = {
+                "error": "Too many model calls waiting, try again shortly",
+                "retry_after": retryAfter(e),
+            }
+            await response.write(
+                f"event: error\ndata: {json.dumps(error)}\n\n".encode()
+            )
+        except Exception as e:
+            logger.error(f"Error during LLM chat stream: {e}", exc_info=True)
+            if not response.prepared:
+                return web.json_response(
+                    {"error": "Error processing LLM request"}, status=500
+                )
+            await response.write(
+                f"event: error\ndata: {json.dumps({'error': 'Error processing LLM request'})}\n\n".encode()
+            )
+        else:
+            if not response.prepared:
+                await response.prepare(self.request)
+            await response.write(b"event: end\ndata: {}\n\n")
+
+        await response.write_eof()
+        return response
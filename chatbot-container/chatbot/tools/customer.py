@@ -1,3 +1,4 @@
+import asyncio
 import requests
 import logging
 from langchain_core.tools import InjectedToolArg, tool
@@ -26,16 +27,18 @@ async def search_records_by_name(
     Returns:
         A list of primary keys (integers) of matching records.
     """
-    logger.error(f"config = {config}")
     identity = config["configurable"].get("identity")
-    logger.error(f"Identity used for search: {identity}")
+    logger.debug(f"Identity used for search: {identity}")
     return [1, 2, 3, 5, 7, 11, 13, 17, 19, 23, 29]  # Mocked data for testing purposes
 
     headers = {}
     if api_key:
         headers["Authorization"] = f"Bearer {api_key}"
     params = {"search": search_name}
-    response = requests.get(api_url, headers=headers, params=params)
+    # requests is blocking so it runs in a thread rather than holding up the event loop
+    response = await asyncio.to_thread(
+        requests.get, api_url, headers=headers, params=params
+    )
     response.raise_for_status()
     data = response.json()
     # Assuming the API returns a list of records with a 'primary_key' field
@@ -60,5 +63,7 @@ async def delete_record_by_id(record_id: int) -> bool:
     headers = {}
     if api_key:
         headers["Authorization"] = f"Bearer {api_key}"
-    response = requests.delete(f"{api_url}/{record_id}", headers=headers)
+    response = await asyncio.to_thread(
+        requests.delete, f"{api_url}/{record_id}", headers=headers
+    )
     return response.status_code == 204
@@ -9,6 +9,7 @@ import requests
 def google_search(query, api_key, cse_id, num=5):
     """
     Search Google using the Custom Search JSON API.
+    The request is blocking, call it from async code with asyncio.to_thread.
 
     Args:
         query (str): Search query.
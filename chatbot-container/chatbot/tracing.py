@@ -0,0 +1,211 @@
+import logging
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from aiohttp import web
+from chatbot import keys
+from chatbot.config import ServiceConfig, TracingConfig
+from chatbot.metrics import span_exemplar
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SimpleSpanProcessor,
+)
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import Status, StatusCode
+from prometheus_client import REGISTRY, CollectorRegistry, Histogram
+
+logger = logging.getLogger(__name__)
+
+
+# From checkpoint reads of a few milliseconds to model calls of minutes
+SPAN_LATENCY_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+)
+
+
+class NullSpan:
+    """Span handed out when spans are not exported, so callers can always set attributes"""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: dict[str, Any]) -> None:
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    """
+    Records the steps of chat turns (checkpoint loads and writes, graph nodes, model and
+    tool calls, Bot Framework sends) as spans.
+
+    The latency of every span is observed in a histogram labelled with the span name.
+    When an exporter is configured the spans are also OpenTelemetry spans, nested by the
+    current span of the task so each turn is exported as one trace.
+    """
+
+    def __init__(
+        self,
+        config: TracingConfig | None = None,
+        registry: CollectorRegistry | None = None,
+    ):
+        self.config = config or TracingConfig()
+        self.provider = None
+        self.span_file = None
+        self.otel = self._create_otel_tracer()
+
+        self.span_metric = Histogram(
+            "turn_span_latency",
+            "Latency of the steps of chat turns by span",
+            ["span"],
+            buckets=SPAN_LATENCY_BUCKETS,
+            registry=registry,
+        )
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Any]:
+        """
+        Time the block as a span with the given name and attributes.
+        Errors raised by the block are recorded on the span and propagated.
+        The latency is observed with the trace of the span as exemplar.
+        """
+        start = time.perf_counter()
+        exemplar = None
+        try:
+            if self.otel is None:
+                yield NULL_SPAN
+            else:
+                with self.otel.start_as_current_span(
+                    name, attributes=attributes
+                ) as span:
+                    exemplar = span_exemplar(span)
+                    yield span
+        finally:
+            self.span_metric.labels(name).observe(time.perf_counter() - start, exemplar)
+
+    @contextmanager
+    def start_span(self, name: str, **attributes: Any) -> Iterator[Any]:
+        """
+        Time the block as a span like span(), without making it the current span.
+        For async generators, whose blocks span yields and may be closed from another
+        context: the steps of the generator are run in the span with current().
+        """
+        start = time.perf_counter()
+        if self.otel is None:
+            span = NULL_SPAN
+            exemplar = None
+        else:
+            span = self.otel.start_span(name, attributes=attributes)
+            exemplar = span_exemplar(span)
+        try:
+            yield span
+        except Exception as e:
+            if span is not NULL_SPAN:
+                span.record_exception(e)
+                span.set_status(Status(StatusCode.ERROR, f"{type(e).__name__}: {e}"))
+            raise
+        finally:
+            if span is not NULL_SPAN:
+                span.end()
+            self.span_metric.labels(name).observe(time.perf_counter() - start, exemplar)
+
+    @contextmanager
+    def current(self, span: Any) -> Iterator[None]:
+        """Make a span from start_span() the current span for the block"""
+        if span is NULL_SPAN:
+            yield
+            return
+        with trace.use_span(
+            span,
+            end_on_exit=False,
+            record_exception=False,
+            set_status_on_exception=False,
+        ):
+            yield
+
+    def shutdown(self):
+        """Flush the spans waiting to be exported"""
+        if self.provider is not None:
+            self.provider.shutdown()
+        if self.span_file is not None:
+            self.span_file.close()
+
+    def _create_otel_tracer(self):
+        if self.config.exporter == "none":
+            return None
+        if self.config.exporter == "global":
+            return trace.get_tracer(__name__)
+
+        match self.config.exporter:
+            case "console":
+                processor = SimpleSpanProcessor(ConsoleSpanExporter())
+            case "file":
+                # One JSON span per line
+                self.span_file = open(self.config.path, "a")
+                processor = SimpleSpanProcessor(
+                    ConsoleSpanExporter(
+                        out=self.span_file,
+                        formatter=lambda span: span.to_json(indent=None) + "\n",
+                    )
+                )
+            case "otlp":
+                # Imported on use as the exporter pulls in protobuf and requests
+                from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                    OTLPSpanExporter,
+                )
+
+                processor = BatchSpanProcessor(
+                    OTLPSpanExporter(endpoint=str(self.config.endpoint))
+                    if self.config.endpoint
+                    else OTLPSpanExporter()
+                )
+
+        self.provider = TracerProvider(
+            resource=Resource.create({"service.name": self.config.service_name}),
+            sampler=ParentBased(TraceIdRatioBased(self.config.sample_ratio)),
+        )
+        self.provider.add_span_processor(processor)
+        logger.info(f"Tracing: exporting spans to {self.config.exporter}")
+        return self.provider.get_tracer(__name__)
+
+
+async def shutdown_tracer(app: web.Application):
+    """
+    Export the remaining spans on shutdown
+    """
+    app[keys.tracer].shutdown()
+
+
+def tracing_app_create(app: web.Application, config: ServiceConfig) -> web.Application:
+    """
+    Add the tracer of chat turns to the app.
+    This must be created before the apps whose steps it traces (bot and LLM handler)
+    """
+    registry = REGISTRY if keys.metrics not in app else app[keys.metrics]
+
+    app[keys.tracer] = Tracer(config.tracing, registry=registry)
+    app.on_cleanup.append(shutdown_tracer)
+
+    return app
@@ -2,3 +2,23 @@ def pytest_addoption(parser):
     parser.addoption(
         "--enable-livellm", action="store_true", help="Enable live LLM tests"
     )
+    parser.addoption(
+        "--enable-loadtest", action="store_true", help="Enable the load test harness"
+    )
+    parser.addoption(
+        "--loadtest-conversations",
+        type=int,
+        default=20,
+        help="Concurrent conversations driven by the load test",
+    )
+    parser.addoption(
+        "--loadtest-turns",
+        type=int,
+        default=5,
+        help="Turns of each load test conversation",
+    )
+    parser.addoption(
+        "--loadtest-report",
+        default=None,
+        help="Path to write the load test results to as JSON",
+    )
@@ -0,0 +1,140 @@
+from datetime import timedelta
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.graph import END, START, StateGraph
+from prometheus_client import CollectorRegistry
+
+from chatbot.config import CheckpointerConfig
+from chatbot.llmconversationhandler.checkpointer import (
+    BoundedMemorySaver,
+    SqliteSaver,
+    create_checkpointer,
+)
+from chatbot.llmconversationhandler.graph_state import AgentState
+
+
+def echo_graph(checkpointer):
+    async def echo(state: AgentState) -> dict:
+        return {"messages": [AIMessage(content=f"echo {len(state['messages'])}")]}
+
+    workflow = StateGraph(AgentState)
+    workflow.add_node("echo", echo)
+    workflow.add_edge(START, "echo")
+    workflow.add_edge("echo", END)
+    return workflow.compile(checkpointer=checkpointer)
+
+
+async def chat(graph, thread_id: str, text: str) -> list:
+    state = await graph.ainvoke(
+        {"messages": [HumanMessage(content=text)]},
+        config={"configurable": {"thread_id": thread_id}},
+    )
+    return state["messages"]
+
+
+def test_create_checkpointer(tmp_path):
+    assert isinstance(
+        create_checkpointer(CheckpointerConfig(), registry=CollectorRegistry()),
+        BoundedMemorySaver,
+    )
+    assert isinstance(
+        create_checkpointer(
+            CheckpointerConfig(backend="sqlite", path=tmp_path / "db.sqlite"),
+            registry=CollectorRegistry(),
+        ),
+        SqliteSaver,
+    )
+
+    with pytest.raises(ValueError):
+        CheckpointerConfig(backend="sqlite")
+
+
+async def test_memory_saver_prunes_history():
+    saver = BoundedMemorySaver(
+        CheckpointerConfig(max_checkpoints_per_thread=2), registry=CollectorRegistry()
+    )
+    graph = echo_graph(saver)
+
+    for turn in range(5):
+        messages = await chat(graph, "thread-1", f"turn {turn}")
+
+    assert len(messages) == 10
+    assert len(saver.storage["thread-1"][""]) == 2
+
+
+async def test_memory_saver_evicts_least_recently_used():
+    deleted = []
+    saver = BoundedMemorySaver(
+        CheckpointerConfig(max_threads=2),
+        registry=CollectorRegistry(),
+        on_delete_thread=deleted.append,
+    )
+    graph = echo_graph(saver)
+
+    await chat(graph, "thread-1", "hello")
+    await chat(graph, "thread-2", "hello")
+    await chat(graph, "thread-1", "again")
+    await chat(graph, "thread-3", "hello")
+
+    assert list(saver.thread_access) == ["thread-1", "thread-3"]
+    assert not any(key[0] == "thread-2" for key in saver.blobs)
+    assert deleted == ["thread-2"]
+    assert len(await chat(graph, "thread-1", "more")) == 6
+
+
+async def test_memory_saver_evicts_idle_threads():
+    saver = BoundedMemorySaver(
+        CheckpointerConfig(idle_ttl=timedelta(seconds=0)), registry=CollectorRegistry()
+    )
+    graph = echo_graph(saver)
+
+    await chat(graph, "thread-1", "hello")
+    await chat(graph, "thread-2", "hello")
+
+    assert list(saver.thread_access) == ["thread-2"]
+
+
+async def test_sqlite_saver_survives_restart(tmp_path):
+    config = CheckpointerConfig(backend="sqlite", path=tmp_path / "db.sqlite")
+
+    saver = SqliteSaver(config, registry=CollectorRegistry())
+    await chat(echo_graph(saver), "thread-1", "hello")
+    saver.close()
+
+    saver = SqliteSaver(config, registry=CollectorRegistry())
+    messages = await chat(echo_graph(saver), "thread-1", "again")
+    saver.close()
+
+    assert [message.content for message in messages] == [
+        "hello",
+        "echo 1",
+        "again",
+        "echo 3",
+    ]
+
+
+async def test_sqlite_saver_evicts(tmp_path):
+    deleted = []
+    saver = SqliteSaver(
+        CheckpointerConfig(
+            backend="sqlite",
+            path=tmp_path / "db.sqlite",
+            max_threads=1,
+            max_checkpoints_per_thread=2,
+        ),
+        registry=CollectorRegistry(),
+        on_delete_thread=deleted.append,
+    )
+    graph = echo_graph(saver)
+
+    await chat(graph, "thread-1", "hello")
+    await chat(graph, "thread-1", "again")
+    await chat(graph, "thread-2", "hello")
+    saver.evict()
+
+    assert [c.config["configurable"]["thread_id"] for c in saver.list(None)] == [
+        "thread-2",
+        "thread-2",
+    ]
+    assert deleted == ["thread-1"]
+    saver.close()
@@ -0,0 +1,94 @@
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from chatbot.config import ContextConfig
+from chatbot.llmconversationhandler.context import ContextWindow
+
+
+def conversation(turns: int) -> list:
+    messages = []
+    for turn in range(turns):
+        messages.append(HumanMessage(content=f"question {turn} " * 10, id=f"h{turn}"))
+        messages.append(AIMessage(content=f"answer {turn} " * 10, id=f"a{turn}"))
+    return messages
+
+
+def test_fit_keeps_recent_turns():
+    window = ContextWindow(400, ContextConfig(reserve_tokens=100))
+    messages = conversation(10)
+
+    dropped, kept = window.fit(messages)
+
+    assert dropped + kept == messages
+    assert dropped
+    assert isinstance(kept[0], HumanMessage)
+    assert window.count_messages(kept) <= window.budget
+    assert kept[-1].id == "a9"
+
+
+def test_fit_keeps_latest_turn_when_too_large():
+    window = ContextWindow(10, ContextConfig(reserve_tokens=0))
+    messages = conversation(2) + [
+        AIMessage(
+            content="",
+            id="call",
+            tool_calls=[{"name": "sum_numbers", "args": {}, "id": "1"}],
+        ),
+        ToolMessage(content="3", tool_call_id="1", id="result"),
+    ]
+
+    dropped, kept = window.fit(messages)
+
+    assert [message.id for message in kept] == ["h1", "a1", "call", "result"]
+
+
+def test_token_counts_are_cached():
+    window = ContextWindow(4096, ContextConfig())
+    messages = conversation(3)
+
+    total = window.count_messages(messages)
+
+    assert set(window.token_cache) == {message.id for message in messages}
+    assert window.count_messages(messages) == total
+
+
+def test_strip_consumed_files():
+    window = ContextWindow(4096, ContextConfig())
+    upload = HumanMessage(
+        content=[{"type": "file", "data": "QUJD" * 1000, "filename": "policy.pdf"}],
+        id="upload",
+    )
+    messages = [upload, HumanMessage(content="summarise it", id="h"), AIMessage("ok")]
+
+    assert window.strip_consumed_files(messages[:2]) == []
+
+    (replacement,) = window.strip_consumed_files(messages)
+    assert replacement.id == "upload"
+    assert "policy.pdf" in replacement.content[0]["text"]
+    assert window.count(replacement) < 50
+
+
+def test_files_are_kept_until_answered():
+    window = ContextWindow(4096, ContextConfig())
+    upload = HumanMessage(
+        content=[{"type": "file", "data": "QUJD", "filename": "policy.pdf"}],
+        id="upload",
+    )
+    tool_call = AIMessage(
+        content="",
+        id="call",
+        tool_calls=[{"name": "sum_numbers", "args": {}, "id": "1"}],
+    )
+    result = ToolMessage(content="3", tool_call_id="1", id="result")
+
+    assert window.strip_consumed_files([upload, tool_call, result]) == []
+    assert window.strip_consumed_files([upload, tool_call, result, AIMessage("ok")])
+
+
+async def test_summarise():
+    window = ContextWindow(4096, ContextConfig())
+    model = GenericFakeChatModel(messages=iter([AIMessage(content="The user asked")]))
+
+    summary = await window.summarise(model, "", conversation(2))
+
+    assert summary.text() == "The user asked"
@@ -0,0 +1,132 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from prometheus_client import CollectorRegistry
+
+from chatbot.config import FileStoreConfig
+from chatbot.llmconversationhandler.filestore import (
+    FileStore,
+    FileTooLargeError,
+    file_reference,
+)
+
+
+async def chunks(*parts: bytes):
+    for part in parts:
+        yield part
+
+
+@pytest.fixture
+def file_store(tmp_path) -> FileStore:
+    return FileStore(
+        FileStoreConfig(path=tmp_path, max_file_bytes=10, max_bytes=20),
+        registry=CollectorRegistry(),
+    )
+
+
+async def test_save_stream(file_store, tmp_path):
+    stored = await file_store.save_stream(chunks(b"hello ", b"file"))
+    again = await file_store.save_stream(chunks(b"hello file"))
+
+    assert stored == again
+    assert stored.size == 10
+    assert await file_store.load(stored.sha256) == b"hello file"
+    assert [path.name for path in tmp_path.iterdir()] == [stored.sha256]
+    assert file_store.metrics.uploads.labels("duplicate")._value.get() == 1
+
+
+async def test_save_stream_rejects_large_files(file_store, tmp_path):
+    with pytest.raises(FileTooLargeError):
+        await file_store.save_stream(chunks(b"hello ", b"large ", b"file"))
+
+    assert list(tmp_path.iterdir()) == []
+
+
+async def test_materialise(file_store):
+    stored = await file_store.save_stream(chunks(b"data"))
+    upload = HumanMessage(
+        content=[file_reference("notes.txt", "text/plain", stored)], id="upload"
+    )
+    messages = [upload, HumanMessage(content="read it"), AIMessage(content="ok")]
+
+    materialised = await file_store.materialise(messages)
+
+    assert materialised[1:] == messages[1:]
+    assert materialised[0].id == "upload"
+    assert materialised[0].content == [
+        {
+            "type": "file",
+            "source_type": "base64",
+            "data": "ZGF0YQ==",
+            "mime_type": "text/plain",
+            "filename": "notes.txt",
+        }
+    ]
+    assert upload.content[0]["source_type"] == "store"
+
+
+async def test_materialise_missing_file(file_store):
+    stored = await file_store.save_stream(chunks(b"data"))
+    file_store.file_path(stored.sha256).unlink()
+
+    (message,) = await file_store.materialise(
+        [HumanMessage(content=[file_reference("notes.txt", "text/plain", stored)])]
+    )
+
+    assert message.content[0]["type"] == "text"
+
+
+async def test_evicts_unreferenced_files_first(file_store):
+    first = await file_store.save_stream(chunks(b"first file"))
+    second = await file_store.save_stream(chunks(b"second"))
+    file_store.add_reference(first.sha256, "thread-1")
+
+    third = await file_store.save_stream(chunks(b"third file"))
+
+    assert list(file_store.files) == [first.sha256, third.sha256]
+    assert not file_store.file_path(second.sha256).exists()
+    assert file_store.total_bytes == 20
+
+
+async def test_release(file_store):
+    stored = await file_store.save_stream(chunks(b"data"))
+    file_store.add_reference(stored.sha256, "thread-1")
+    file_store.add_reference(stored.sha256, "thread-2")
+    messages = [
+        HumanMessage(content=[file_reference("notes.txt", "text/plain", stored)])
+    ]
+
+    file_store.release(messages, "thread-1")
+    assert file_store.references[stored.sha256] == {"thread-2"}
+
+    file_store.release(messages, "thread-2")
+    assert stored.sha256 not in file_store.references
+
+
+async def test_release_thread(file_store):
+    first = await file_store.save_stream(chunks(b"first"))
+    second = await file_store.save_stream(chunks(b"second"))
+    file_store.add_reference(first.sha256, "thread-1")
+    file_store.add_reference(first.sha256, "thread-2")
+    file_store.add_reference(second.sha256, "thread-1")
+
+    file_store.release_thread("thread-1")
+
+    assert dict(file_store.references) == {first.sha256: {"thread-2"}}
+
+
+async def test_reload_existing_files(file_store, tmp_path):
+    stored = await file_store.save_stream(chunks(b"data"))
+
+    reloaded = FileStore(FileStoreConfig(path=tmp_path), registry=CollectorRegistry())
+
+    assert reloaded.files == {stored.sha256: 4}
+
+
+async def test_base64_encoding_is_memoised(file_store):
+    stored = await file_store.save_stream(chunks(b"data"))
+
+    assert await file_store.load_base64(stored.sha256) == "ZGF0YQ=="
+    file_store.file_path(stored.sha256).write_bytes(b"changed")
+
+    assert await file_store.load_base64(stored.sha256) == "ZGF0YQ=="
+    assert file_store.encoded_bytes == 8
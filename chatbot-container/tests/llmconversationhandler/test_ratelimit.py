@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+from prometheus_client import CollectorRegistry
+
+from chatbot.config import RateLimitConfig
+from chatbot.llmconversationhandler.ratelimit import (
+    RateLimiter,
+    RateLimitExceededError,
+)
+
+
+def limiter(**config) -> RateLimiter:
+    return RateLimiter(RateLimitConfig(**config), registry=CollectorRegistry())
+
+
+async def test_unlimited_does_not_wait():
+    rate_limiter = limiter()
+    assert not rate_limiter.enabled
+    await rate_limiter.acquire("a", 1_000_000)
+
+
+async def test_takes_tokens_without_queueing():
+    rate_limiter = limiter(requests_per_minute=60, tokens_per_minute=1000)
+
+    await rate_limiter.acquire("a", 400)
+
+    assert rate_limiter.queued == 0
+    assert rate_limiter.requests.tokens == pytest.approx(59, abs=0.1)
+    assert rate_limiter.tokens.tokens == pytest.approx(600, abs=1)
+
+
+async def test_queues_are_served_round_robin():
+    # 100 requests a second once the bucket is empty
+    rate_limiter = limiter(requests_per_minute=6000)
+    rate_limiter.requests.tokens = 0
+
+    served = []
+
+    async def call(conversation: str):
+        await rate_limiter.acquire(conversation, 1)
+        served.append(conversation)
+
+    # Conversation a queues three calls before b queues one
+    calls = [asyncio.create_task(call("a")) for _ in range(3)]
+    await asyncio.sleep(0)
+    calls.append(asyncio.create_task(call("b")))
+
+    await asyncio.gather(*calls)
+
+    assert served == ["a", "b", "a", "a"]
+    assert rate_limiter.queued == 0
+
+
+async def test_full_queue_rejects():
+    rate_limiter = limiter(requests_per_minute=1, max_queue=2)
+    rate_limiter.requests.tokens = 0
+
+    waiting = [asyncio.create_task(rate_limiter.acquire(str(i), 1)) for i in range(2)]
+    await asyncio.sleep(0)
+
+    assert rate_limiter.queued == 2
+    with pytest.raises(RateLimitExceededError) as rejected:
+        await rate_limiter.acquire("c", 1)
+    # Three calls at one a minute
+    assert 179 < rejected.value.retry_after <= 180
+
+    for task in waiting:
+        task.cancel()
+    await asyncio.gather(*waiting, return_exceptions=True)
+
+    # Cancelled calls leave the queue
+    assert rate_limiter.queued == 0
+    assert not rate_limiter.queues
+
+
+async def test_cancelled_waiter_is_skipped_by_dispatcher():
+    rate_limiter = limiter(requests_per_minute=60)
+    rate_limiter.requests.tokens = 0
+
+    cancelled = asyncio.create_task(rate_limiter.acquire("a", 1))
+    waiting = asyncio.create_task(rate_limiter.acquire("b", 1))
+    await asyncio.sleep(0)
+
+    # The dispatcher runs before the cancelled caller can leave the queue
+    rate_limiter.requests.tokens = rate_limiter.requests.capacity
+    cancelled.cancel()
+    await asyncio.wait_for(waiting, 1)
+
+    assert cancelled.cancelled()
+    assert rate_limiter.queued == 0
+    assert not rate_limiter.queues
+    assert rate_limiter.requests.tokens == pytest.approx(59, abs=0.1)
+
+
+async def test_token_estimate_is_reconciled_with_usage():
+    rate_limiter = limiter(tokens_per_minute=1000)
+
+    await rate_limiter.acquire("a", 100)
+    rate_limiter.reconcile(estimated=100, actual=300)
+
+    assert rate_limiter.tokens.tokens == pytest.approx(700, abs=1)
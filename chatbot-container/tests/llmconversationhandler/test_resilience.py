@@ -0,0 +1,206 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGenerationChunk
+from langchain_core.runnables import RunnableLambda
+from prometheus_client import CollectorRegistry
+
+from chatbot.config import ResilienceConfig
+from chatbot.llmconversationhandler.resilience import (
+    HEDGE_MIN_SAMPLES,
+    CircuitBreaker,
+    PartialStreamError,
+    ProvidersUnavailableError,
+    ResilienceMetrics,
+    ResilienceState,
+    ResilientChatModel,
+    is_retryable,
+)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class ScriptedModel:
+    """Model replying with the scripted errors, then with its name after an optional delay"""
+
+    def __init__(self, name: str, errors=(), delay: float = 0):
+        self.name = name
+        self.errors = list(errors)
+        self.delay = delay
+        self.calls = 0
+        self.kwargs = []
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        self.calls += 1
+        self.kwargs.append(kwargs)
+        if self.errors:
+            raise self.errors.pop(0)
+        await asyncio.sleep(self.delay)
+        return AIMessage(content=self.name)
+
+
+class BrokenStreamModel(GenericFakeChatModel):
+    """Model streaming the first chunk of its reply, then failing with the error"""
+
+    error: Exception
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        yield ChatGenerationChunk(message=AIMessageChunk(content="Hel"))
+        raise self.error
+
+
+def resilient(*providers, timeout: float = 1, **config) -> ResilientChatModel:
+    config = ResilienceConfig(backoff=timedelta(0), **config)
+    state = ResilienceState(config, ResilienceMetrics(registry=CollectorRegistry()))
+    return ResilientChatModel(providers, config, timeout, state)
+
+
+MESSAGES = [HumanMessage(content="hello")]
+
+
+def test_is_retryable():
+    assert is_retryable(StatusError(429))
+    assert is_retryable(StatusError(503))
+    assert is_retryable(TimeoutError())
+    assert not is_retryable(StatusError(400))
+    assert not is_retryable(ValueError("bad request"))
+
+
+def test_circuit_breaker_opens_and_half_opens():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    # With no reset timeout the open circuit is immediately half open
+    assert breaker.state == "half_open"
+
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+
+
+async def test_retries_throttled_call():
+    primary = ScriptedModel("primary", errors=[StatusError(429)])
+    model = resilient(("azure_openai", primary))
+
+    response = await model.ainvoke(MESSAGES)
+
+    assert response.content == "primary"
+    assert primary.calls == 2
+
+
+async def test_client_error_is_not_retried():
+    primary = ScriptedModel("primary", errors=[StatusError(400)])
+    fallback = ScriptedModel("fallback")
+    model = resilient(("azure_openai", primary), ("google_genai", fallback))
+
+    with pytest.raises(StatusError):
+        await model.ainvoke(MESSAGES)
+    assert primary.calls == 1
+    assert fallback.calls == 0
+
+
+async def test_fails_over_after_retries_and_call_options_go_to_primary_only():
+    primary = ScriptedModel("primary", errors=[StatusError(503)] * 3)
+    fallback = ScriptedModel("fallback")
+    model = resilient(
+        ("azure_openai", primary), ("google_genai", fallback), max_retries=2
+    )
+
+    response = await model.ainvoke(MESSAGES, prompt_cache_key="abc")
+
+    assert response.content == "fallback"
+    assert primary.calls == 3
+    assert primary.kwargs[0] == {"prompt_cache_key": "abc"}
+    assert fallback.kwargs == [{}]
+
+
+async def test_timeout_fails_over():
+    primary = ScriptedModel("primary", delay=1)
+    fallback = ScriptedModel("fallback")
+    model = resilient(
+        ("azure_openai", primary),
+        ("google_genai", fallback),
+        timeout=0.05,
+        max_retries=0,
+    )
+
+    response = await model.ainvoke(MESSAGES)
+
+    assert response.content == "fallback"
+
+
+async def test_open_circuit_skips_provider():
+    primary = ScriptedModel("primary", errors=[StatusError(500)] * 10)
+    fallback = ScriptedModel("fallback")
+    model = resilient(
+        ("azure_openai", primary),
+        ("google_genai", fallback),
+        max_retries=5,
+        failure_threshold=2,
+    )
+
+    assert (await model.ainvoke(MESSAGES)).content == "fallback"
+    # The circuit opened after two failures so the remaining retries were skipped
+    assert primary.calls == 2
+
+    assert (await model.ainvoke(MESSAGES)).content == "fallback"
+    assert primary.calls == 2
+
+
+async def test_all_circuits_open():
+    primary = ScriptedModel("primary", errors=[StatusError(500)])
+    model = resilient(("azure_openai", primary), max_retries=0, failure_threshold=1)
+
+    with pytest.raises(StatusError):
+        await model.ainvoke(MESSAGES)
+    with pytest.raises(ProvidersUnavailableError):
+        await model.ainvoke(MESSAGES)
+
+
+async def test_hedged_request_to_fallback_wins():
+    primary = ScriptedModel("primary", delay=0.01)
+    fallback = ScriptedModel("fallback")
+    model = resilient(
+        ("azure_openai", primary),
+        ("google_genai", fallback),
+        hedge=True,
+        hedge_min_delay=timedelta(seconds=0.05),
+    )
+
+    # Not hedged until enough latencies are known
+    for _ in range(HEDGE_MIN_SAMPLES):
+        assert (await model.ainvoke(MESSAGES)).content == "primary"
+    assert fallback.calls == 0
+
+    primary.delay = 1
+    response = await model.ainvoke(MESSAGES)
+
+    assert response.content == "fallback"
+    assert fallback.calls == 1
+
+
+async def test_partly_streamed_reply_is_not_retried():
+    primary = BrokenStreamModel(messages=iter([]), error=StatusError(503))
+    fallback = ScriptedModel("fallback")
+    model = resilient(("azure_openai", primary), ("google_genai", fallback))
+
+    streamed = []
+    with pytest.raises(PartialStreamError):
+        async for event in RunnableLambda(model.ainvoke).astream_events(
+            MESSAGES, version="v2"
+        ):
+            if event["event"] == "on_chat_model_stream":
+                streamed.append(event["data"]["chunk"].content)
+
+    assert streamed == ["Hel"]
+    assert fallback.calls == 0
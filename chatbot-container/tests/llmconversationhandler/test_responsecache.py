@@ -0,0 +1,83 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from langchain_core.embeddings import Embeddings
+from prometheus_client import CollectorRegistry
+
+from chatbot.config import ResponseCacheConfig
+from chatbot.llmconversationhandler.responsecache import (
+    ResponseCache,
+    normalise_prompt,
+)
+
+
+class BagOfWordsEmbeddings(Embeddings):
+    """Embeds text as word counts over a fixed vocabulary"""
+
+    vocabulary = ["time", "london", "paris", "what", "is", "it", "in", "now"]
+
+    def embed_query(self, text: str) -> list[float]:
+        words = text.split()
+        return [float(words.count(word)) for word in self.vocabulary]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+def test_normalise_prompt():
+    assert normalise_prompt("  What time is it in   London? ") == (
+        "what time is it in london"
+    )
+
+
+async def test_exact_cache_is_scoped():
+    cache = ResponseCache(
+        ResponseCacheConfig(enabled=True), registry=CollectorRegistry()
+    )
+
+    await cache.store("alice", "tools-1", "Find customer Smith", "Found Smith")
+
+    assert await cache.lookup("alice", "tools-1", "find customer smith?") == (
+        "Found Smith"
+    )
+    assert await cache.lookup("bob", "tools-1", "Find customer Smith") is None
+    assert await cache.lookup("alice", "tools-2", "Find customer Smith") is None
+    assert cache.lookup_metric.labels("hit")._value.get() == 1
+
+
+async def test_cache_uses_shortest_ttl():
+    cache = ResponseCache(
+        ResponseCacheConfig(enabled=True), registry=CollectorRegistry()
+    )
+
+    await cache.store("alice", "tools", "time?", "noon", ttl=timedelta(seconds=0.05))
+    await asyncio.sleep(0.1)
+
+    assert await cache.lookup("alice", "tools", "time?") is None
+
+
+async def test_semantic_cache():
+    cache = ResponseCache(
+        ResponseCacheConfig(
+            enabled=True,
+            mode="semantic",
+            embedding_model="bag-of-words",
+            similarity=0.9,
+        ),
+        embeddings=BagOfWordsEmbeddings(),
+        registry=CollectorRegistry(),
+    )
+
+    await cache.store("alice", "tools", "What time is it in London?", "Noon")
+
+    assert await cache.lookup("alice", "tools", "what time is it in london now") == (
+        "Noon"
+    )
+    assert await cache.lookup("alice", "tools", "what time is it in paris") is None
+    assert await cache.lookup("bob", "tools", "what time is it in london") is None
+
+
+def test_semantic_cache_requires_embeddings():
+    with pytest.raises(ValueError):
+        ResponseCacheConfig(enabled=True, mode="semantic")
@@ -0,0 +1,174 @@
+import asyncio
+from datetime import timedelta
+import pytest
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import tool
+from prometheus_client import CollectorRegistry
+
+from chatbot.config.tool import ToolBoxConfig, ToolConfig
+from chatbot.llmconversationhandler.toolregistry import ToolRegistry
+
+running = 0
+peak = 0
+
+
+@tool
+async def slow_echo(text: str, delay: float) -> str:
+    """Echo the text after a delay.
+
+    Args:
+        text: The text to echo.
+        delay: Seconds to wait.
+    """
+    global running, peak
+    running += 1
+    peak = max(peak, running)
+    try:
+        await asyncio.sleep(delay)
+    finally:
+        running -= 1
+    return text
+
+
+@pytest.fixture
+def registry() -> ToolRegistry:
+    global running, peak
+    running = peak = 0
+
+    toolbox = ToolBoxConfig(
+        tools=[
+            ToolConfig(
+                name="slow_echo", max_instances=2, timeout=timedelta(seconds=0.5)
+            )
+        ],
+        max_concurrent=10,
+        mcps=[],
+    )
+    registry = ToolRegistry(toolbox, registry=CollectorRegistry())
+    registry.register_tools([slow_echo])
+    return registry
+
+
+def call(index: int, delay: float = 0.05) -> dict:
+    return {
+        "name": "slow_echo",
+        "args": {"text": f"echo {index}", "delay": delay},
+        "id": f"call-{index}",
+        "type": "tool_call",
+    }
+
+
+async def test_tool_calls_limited_by_max_instances(registry):
+    results = await registry.perform_tool_actions([call(index) for index in range(6)])
+
+    assert [result.content for result in results] == [
+        f"echo {index}" for index in range(6)
+    ]
+    assert peak == 2
+
+
+async def test_tool_limit_is_process_wide(registry):
+    await asyncio.gather(
+        registry.perform_tool_actions([call(0), call(1)]),
+        registry.perform_tool_actions([call(2), call(3)]),
+    )
+
+    assert peak == 2
+
+
+async def test_tool_timeout(registry):
+    (result,) = await registry.perform_tool_actions([call(0, delay=5)])
+
+    assert result.status == "error"
+    assert "timed out" in result.content
+    assert running == 0
+
+
+async def test_unknown_tool(registry):
+    (result,) = await registry.perform_tool_actions(
+        [{"name": "missing", "args": {}, "id": "call-0", "type": "tool_call"}]
+    )
+
+    assert result.status == "error"
+
+
+async def test_tool_calls_cancelled_with_caller(registry):
+    task = asyncio.create_task(
+        registry.perform_tool_actions([call(index, delay=5) for index in range(3)])
+    )
+    await asyncio.sleep(0.05)
+    task.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert running == 0
+
+
+@tool
+async def whoami(config: RunnableConfig) -> str:
+    """Reply with the identity of the caller."""
+    return config["configurable"]["identity"]
+
+
+@pytest.fixture
+def cached_registry() -> ToolRegistry:
+    global running, peak
+    running = peak = 0
+
+    toolbox = ToolBoxConfig(
+        tools=[
+            ToolConfig(name="slow_echo", cache_ttl=timedelta(minutes=1)),
+            ToolConfig(name="whoami", cache_ttl=timedelta(minutes=1)),
+        ],
+        max_concurrent=10,
+        mcps=[],
+    )
+    registry = ToolRegistry(toolbox, registry=CollectorRegistry())
+    registry.register_tools([slow_echo, whoami])
+    return registry
+
+
+async def test_tool_results_cached(cached_registry):
+    first = await cached_registry.perform_tool_action(call(0))
+    second = await cached_registry.perform_tool_action(call(0))
+    other = await cached_registry.perform_tool_action(call(1))
+
+    assert first.content == second.content == "echo 0"
+    assert other.content == "echo 1"
+    assert peak == 1
+    assert (
+        cached_registry.prometheus_registry.get_sample_value(
+            "tool_cache_total", {"tool_name": "slow_echo", "result": "hit"}
+        )
+        == 1
+    )
+
+
+async def test_tool_cache_keyed_by_identity(cached_registry):
+    whoami_call = {"name": "whoami", "args": {}, "id": "1", "type": "tool_call"}
+
+    alice = await cached_registry.perform_tool_action(
+        whoami_call, {"configurable": {"identity": "alice"}}
+    )
+    bob = await cached_registry.perform_tool_action(
+        whoami_call, {"configurable": {"identity": "bob"}}
+    )
+
+    assert (alice.content, bob.content) == ("alice", "bob")
+
+
+async def test_tool_not_cacheable():
+    toolbox = ToolBoxConfig(
+        tools=[
+            ToolConfig(
+                name="slow_echo", cacheable=False, cache_ttl=timedelta(minutes=1)
+            )
+        ],
+        max_concurrent=10,
+        mcps=[],
+    )
+    registry = ToolRegistry(toolbox, registry=CollectorRegistry())
+    registry.register_tools([slow_echo])
+
+    assert registry.registry["slow_echo"].cache is None
@@ -0,0 +1,128 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from prometheus_client import CollectorRegistry
+
+from chatbot.config import TurnQueueConfig
+from chatbot.llmconversationhandler.turnqueue import ConversationBusyError, TurnQueue
+
+
+def turn_queue(**config) -> TurnQueue:
+    return TurnQueue(TurnQueueConfig(**config), registry=CollectorRegistry())
+
+
+async def test_conversations_run_concurrently():
+    queue = turn_queue()
+    running = []
+
+    async def turn(thread_id: str):
+        async with queue.turn(thread_id, "hi") as current:
+            running.append(thread_id)
+            await asyncio.sleep(0.01)
+            current.reply = thread_id
+
+    await asyncio.gather(turn("a"), turn("b"))
+
+    assert running == ["a", "b"]
+    assert not queue.queues
+
+
+async def test_waiting_prompts_are_coalesced():
+    queue = turn_queue(coalesce_max=2)
+    turns = []
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def chat(prompt: str) -> str:
+        async with queue.turn("a", prompt) as current:
+            if current.coalesced:
+                return current.reply
+            turns.append(current.prompts)
+            started.set()
+            await release.wait()
+            current.reply = "+".join(current.prompts)
+            return current.reply
+
+    first = asyncio.create_task(chat("1"))
+    await started.wait()
+    waiting = [asyncio.create_task(chat(prompt)) for prompt in ("2", "3", "4")]
+    await asyncio.sleep(0)
+    release.set()
+
+    replies = await asyncio.gather(first, *waiting)
+
+    assert turns == [["1"], ["2", "3"], ["4"]]
+    assert replies == ["1", "2+3", "2+3", "4"]
+    assert not queue.queues
+
+
+async def test_coalesce_window_collects_rapid_fire_prompts():
+    queue = turn_queue(coalesce_window=timedelta(milliseconds=20))
+    turns = []
+
+    async def chat(prompt: str):
+        async with queue.turn("a", prompt) as current:
+            if not current.coalesced:
+                turns.append(current.prompts)
+
+    first = asyncio.create_task(chat("1"))
+    await asyncio.sleep(0.005)
+    await asyncio.gather(first, chat("2"))
+
+    assert turns == [["1", "2"]]
+
+
+async def test_full_conversation_is_rejected():
+    queue = turn_queue(max_pending=1)
+    release = asyncio.Event()
+
+    async def hold():
+        async with queue.turn("a", "1"):
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+
+    with pytest.raises(ConversationBusyError):
+        async with queue.turn("a", "3"):
+            pass
+
+    # A cancelled waiting prompt leaves the queue
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    assert not queue.queues["a"].pending
+
+    release.set()
+    await holder
+    assert not queue.queues
+
+
+async def test_failed_turn_fails_coalesced_prompts():
+    queue = turn_queue()
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def chat(prompt: str, fail: bool = False):
+        async with queue.turn("a", prompt) as current:
+            if current.coalesced:
+                return current.reply
+            started.set()
+            await release.wait()
+            if fail:
+                raise RuntimeError("model failed")
+
+    first = asyncio.create_task(chat("1"))
+    await started.wait()
+    second = asyncio.create_task(chat("2", fail=True))
+    third = asyncio.create_task(chat("3"))
+    await asyncio.sleep(0)
+    release.set()
+
+    results = await asyncio.gather(first, second, third, return_exceptions=True)
+
+    assert results[0] is None
+    assert isinstance(results[1], RuntimeError)
+    assert isinstance(results[2], RuntimeError)
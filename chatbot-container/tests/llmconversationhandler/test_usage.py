@@ -0,0 +1,101 @@
+import datetime
+
+import pytest
+from prometheus_client import CollectorRegistry
+
+from chatbot.config import ModelPriceConfig, UsageConfig
+from chatbot.llmconversationhandler import usage
+from chatbot.llmconversationhandler.usage import TokenBudgetExceededError, UsageLedger
+
+
+def ledger(**config) -> tuple[UsageLedger, CollectorRegistry]:
+    registry = CollectorRegistry()
+    return UsageLedger(UsageConfig(**config), registry=registry), registry
+
+
+def call_usage(input_tokens: int, output_tokens: int, cached: int = 0) -> dict:
+    return {
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "total_tokens": input_tokens + output_tokens,
+        "input_token_details": {"cache_read": cached},
+    }
+
+
+def test_records_tokens_and_cost():
+    usage_ledger, registry = ledger(
+        prices={
+            "gpt-4o": ModelPriceConfig(input=2.5, output=10, cached_input=1.25),
+        }
+    )
+
+    cost = usage_ledger.record(
+        "flagship", "gpt-4o", "alice", call_usage(1_000_000, 100_000, cached=400_000)
+    )
+
+    assert cost == pytest.approx(0.6 * 2.5 + 0.4 * 1.25 + 0.1 * 10)
+    labels = {"model": "flagship", "identity": "alice"}
+    assert registry.get_sample_value("llm_estimated_cost_total", labels) == cost
+    for token_type, tokens in [
+        ("input", 600_000),
+        ("cached", 400_000),
+        ("output", 100_000),
+    ]:
+        assert (
+            registry.get_sample_value(
+                "llm_identity_tokens_total", {**labels, "type": token_type}
+            )
+            == tokens
+        )
+    assert (
+        registry.get_sample_value("llm_identity_daily_tokens", {"identity": "alice"})
+        == 1_100_000
+    )
+
+
+def test_unpriced_model_is_not_costed():
+    usage_ledger, registry = ledger()
+
+    assert (
+        usage_ledger.record("small", "gpt-4o-mini", "alice", call_usage(10, 5)) is None
+    )
+    assert usage_ledger.used_today("alice") == 15
+
+
+def test_daily_budget(monkeypatch):
+    usage_ledger, registry = ledger(daily_tokens=100, identity_daily_tokens={"bob": 10})
+
+    usage_ledger.check("alice")
+    usage_ledger.record("small", "model", "alice", call_usage(80, 30))
+    with pytest.raises(TokenBudgetExceededError) as error:
+        usage_ledger.check("alice")
+    assert (error.value.used, error.value.budget) == (110, 100)
+
+    usage_ledger.record("small", "model", "bob", call_usage(10, 0))
+    with pytest.raises(TokenBudgetExceededError):
+        usage_ledger.check("bob")
+    assert (
+        registry.get_sample_value("llm_budget_rejections_total", {"identity": "bob"})
+        == 1
+    )
+
+    # The budgets are renewed the next day
+    tomorrow = usage_ledger.day + datetime.timedelta(days=1)
+    monkeypatch.setattr(usage, "today", lambda: tomorrow)
+    usage_ledger.check("alice")
+    usage_ledger.check("bob")
+    assert usage_ledger.used_today("alice") == 0
+
+
+def test_records_tool_result_tokens():
+    usage_ledger, registry = ledger()
+
+    usage_ledger.record_tool("sum_numbers", 12)
+    usage_ledger.record_tool("sum_numbers", 3)
+
+    assert (
+        registry.get_sample_value(
+            "llm_tool_result_tokens_total", {"tool_name": "sum_numbers"}
+        )
+        == 15
+    )
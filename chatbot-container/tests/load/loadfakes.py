@@ -0,0 +1,169 @@
+"""
+Deterministic stand-ins for the model provider and the customer MCP server, used by the load test
+"""
+
+import asyncio
+import datetime
+import json
+import time
+from collections.abc import AsyncIterator, Iterator
+from contextlib import asynccontextmanager
+from typing import Any
+from zoneinfo import ZoneInfo
+
+import uvicorn
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    HumanMessage,
+    ToolMessage,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from mcp.server.fastmcp import FastMCP
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Chat model answering every turn with the same script: the tool calls in order, one per
+    model call, then the reply. Replies are streamed word by word at the token rate after
+    the latency to the first token.
+    """
+
+    latency: float = 0.05
+    tokens_per_second: float = 200.0
+    tool_calls: list[dict[str, Any]] = []
+    reply: str = "Here is the answer to your question about the customer records."
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _next_message(self, messages: list[BaseMessage]) -> AIMessage:
+        # Tool results received since the user last spoke give the step of the script
+        step = 0
+        for message in reversed(messages):
+            if isinstance(message, HumanMessage):
+                break
+            if isinstance(message, ToolMessage):
+                step += 1
+
+        prompt_tokens = sum(len(str(message.content)) // 4 for message in messages)
+        if step < len(self.tool_calls):
+            call = self.tool_calls[step]
+            return AIMessage(
+                content="",
+                tool_calls=[
+                    {"name": call["name"], "args": call["args"], "id": f"call-{step}"}
+                ],
+                usage_metadata=usage(prompt_tokens, 10),
+            )
+        return AIMessage(
+            content=self.reply,
+            usage_metadata=usage(prompt_tokens, len(self.reply.split())),
+        )
+
+    def _duration(self, message: AIMessage) -> float:
+        return self.latency + message.usage_metadata["output_tokens"] / (
+            self.tokens_per_second
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._next_message(messages)
+        time.sleep(self._duration(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ) -> ChatResult:
+        message = self._next_message(messages)
+        await asyncio.sleep(self._duration(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ) -> Iterator[ChatGenerationChunk]:
+        raise NotImplementedError("The load test only streams asynchronously")
+
+    async def _astream(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        message = self._next_message(messages)
+        await asyncio.sleep(self.latency)
+
+        if message.tool_calls:
+            call = message.tool_calls[0]
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content="",
+                    tool_call_chunks=[
+                        {
+                            "name": call["name"],
+                            "args": json.dumps(call["args"]),
+                            "id": call["id"],
+                            "index": 0,
+                        }
+                    ],
+                    usage_metadata=message.usage_metadata,
+                )
+            )
+            return
+
+        words = message.content.split(" ")
+        for index, word in enumerate(words):
+            await asyncio.sleep(1 / self.tokens_per_second)
+            chunk = AIMessageChunk(
+                content=word if index == 0 else f" {word}",
+                usage_metadata=message.usage_metadata if index == 0 else None,
+            )
+            yield ChatGenerationChunk(message=chunk)
+
+
+def usage(input_tokens: int, output_tokens: int) -> dict:
+    return {
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "total_tokens": input_tokens + output_tokens,
+    }
+
+
+@asynccontextmanager
+async def customer_mcp_server(port: int, latency: float = 0.01):
+    """
+    In process stand-in for the customer MCP container, offering the same tools over
+    streamable HTTP with a fixed latency
+    """
+    server = FastMCP("customers")
+    calls = 0
+
+    @server.tool()
+    async def count_calls() -> int:
+        """Count the number of calls made to the function"""
+        nonlocal calls
+        await asyncio.sleep(latency)
+        calls += 1
+        return calls
+
+    @server.tool()
+    async def get_time(timezone: str) -> str:
+        """Get the current time in the specified timezone."""
+        await asyncio.sleep(latency)
+        return datetime.datetime.now(ZoneInfo(timezone)).isoformat()
+
+    uvicorn_server = uvicorn.Server(
+        uvicorn.Config(
+            server.streamable_http_app(), port=port, log_level="warning", lifespan="on"
+        )
+    )
+    task = asyncio.create_task(uvicorn_server.serve())
+    while not uvicorn_server.started:
+        await asyncio.sleep(0.01)
+    try:
+        yield
+    finally:
+        uvicorn_server.should_exit = True
+        await task
@@ -0,0 +1,208 @@
+"""
+Load test of the full service against a fake model and MCP server.
+
+Run with:
+    pytest tests/load --enable-loadtest -s [--loadtest-conversations 20] [--loadtest-turns 5]
+        [--loadtest-report results.json]
+"""
+
+import asyncio
+import json
+import os
+import resource
+import socket
+import statistics
+import time
+from dataclasses import dataclass, field
+
+import pytest
+from aiohttp import web
+from pydantic import HttpUrl
+
+from chatbot import app_init, keys
+from chatbot.config import ServiceConfig
+from chatbot.config.tool import McpConfig
+import chatbot.llmconversationhandler
+from loadfakes import ScriptedChatModel, customer_mcp_server
+
+# Every turn looks up the time through the MCP server before answering
+TOOL_CALLS = [{"name": "get_time", "args": {"timezone": "Europe/London"}}]
+
+
+@pytest.fixture
+def loadtest(request):
+    if not request.config.getoption("--enable-loadtest"):
+        pytest.skip("Skipped unless --enable-loadtest is set")
+    return request.config
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_bytes() -> int:
+    """Resident set size of the process"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak rather than current RSS, in kilobytes on Linux and bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@dataclass
+class LoadResult:
+    name: str
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    duration: float = 0.0
+
+    def report(self) -> dict:
+        quantiles = (
+            statistics.quantiles(self.latencies, n=100, method="inclusive")
+            if len(self.latencies) > 1
+            else [self.latencies[0]] * 99 if self.latencies else [0.0] * 99
+        )
+        return {
+            "turns": len(self.latencies),
+            "errors": self.errors,
+            "turns_per_second": len(self.latencies) / self.duration,
+            "p50": quantiles[49],
+            "p95": quantiles[94],
+            "p99": quantiles[98],
+        }
+
+
+@pytest.fixture
+async def connector(aiohttp_server):
+    """
+    Stand-in for the Bot Connector receiving the replies of the bot, keyed by the
+    activity replied to
+    """
+    replies: dict[str, asyncio.Future] = {}
+
+    async def reply(request: web.Request) -> web.Response:
+        activity = await request.json()
+        if activity.get("type") == "message":
+            future = replies.get(request.match_info["activity"])
+            if future is not None and not future.done():
+                future.set_result(activity.get("text"))
+        return web.json_response({"id": "reply"})
+
+    app = web.Application()
+    app.router.add_post("/v3/conversations/{conversation}/activities/{activity}", reply)
+    server = await aiohttp_server(app)
+    server.replies = replies
+    return server
+
+
+@pytest.fixture
+async def load_client(loadtest, aiohttp_client, monkeypatch):
+    config: ServiceConfig = ServiceConfig.from_yaml(
+        "tests/test_data/config.yaml", "tests/test_data/secrets_sample"
+    )
+    mcp_port = free_port()
+    config.myai.toolbox.mcps = [
+        McpConfig(
+            name="customers",
+            url=f"http://127.0.0.1:{mcp_port}/mcp",
+            transport="streamable_http",
+        )
+    ]
+    config.hams.url = HttpUrl(f"http://127.0.0.1:{free_port()}")
+    config.aiclient.context_length = 32768
+    config.events.maxTurns = 10000
+    config.bot.queue_size = 10000
+
+    # Every model the service creates is the fake model
+    monkeypatch.setattr(
+        chatbot.llmconversationhandler,
+        "create_model",
+        lambda *args, **kwargs: ScriptedChatModel(tool_calls=TOOL_CALLS),
+    )
+
+    async with customer_mcp_server(mcp_port):
+        app = app_init(web.Application(), config)
+        client = await aiohttp_client(app)
+        yield client
+
+
+async def drive(name: str, conversations: int, turns: int, turn) -> LoadResult:
+    """Run the conversations concurrently, each taking its turns in sequence"""
+    result = LoadResult(name)
+
+    async def conversation(index: int):
+        for number in range(turns):
+            start = time.perf_counter()
+            try:
+                await turn(f"{name}-{index}", number)
+            except Exception as e:
+                print(f"{name}: turn failed: {e!r}")
+                result.errors += 1
+                continue
+            result.latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(conversation(index) for index in range(conversations)))
+    result.duration = time.perf_counter() - start
+    return result
+
+
+async def test_load(loadtest, load_client, connector):
+    conversations = loadtest.getoption("--loadtest-conversations")
+    turns = loadtest.getoption("--loadtest-turns")
+
+    async def chat_turn(conversation: str, number: int):
+        resp = await load_client.get(
+            "/pie/v0/llm/chat",
+            params={
+                "prompt": f"What time is it? ({number})",
+                "conversation": conversation,
+            },
+        )
+        assert resp.status == 200, await resp.text()
+        assert (await resp.json())["response"]
+
+    async def bot_turn(conversation: str, number: int):
+        activity_id = f"{conversation}-{number}"
+        reply = asyncio.get_running_loop().create_future()
+        connector.replies[activity_id] = reply
+        resp = await load_client.post(
+            "/api/messages",
+            json={
+                "type": "message",
+                "id": activity_id,
+                "text": f"What time is it? ({number})",
+                "channelId": "emulator",
+                "serviceUrl": str(connector.make_url("")),
+                "conversation": {"id": conversation},
+                "from": {"id": "user"},
+                "recipient": {"id": "bot"},
+            },
+        )
+        assert resp.status == 200, await resp.text()
+        assert await asyncio.wait_for(reply, 60)
+
+    rss_start = rss_bytes()
+    results = [
+        await drive("chat", conversations, turns, chat_turn),
+        await drive("bot", conversations, turns, bot_turn),
+    ]
+    rss_end = rss_bytes()
+
+    report = {
+        "conversations": conversations,
+        "turns_per_conversation": turns,
+        "rss_start_bytes": rss_start,
+        "rss_growth_bytes": rss_end - rss_start,
+        **{result.name: result.report() for result in results},
+    }
+    print(json.dumps(report, indent=2))
+    if path := loadtest.getoption("--loadtest-report"):
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
+
+    assert all(result.errors == 0 for result in results)
+    assert load_client.app[keys.llmhandler].turn_queue.queues == {}
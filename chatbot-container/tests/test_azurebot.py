@@ -0,0 +1,265 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+from aiohttp import web
+from botbuilder.schema import Activity, ChannelAccount, ConversationAccount
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from prometheus_client import CollectorRegistry
+
+from chatbot import config_app_create, keys, metrics_app_create
+from chatbot.azurebot import AzureBot, azure_app_create
+from chatbot.config import FileStoreConfig, ServiceConfig
+from chatbot.llmconversationhandler import LLMConversationHandler
+from chatbot.llmconversationhandler.ratelimit import RateLimitExceededError
+from chatbot.llmconversationhandler.turnqueue import ConversationBusyError
+from chatbot.llmconversationhandler.filestore import FileStore
+from chatbot.service import service_app_create
+
+
+@pytest.fixture
+def bot_app():
+    app = web.Application()
+
+    config_filename = "tests/test_data/config.yaml"
+    secrets_dir = os.environ.get("TEST_SECRETS_DIR", "tests/test_data/secrets_sample")
+
+    config: ServiceConfig = ServiceConfig.from_yaml(config_filename, secrets_dir)
+    config.bot.workers = 1
+    config.bot.queue_size = 1
+
+    config_app_create(app, config)
+    metrics_app_create(app)
+    service_app_create(app, config)
+    azure_app_create(app, config)
+
+    return app
+
+
+def message(activity_id: str, text: str) -> dict:
+    return {
+        "type": "message",
+        "id": activity_id,
+        "text": text,
+        "channelId": "emulator",
+        "serviceUrl": "http://localhost:9999",
+        "conversation": {"id": "conversation-1"},
+        "from": {"id": "user"},
+        "recipient": {"id": "bot"},
+    }
+
+
+async def test_bot_acknowledges_then_processes_in_background(aiohttp_client, bot_app):
+    release = asyncio.Event()
+    processed = []
+
+    async def logic(turn_context):
+        await release.wait()
+        processed.append(turn_context.activity.text)
+
+    bot_app[keys.botworkers].logic = logic
+    client = await aiohttp_client(bot_app)
+
+    # Acknowledged before the turn has been processed
+    resp = await client.post("/api/messages", json=message("1", "hello"))
+    assert resp.status == 200
+    assert processed == []
+
+    # A retry of the same activity is acknowledged but not processed again
+    resp = await client.post("/api/messages", json=message("1", "hello"))
+    assert resp.status == 200
+
+    # One activity waits for the busy worker, the next is over capacity
+    resp = await client.post("/api/messages", json=message("2", "second"))
+    assert resp.status == 200
+    resp = await client.post("/api/messages", json=message("3", "third"))
+    assert resp.status == 503
+
+    release.set()
+    await asyncio.wait_for(bot_app[keys.botworkers].queue.join(), 5)
+
+    assert processed == ["hello", "second"]
+    registry = bot_app[keys.metrics]
+    assert (
+        registry.get_sample_value("bot_activities_total", {"result": "duplicate"}) == 1
+    )
+    assert (
+        registry.get_sample_value("bot_activities_total", {"result": "processed"}) == 2
+    )
+
+
+async def test_bot_rejects_unauthenticated_activity(aiohttp_client):
+    config: ServiceConfig = ServiceConfig.from_yaml(
+        "tests/test_data/config.yaml", "tests/test_data/secrets_sample"
+    )
+    config.bot.app_id = "bot-id"
+    app = web.Application()
+    config_app_create(app, config)
+    metrics_app_create(app)
+    service_app_create(app, config)
+    azure_app_create(app, config)
+    client = await aiohttp_client(app)
+
+    resp = await client.post("/api/messages", json=message("1", "hello"))
+
+    assert resp.status == 401
+    assert app[keys.botworkers].queue.empty()
+
+
+async def test_bot_attachment_download_timeout(aiohttp_server, tmp_path):
+    async def slow(request):
+        await asyncio.sleep(1)
+        return web.Response(body=b"%PDF-1.4")
+
+    files = web.Application()
+    files.router.add_get("/slow.pdf", slow)
+    server = await aiohttp_server(files)
+
+    app = web.Application()
+    app[keys.http_session] = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=0.1)
+    )
+    app[keys.llmhandler] = SimpleNamespace(
+        file_store=FileStore(
+            FileStoreConfig(path=tmp_path), registry=CollectorRegistry()
+        )
+    )
+    bot = AzureBot(app, registry=CollectorRegistry())
+
+    sent = []
+
+    async def send_activity(activity):
+        sent.append(activity)
+
+    attachment = SimpleNamespace(
+        content_url=str(server.make_url("/slow.pdf")),
+        content_type="application/pdf",
+        name="slow.pdf",
+    )
+    try:
+        stored = await bot._download_attachment(
+            SimpleNamespace(send_activity=send_activity), attachment
+        )
+    finally:
+        await app[keys.http_session].close()
+
+    assert stored is None
+    assert sent == ["Failed to download file 'slow.pdf'."]
+
+
+def bot_turn(sent: list, **sender) -> SimpleNamespace:
+    """Turn context of a message from the sender, recording the text replies sent"""
+
+    async def send_activity(activity):
+        if isinstance(activity, str):
+            sent.append(activity)
+
+    return SimpleNamespace(
+        activity=Activity(
+            type="message",
+            text="hello",
+            conversation=ConversationAccount(id="conversation-1"),
+            from_property=ChannelAccount(**sender),
+        ),
+        send_activity=send_activity,
+    )
+
+
+async def test_bot_chats_as_the_sending_user():
+    checked, chatted, sent = [], [], []
+
+    async def chat_stream(conversation, identity, prompt):
+        chatted.append(identity)
+        yield "hi"
+
+    app = web.Application()
+    app[keys.llmhandler] = SimpleNamespace(
+        usage=SimpleNamespace(check=checked.append), chat_stream=chat_stream
+    )
+    bot = AzureBot(app, registry=CollectorRegistry())
+
+    await bot.on_message_activity(
+        bot_turn(sent, id="29:teams-user", aad_object_id="aad-user")
+    )
+    await bot.on_message_activity(bot_turn(sent, id="emulator-user"))
+
+    assert checked == chatted == ["aad-user", "emulator-user"]
+    assert sent == ["hi", "hi"]
+
+
+async def test_bot_replies_when_rate_limited():
+    sent = []
+
+    async def chat_stream(conversation, identity, prompt):
+        raise RateLimitExceededError(10, 2.5)
+        yield
+
+    app = web.Application()
+    app[keys.llmhandler] = SimpleNamespace(
+        usage=SimpleNamespace(check=len), chat_stream=chat_stream
+    )
+    bot = AzureBot(app, registry=CollectorRegistry())
+
+    await bot.on_message_activity(bot_turn(sent, id="user"))
+
+    assert sent == ["I am busy right now, please try again in a moment."]
+
+
+async def test_bot_replies_when_conversation_busy():
+    sent = []
+
+    async def chat_stream(conversation, identity, prompt):
+        raise ConversationBusyError("2 prompts are already waiting")
+        yield
+
+    app = web.Application()
+    app[keys.llmhandler] = SimpleNamespace(
+        usage=SimpleNamespace(check=len), chat_stream=chat_stream
+    )
+    bot = AzureBot(app, registry=CollectorRegistry())
+
+    await bot.on_message_activity(bot_turn(sent, id="user"))
+
+    assert sent == [
+        "I am still answering your earlier messages, please wait for my reply."
+    ]
+
+
+class FakeToolChatModel(GenericFakeChatModel):
+    """Fake chat model that accepts tool binding so it can drive the graph"""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+async def test_bot_does_not_share_cached_replies_between_users(tmp_path):
+    config: ServiceConfig = ServiceConfig.from_yaml(
+        "tests/test_data/config.yaml", "tests/test_data/secrets_sample"
+    )
+    config.myai.files.path = tmp_path
+    config.myai.response_cache.enabled = True
+    model = FakeToolChatModel(
+        messages=iter(
+            [AIMessage(content="Smith is customer 1"), AIMessage(content="Found Smith")]
+        )
+    )
+    handler = LLMConversationHandler(
+        config.myai, config.aiclient, model, registry=CollectorRegistry()
+    )
+    handler.bind_tools()
+    handler.compile()
+
+    app = web.Application()
+    app[keys.llmhandler] = handler
+    bot = AzureBot(app, registry=CollectorRegistry())
+    sent = []
+
+    for user in ("alice", "bob"):
+        turn_context = bot_turn(sent, id=user)
+        turn_context.activity.text = "Find customer Smith"
+        await bot.on_message_activity(turn_context)
+
+    assert sent == ["Smith is customer 1", "Found Smith"]
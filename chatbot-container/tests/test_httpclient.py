@@ -0,0 +1,84 @@
+from aiohttp import web
+import pytest
+
+from chatbot import config_app_create, keys, metrics_app_create
+from chatbot.config import ServiceConfig
+from chatbot.hams.config import HttpCheck
+from chatbot.httpclient import http_app_create
+from chatbot.llmconversationhandler import langchain_app_create
+
+
+async def pong(request):
+    return web.Response(text="pong")
+
+
+@pytest.fixture
+def http_app():
+    app = web.Application()
+
+    config: ServiceConfig = ServiceConfig.from_yaml(
+        "tests/test_data/config.yaml", "tests/test_data/secrets_sample"
+    )
+    config.http.per_host = 3
+
+    config_app_create(app, config)
+    http_app_create(app, config)
+    app.router.add_get("/ping", pong)
+
+    return app
+
+
+async def test_http_session_shared(aiohttp_client, http_app):
+    client = await aiohttp_client(http_app)
+    session = http_app[keys.http_session]
+
+    assert session.connector.limit_per_host == 3
+
+    check = HttpCheck(
+        name="ping", description="ping", http=str(client.make_url("/ping"))
+    )
+    assert await check.check(session)
+    assert not session.closed
+
+    await client.close()
+    assert session.closed
+
+
+@pytest.fixture
+def llm_config(tmp_path) -> ServiceConfig:
+    config: ServiceConfig = ServiceConfig.from_yaml(
+        "tests/test_data/config.yaml", "tests/test_data/secrets_sample"
+    )
+    config.myai.files.path = tmp_path
+    return config
+
+
+def llm_app(config: ServiceConfig) -> web.Application:
+    app = web.Application()
+    config_app_create(app, config)
+    metrics_app_create(app)
+    langchain_app_create(app, config)
+    return app
+
+
+async def test_llm_http_clients_closed_on_cleanup(llm_config):
+    app = llm_app(llm_config)
+    app.freeze()
+
+    await app.cleanup()
+
+    assert app[keys.llm_http_client].is_closed
+    assert app[keys.llm_sync_http_client].is_closed
+
+
+def test_llm_http_client_keeps_idle_connections(llm_config):
+    llm_config.http.pool_size = 50
+    llm_config.http.per_host = 10
+
+    pool = llm_app(llm_config)[keys.llm_http_client]._transport._pool
+    assert pool._max_connections == 50
+    assert pool._max_keepalive_connections == 50
+
+    llm_config.http.max_keepalive = 20
+    pool = llm_app(llm_config)[keys.llm_http_client]._transport._pool
+    assert pool._max_keepalive_connections == 20
@@ -1,12 +1,25 @@
+import asyncio
+import base64
+import json
 import os
+from collections.abc import Sequence
 from aiohttp import web
 
 from chatbot import config_app_create, keys, metrics_app_create
-from chatbot.config import ServiceConfig
+from chatbot.config import ModelTierConfig, ServiceConfig, TracingConfig
 from chatbot.llmconversationhandler import LLMConversationHandler, langchain_app_create
+from chatbot.llmconversationhandler.usage import TokenBudgetExceededError
 from chatbot.mcp import mcp_app_create
+from chatbot.tracing import Tracer
 import pytest
 from botbuilder.schema import ConversationAccount
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import tool
+from opentelemetry import trace
+from prometheus_client import CollectorRegistry
+from chatbot.tools import mytools
 
 
 @pytest.fixture
@@ -79,3 +92,547 @@ async def test_llm_chat_post_valid(service_client, enable_livellm):
     }
     resp = await service_client.post("/pie/v0/llm/chat", json=payload)
     assert resp.status == 404
+
+
+class FakeToolChatModel(GenericFakeChatModel):
+    """Fake chat model that accepts tool binding so it can drive the graph"""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+class RecordPrompts(AsyncCallbackHandler):
+    """Records the messages sent to the model"""
+
+    def __init__(self, prompts: list):
+        self.prompts = prompts
+
+    async def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.prompts.extend(messages)
+
+
+def fake_model(
+    replies: Sequence[AIMessage | str], prompts: list | None = None
+) -> FakeToolChatModel:
+    """Fake model answering with the replies in turn, recording its prompts if given a list"""
+    model = FakeToolChatModel(
+        messages=iter(
+            AIMessage(content=reply) if isinstance(reply, str) else reply
+            for reply in replies
+        )
+    )
+    if prompts is not None:
+        model.callbacks = [RecordPrompts(prompts)]
+    return model
+
+
+@pytest.fixture
+def llm_config(tmp_path) -> ServiceConfig:
+    """The test configuration, which tests may change before creating a handler"""
+    config: ServiceConfig = ServiceConfig.from_yaml(
+        "tests/test_data/config.yaml", "tests/test_data/secrets_sample"
+    )
+    config.myai.files.path = tmp_path
+    return config
+
+
+@pytest.fixture
+def fake_llm_handler(llm_config):
+    """
+    Factory of LLMConversationHandlers with the local tools, compiled with llm_config and
+    driven by a fake model answering with the replies given.
+    With tiers, each tier has a fake model answering with its own replies and the last tier
+    is the flagship model.
+    """
+
+    def create(
+        *replies: AIMessage | str,
+        registry: CollectorRegistry | None = None,
+        prompts: list | None = None,
+        tiers: dict[str, Sequence[AIMessage | str]] | None = None,
+        tracer: Tracer | None = None,
+    ) -> LLMConversationHandler:
+        models = (
+            {name: fake_model(tier, prompts) for name, tier in tiers.items()}
+            if tiers
+            else None
+        )
+        handler = LLMConversationHandler(
+            llm_config.myai,
+            llm_config.aiclient,
+            list(models.values())[-1] if models else fake_model(replies, prompts),
+            registry=registry or CollectorRegistry(),
+            tiers=models,
+            tracer=tracer,
+        )
+        handler.register_tools(mytools)
+        handler.bind_tools()
+        handler.compile()
+        return handler
+
+    return create
+
+
+async def test_llm_chat_stream(fake_llm_handler):
+    handler = fake_llm_handler("Hello from the fake model")
+    conversation = ConversationAccount(id="test-stream")
+
+    fragments = [
+        fragment
+        async for fragment in handler.chat_stream(conversation, "my-identity", "Hello")
+    ]
+
+    assert len(fragments) > 1
+    assert "".join(fragments) == "Hello from the fake model"
+
+
+async def test_llm_chat_summarises_old_turns(llm_config, fake_llm_handler):
+    llm_config.aiclient.context_length = 200
+    llm_config.myai.context.reserve_tokens = 50
+    handler = fake_llm_handler("answer " * 100, "Summary so far", "short answer")
+
+    conversation = ConversationAccount(id="test-summary")
+    await handler.chat(conversation, "my-identity", "first question")
+    await handler.chat(conversation, "my-identity", "second question")
+
+    state = await handler.graph.aget_state(handler.get_graph_config(conversation))
+    assert state.values["summary"] == "Summary so far"
+    assert [message.content for message in state.values["messages"]][0] == (
+        "second question"
+    )
+
+
+async def test_llm_chat_summary_counts_against_budget(llm_config, fake_llm_handler):
+    llm_config.aiclient.context_length = 200
+    llm_config.myai.context.reserve_tokens = 50
+    llm_config.myai.usage.daily_tokens = 100
+    registry = CollectorRegistry()
+    handler = fake_llm_handler(
+        "answer " * 100,
+        AIMessage(
+            content="Summary so far",
+            usage_metadata={
+                "input_tokens": 90,
+                "output_tokens": 20,
+                "total_tokens": 110,
+            },
+        ),
+        "short answer",
+        registry=registry,
+    )
+
+    conversation = ConversationAccount(id="test-summary-budget")
+    await handler.chat(conversation, "my-identity", "first question")
+    assert await handler.chat(conversation, "my-identity", "second question") == (
+        "short answer"
+    )
+
+    assert (
+        registry.get_sample_value(
+            "llm_identity_tokens_total",
+            {
+                "model": llm_config.aiclient.model,
+                "identity": "my-identity",
+                "type": "output",
+            },
+        )
+        == 20
+    )
+    with pytest.raises(TokenBudgetExceededError):
+        await handler.chat(conversation, "my-identity", "third question")
+
+
+async def test_llm_chat_calls_tools_through_registry(fake_llm_handler):
+    registry = CollectorRegistry()
+    handler = fake_llm_handler(
+        AIMessage(
+            content="",
+            tool_calls=[
+                {"name": "sum_numbers", "args": {"numbers": [1, 2]}, "id": "1"},
+                {
+                    "name": "search_records_by_name",
+                    "args": {"search_name": "Smith"},
+                    "id": "2",
+                },
+            ],
+        ),
+        "The sum is 3",
+        registry=registry,
+    )
+
+    conversation = ConversationAccount(id="test-tools")
+    reply = await handler.chat(conversation, "my-identity", "add 1 and 2")
+
+    state = await handler.graph.aget_state(handler.get_graph_config(conversation))
+    tool_messages = [m for m in state.values["messages"] if m.type == "tool"]
+
+    assert reply == "The sum is 3"
+    assert [m.status for m in tool_messages] == ["success", "success"]
+    assert tool_messages[0].content == "3.0"
+    assert (
+        registry.get_sample_value("tool_usage_count", {"tool_name": "sum_numbers"}) == 1
+    )
+
+
+async def test_llm_upload_keeps_file_reference(fake_llm_handler):
+    prompts = []
+    handler = fake_llm_handler("It is a PDF", prompts=prompts)
+
+    async def chunks():
+        yield b"%PDF-"
+        yield b"1.4"
+
+    stored = await handler.file_store.save_stream(chunks())
+    conversation = ConversationAccount(id="test-upload")
+    await handler.upload(conversation, "policy.pdf", "application/pdf", stored)
+    reply = await handler.chat(conversation, "my-identity", "what is this?")
+
+    state = await handler.graph.aget_state(handler.get_graph_config(conversation))
+    (reference,) = state.values["messages"][0].content
+    (file_block,) = prompts[0][1].content
+
+    assert reply == "It is a PDF"
+    assert reference["ref"] == stored.sha256
+    assert "data" not in reference
+    assert file_block["data"] == base64.b64encode(b"%PDF-1.4").decode()
+    assert file_block["mime_type"] == "application/pdf"
+
+
+async def test_llm_keeps_file_across_tool_calls(fake_llm_handler):
+    prompts = []
+    handler = fake_llm_handler(
+        AIMessage(
+            content="",
+            tool_calls=[
+                {"name": "sum_numbers", "args": {"numbers": [1, 2]}, "id": "1"}
+            ],
+        ),
+        "The total is 3",
+        prompts=prompts,
+    )
+
+    async def chunks():
+        yield b"%PDF-1.4"
+
+    stored = await handler.file_store.save_stream(chunks())
+    conversation = ConversationAccount(id="test-upload-tools")
+    await handler.upload(conversation, "invoice.pdf", "application/pdf", stored)
+    reply = await handler.chat(conversation, "my-identity", "add up the invoice")
+
+    # The call after the tool call is still sent the file
+    encoded = base64.b64encode(b"%PDF-1.4").decode()
+    for prompt in prompts:
+        (file_block,) = prompt[1].content
+        assert file_block["data"] == encoded
+    assert reply == "The total is 3"
+    assert len(prompts) == 2
+
+
+async def test_llm_update_tools(fake_llm_handler):
+    @tool
+    def get_weather(city: str) -> str:
+        """Get the weather for a city."""
+        return "sunny"
+
+    @tool
+    def get_time() -> str:
+        """Get the time."""
+        return "noon"
+
+    @tool
+    def get_weather_v2(city: str, day: str) -> str:
+        """Get the weather for a city on a day."""
+        return "rain"
+
+    get_weather_v2.name = "get_weather"
+
+    @tool
+    def unconfigured() -> str:
+        """Not in the toolbox configuration."""
+        return ""
+
+    handler = fake_llm_handler()
+    original_graph = handler.graph
+
+    assert handler.update_tools([get_weather, get_time, unconfigured])
+    assert handler.graph is not original_graph
+    assert handler.mcp_tool_names == {"get_weather", "get_time"}
+
+    graph = handler.graph
+    assert not handler.update_tools([get_weather, get_time])
+    assert handler.graph is graph
+
+    assert handler.update_tools([get_weather_v2])
+    assert handler.function_registry.registry["get_weather"].tool is get_weather_v2
+    assert "get_time" not in handler.function_registry.registry
+    assert "sum_numbers" in handler.function_registry.registry
+
+
+async def test_llm_tool_removed_during_turn(fake_llm_handler):
+    @tool
+    def get_weather(city: str) -> str:
+        """Get the weather for a city."""
+        return "sunny"
+
+    handler = fake_llm_handler(
+        AIMessage(
+            content="",
+            tool_calls=[{"name": "get_weather", "args": {"city": "Leeds"}, "id": "1"}],
+        ),
+        "I cannot check the weather",
+    )
+    assert handler.update_tools([get_weather])
+
+    class RefreshCatalogue(AsyncCallbackHandler):
+        """Removes the MCP tools after the model has called them"""
+
+        async def on_llm_end(self, response, **kwargs):
+            handler.update_tools([])
+
+    handler.client.callbacks = [RefreshCatalogue()]
+    conversation = ConversationAccount(id="test-tool-removed")
+    reply = await handler.chat(conversation, "my-identity", "weather in Leeds?")
+
+    state = await handler.graph.aget_state(handler.get_graph_config(conversation))
+    (tool_message,) = [m for m in state.values["messages"] if m.type == "tool"]
+
+    assert reply == "I cannot check the weather"
+    assert tool_message.status == "error"
+    assert "get_weather is not available" in tool_message.content
+
+
+async def test_llm_chat_served_from_response_cache(llm_config, fake_llm_handler):
+    llm_config.myai.response_cache.enabled = True
+    handler = fake_llm_handler(
+        "Smith is customer 1",
+        AIMessage(
+            content="",
+            tool_calls=[
+                {"name": "delete_record_by_id", "args": {"record_id": 1}, "id": "1"}
+            ],
+        ),
+        "Deleted",
+        "Deleted again",
+    )
+
+    conversation = ConversationAccount(id="test-response-cache")
+    first = await handler.chat(conversation, "my-identity", "Find customer Smith")
+    second = await handler.chat(conversation, "my-identity", "find customer smith")
+    await handler.chat(conversation, "my-identity", "Delete customer 1")
+    deleted = await handler.chat(conversation, "my-identity", "Delete customer 1")
+
+    state = await handler.graph.aget_state(handler.get_graph_config(conversation))
+
+    assert first == second == "Smith is customer 1"
+    assert deleted == "Deleted again"
+    assert [message.content for message in state.values["messages"][:4]] == [
+        "Find customer Smith",
+        "Smith is customer 1",
+        "find customer smith",
+        "Smith is customer 1",
+    ]
+
+
+async def test_llm_chat_sends_stable_system_prefix(fake_llm_handler):
+    usage = {
+        "input_tokens": 100,
+        "output_tokens": 5,
+        "total_tokens": 105,
+        "input_token_details": {"cache_read": 75},
+    }
+    prompts = []
+    registry = CollectorRegistry()
+    handler = fake_llm_handler(
+        AIMessage(content="first", usage_metadata=usage),
+        AIMessage(content="second", usage_metadata=usage),
+        registry=registry,
+        prompts=prompts,
+    )
+    assert handler.update_prompts(
+        {"customers": {"policy": [HumanMessage(content="Never delete customers.")]}}
+    )
+
+    conversation = ConversationAccount(id="test-system-prefix")
+    await handler.chat(conversation, "my-identity", "hello")
+    await handler.chat(conversation, "my-identity", "again")
+
+    first, second = prompts
+    assert first[0] is second[0]
+    assert first[0].type == "system"
+    assert first[0].content == (
+        "You are a helpful assistant.\n\nNever delete customers."
+    )
+    assert registry.get_sample_value("llm_cached_input_tokens_total") == 150
+    assert registry.get_sample_value("llm_input_tokens_total") == 200
+
+    assert not handler.update_prompts(handler.mcp_prompts)
+    assert handler.update_prompts({})
+    assert handler.system_prefix[0].content == "You are a helpful assistant."
+
+
+async def test_llm_routes_between_model_tiers(llm_config, fake_llm_handler):
+    llm_config.aiclient.models = [
+        ModelTierConfig(name="small", model="small-model", max_prompt_tokens=20),
+        ModelTierConfig(name="large", model="large-model"),
+    ]
+    registry = CollectorRegistry()
+    handler = fake_llm_handler(
+        registry=registry,
+        tiers={
+            "small": [
+                "Hi",
+                AIMessage(
+                    content="",
+                    tool_calls=[
+                        {"name": "sum_numbers", "args": {"numbers": [1, 2]}, "id": "1"}
+                    ],
+                ),
+                "",
+            ],
+            "large": ["A long answer", "The sum is 3", "Escalated"],
+        },
+    )
+
+    conversation = ConversationAccount(id="test-routing")
+
+    assert await handler.chat(conversation, "my-identity", "hello") == "Hi"
+    assert (
+        await handler.chat(conversation, "my-identity", "explain " * 50)
+        == "A long answer"
+    )
+    assert await handler.chat(conversation, "my-identity", "add 1 and 2") == (
+        "The sum is 3"
+    )
+    assert await handler.chat(conversation, "my-identity", "hmm") == "Escalated"
+
+    def routes(model: str, reason: str) -> float:
+        return registry.get_sample_value(
+            "llm_routes_total", {"model": model, "reason": reason}
+        )
+
+    assert routes("small", "simple") == 3
+    assert routes("large", "complex") == 1
+    assert routes("large", "tool_use") == 1
+    assert routes("large", "low_confidence") == 1
+
+
+async def test_llm_chat_serialises_and_coalesces_turns(fake_llm_handler):
+    prompts = []
+    handler = fake_llm_handler("first", "both", prompts=prompts)
+
+    conversation = ConversationAccount(id="test-turns")
+    replies = await asyncio.gather(
+        handler.chat(conversation, "my-identity", "one"),
+        handler.chat(conversation, "my-identity", "two"),
+        handler.chat(conversation, "my-identity", "three"),
+    )
+
+    # The prompts arriving during the first turn are answered by a single second turn
+    assert replies == ["first", "both", "both"]
+    assert len(prompts) == 2
+    assert [message.content for message in prompts[1][-2:]] == ["two", "three"]
+    assert not handler.turn_queue.queues
+
+
+async def test_llm_chat_records_turn_spans(fake_llm_handler, tmp_path):
+    registry = CollectorRegistry()
+    path = tmp_path / "spans.jsonl"
+    tracer = Tracer(TracingConfig(exporter="file", path=path), registry=registry)
+    handler = fake_llm_handler(
+        AIMessage(
+            content="",
+            tool_calls=[
+                {"name": "sum_numbers", "args": {"numbers": [1, 2]}, "id": "1"},
+            ],
+        ),
+        "The sum is 3",
+        registry=registry,
+        tracer=tracer,
+    )
+
+    reply = await handler.chat(
+        ConversationAccount(id="test-spans"), "my-identity", "add 1 and 2"
+    )
+    tracer.shutdown()
+
+    def spans(name: str) -> float | None:
+        return registry.get_sample_value("turn_span_latency_count", {"span": name})
+
+    assert reply == "The sum is 3"
+    assert spans("turn") == 1
+    assert spans("checkpoint.load") == 1
+    assert spans("checkpoint.write") > 1
+    assert spans("node.context") == 2
+    assert spans("node.chatbot") == 2
+    assert spans("llm") == 2
+    assert spans("node.tools") == 1
+    assert spans("tool") == 1
+
+    exported = [json.loads(line) for line in path.read_text().splitlines()]
+    (tool,) = [span for span in exported if span["name"] == "tool"]
+    (turn,) = [span for span in exported if span["name"] == "turn"]
+    assert tool["attributes"] == {"tool.name": "sum_numbers", "tool.status": "success"}
+    assert tool["status"]["status_code"] == "UNSET"
+    assert tool["context"]["trace_id"] == turn["context"]["trace_id"]
+
+
+async def test_llm_chat_stream_closed_early(fake_llm_handler, tmp_path, caplog):
+    path = tmp_path / "spans.jsonl"
+    tracer = Tracer(
+        TracingConfig(exporter="file", path=path), registry=CollectorRegistry()
+    )
+    handler = fake_llm_handler("Hello from the fake model", tracer=tracer)
+
+    stream = handler.chat_stream(
+        ConversationAccount(id="test-stream-closed"), "my-identity", "Hello"
+    )
+    assert await anext(stream) == "Hello"
+    # The turn span does not leak into the caller between fragments
+    assert not trace.get_current_span().get_span_context().is_valid
+
+    # Closed by another task, as when a client disconnects
+    await asyncio.create_task(stream.aclose())
+    tracer.shutdown()
+
+    assert "Failed to detach context" not in caplog.text
+    exported = [json.loads(line) for line in path.read_text().splitlines()]
+    (turn,) = [span for span in exported if span["name"] == "turn"]
+    assert {span["context"]["trace_id"] for span in exported} == {
+        turn["context"]["trace_id"]
+    }
+
+
+async def test_llm_chat_enforces_daily_token_budget(llm_config, fake_llm_handler):
+    llm_config.myai.usage.daily_tokens = 100
+    registry = CollectorRegistry()
+    handler = fake_llm_handler(
+        AIMessage(
+            content="first",
+            usage_metadata={
+                "input_tokens": 90,
+                "output_tokens": 20,
+                "total_tokens": 110,
+            },
+        ),
+        registry=registry,
+    )
+
+    conversation = ConversationAccount(id="test-budget")
+    assert await handler.chat(conversation, "my-identity", "hello") == "first"
+
+    with pytest.raises(TokenBudgetExceededError):
+        await handler.chat(conversation, "my-identity", "again")
+    # Other identities have their own budget
+    handler.usage.check("other-identity")
+
+    assert (
+        registry.get_sample_value(
+            "llm_identity_tokens_total",
+            {
+                "model": llm_config.aiclient.model,
+                "identity": "my-identity",
+                "type": "output",
+            },
+        )
+        == 20
+    )
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+from aiohttp import web
+from prometheus_client import CollectorRegistry
+
+from chatbot import config_app_create, keys, metrics_app_create
+from chatbot.config import ServiceConfig
+from chatbot.hams import hams_app_create
+from chatbot.service import service_app_create
+from chatbot.service.looplag import LoopLagMonitor
+
+
+def service_config() -> ServiceConfig:
+    config: ServiceConfig = ServiceConfig.from_yaml(
+        "tests/test_data/config.yaml", "tests/test_data/secrets_sample"
+    )
+    config.events.lagInterval = timedelta(milliseconds=20)
+    config.events.blockingThreshold = timedelta(milliseconds=50)
+    return config
+
+
+def blocking_call():
+    time.sleep(0.3)
+
+
+async def test_monitor_reports_blocking_call():
+    config = service_config()
+    config.events.blockingDebug = True
+    registry = CollectorRegistry()
+    monitor = LoopLagMonitor(config.events, registry=registry)
+
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0.05)
+    assert monitor.debug
+
+    blocking_call()
+    await asyncio.sleep(0.05)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert not monitor.debug
+    (report,) = monitor.reports
+    assert report["blocked"] >= 0.05
+    assert "in blocking_call" in report["stack"]
+    assert registry.get_sample_value("event_loop_blocked_total") == 1
+    assert registry.get_sample_value("event_loop_lag_count") > 1
+    assert registry.get_sample_value("event_loop_lag_bucket", {"le": "0.1"}) < (
+        registry.get_sample_value("event_loop_lag_count")
+    )
+
+
+async def test_hams_switches_blocking_debug(aiohttp_client):
+    config = service_config()
+    app = web.Application()
+    config_app_create(app, config)
+    metrics_app_create(app)
+    service_app_create(app, config)
+    hams_app_create(app, config.hams)
+    client = await aiohttp_client(app[keys.hams].hams_app)
+    monitor = app[keys.events].loopLag
+
+    # The monitor runs with the service
+    resp = await client.post("/hams/looplag", json={"debug": True})
+    assert resp.status == 409
+
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0.05)
+
+    resp = await client.post("/hams/looplag", json={"debug": "yes"})
+    assert resp.status == 400
+    resp = await client.post("/hams/looplag", json={"debug": True})
+    assert await resp.json() == {"debug": True}
+
+    blocking_call()
+    await asyncio.sleep(0.05)
+
+    resp = await client.get("/hams/looplag")
+    body = await resp.json()
+    assert body["debug"]
+    assert body["threshold"] == 0.05
+    assert len(body["reports"]) == 1
+
+    resp = await client.post("/hams/looplag", json={"debug": False})
+    assert await resp.json() == {"debug": False}
+    task.cancel()
+
+
+async def test_switching_debug_does_not_wait_for_watchdog():
+    config = service_config()
+    config.events.blockingDebug = True
+    monitor = LoopLagMonitor(config.events, registry=CollectorRegistry())
+    # A watchdog slow to finish its report, eg logging to a slow handler
+    monitor._report = lambda blocked, stack: time.sleep(1)
+
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0.05)
+    watchdog = monitor.watchdog
+    blocking_call()
+    await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    monitor.setDebug(False)
+    monitor.setDebug(True)
+    assert time.perf_counter() - start < 0.1
+    assert monitor.watchdog is not watchdog
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    watchdog.join(2)
+    assert not watchdog.is_alive()
@@ -0,0 +1,253 @@
+import asyncio
+import socket
+import time
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+import uvicorn
+from aiohttp import web
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from mcp.server.fastmcp import FastMCP
+
+from langchain_core.messages import HumanMessage
+from prometheus_client import CollectorRegistry
+
+from chatbot import keys
+from chatbot.config import ServiceConfig
+from chatbot.config.tool import McpConfig
+from chatbot.mcp import MCPMetrics, discover, rediscover
+from chatbot.mcp.pool import (
+    MCPSessionMetrics,
+    MCPSessionPool,
+    MCPSessionPools,
+    MCPSessionUnavailableError,
+)
+
+DELAY = 0.2
+
+
+class FakeMCPClient:
+    """Client answering every request after a delay, or failing for broken servers"""
+
+    def __init__(self, broken: tuple[str, ...] = ("broken",)):
+        self.broken = broken
+
+    async def request(self, server_name: str, value):
+        await asyncio.sleep(DELAY)
+        if server_name in self.broken:
+            raise ConnectionError("connection refused")
+        if server_name == "slow":
+            await asyncio.sleep(10)
+        return value
+
+    async def get_tools(self, *, server_name: str):
+        return await self.request(
+            server_name, [SimpleNamespace(name=f"{server_name}-tool")]
+        )
+
+    async def get_resources(self, server_name: str):
+        return await self.request(server_name, [])
+
+    async def get_prompt(self, server_name: str, prompt: str):
+        return await self.request(server_name, [HumanMessage(content=prompt)])
+
+
+def mcp(name: str) -> McpConfig:
+    return McpConfig(
+        name=name,
+        url="http://localhost/mcp",
+        transport="sse",
+        prompts=["one", "two", "three"],
+        timeout=timedelta(seconds=1),
+    )
+
+
+async def test_discover_concurrently():
+    registry = CollectorRegistry()
+    start = time.perf_counter()
+
+    mcpObjects = await discover(
+        FakeMCPClient(),
+        [mcp("first"), mcp("second"), mcp("broken"), mcp("slow")],
+        MCPMetrics(registry=registry),
+    )
+
+    assert time.perf_counter() - start < 1.5
+    assert [tool.name for tool in mcpObjects.tools] == ["first-tool", "second-tool"]
+    assert list(mcpObjects.prompts["second"]) == ["one", "two", "three"]
+    assert mcpObjects.unavailable == ["broken", "slow"]
+    assert (
+        registry.get_sample_value("mcp_discovery_failures_total", {"server": "slow"})
+        == 1
+    )
+    assert (
+        registry.get_sample_value("mcp_discovery_seconds", {"server": "first"})
+        < 2 * DELAY
+    )
+
+
+async def test_rediscover_keeps_unavailable_servers():
+    config: ServiceConfig = ServiceConfig.from_yaml(
+        "tests/test_data/config.yaml", "tests/test_data/secrets_sample"
+    )
+    config.myai.toolbox.mcps = [mcp("first"), mcp("second")]
+
+    app = web.Application()
+    app[keys.config] = config
+    app[keys.mcpmetrics] = MCPMetrics(registry=CollectorRegistry())
+    app[keys.mcpclient] = FakeMCPClient(broken=())
+    app[keys.mcpobjects] = await discover(
+        app[keys.mcpclient], config.myai.toolbox.mcps, app[keys.mcpmetrics]
+    )
+
+    app[keys.mcpclient] = FakeMCPClient(broken=("second",))
+    mcpObjects = await rediscover(app)
+
+    assert app[keys.mcpobjects] is mcpObjects
+    assert mcpObjects.unavailable == ["second"]
+    assert [tool.name for tool in mcpObjects.tools] == ["first-tool", "second-tool"]
+    assert list(mcpObjects.prompts["second"]) == ["one", "two", "three"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def mcp_server(port: int):
+    """Run an MCP server in process over streamable HTTP"""
+    server = FastMCP("customers")
+
+    @server.tool()
+    def add(a: int, b: int) -> int:
+        """Add two numbers"""
+        return a + b
+
+    @server.prompt()
+    def greeting() -> str:
+        """Greet the user"""
+        return "Hello"
+
+    uvicorn_server = uvicorn.Server(
+        uvicorn.Config(
+            server.streamable_http_app(), port=port, log_level="warning", lifespan="on"
+        )
+    )
+    task = asyncio.create_task(uvicorn_server.serve())
+    while not uvicorn_server.started:
+        await asyncio.sleep(0.01)
+    try:
+        yield
+    finally:
+        uvicorn_server.should_exit = True
+        await task
+
+
+def pooled_mcp(port: int, **kwargs) -> McpConfig:
+    return McpConfig(
+        name="customers",
+        url=f"http://127.0.0.1:{port}/mcp",
+        transport="streamable_http",
+        prompts=["greeting"],
+        **kwargs,
+    )
+
+
+async def test_session_pool_reuses_sessions():
+    port = free_port()
+    config = pooled_mcp(port, sessions=1)
+    registry = CollectorRegistry()
+    client = MultiServerMCPClient(
+        {config.name: {"url": str(config.url), "transport": config.transport.value}}
+    )
+
+    async with mcp_server(port):
+        pools = MCPSessionPools(client, [config], registry=registry)
+        pools.start()
+        try:
+            mcpObjects = await discover(pools, [config], MCPMetrics(registry=registry))
+            (add,) = mcpObjects.tools
+            results = await asyncio.gather(
+                *(add.ainvoke({"a": n, "b": 1}) for n in range(5))
+            )
+        finally:
+            await pools.close()
+
+    assert results == ["1", "2", "3", "4", "5"]
+    assert mcpObjects.prompts["customers"]["greeting"][0].content == "Hello"
+    assert (
+        registry.get_sample_value("mcp_session_connects_total", {"server": "customers"})
+        == 1
+    )
+    assert (
+        registry.get_sample_value(
+            "mcp_request_count", {"server": "customers", "method": "call_tool"}
+        )
+        == 5
+    )
+
+
+async def test_session_pool_reconnects():
+    port = free_port()
+    config = pooled_mcp(
+        port,
+        reconnect_backoff=timedelta(seconds=0.05),
+        reconnect_backoff_max=timedelta(seconds=0.2),
+        timeout=timedelta(seconds=5),
+    )
+    registry = CollectorRegistry()
+    client = MultiServerMCPClient(
+        {config.name: {"url": str(config.url), "transport": config.transport.value}}
+    )
+
+    pools = MCPSessionPools(client, [config], registry=registry)
+    pools.start()
+    try:
+        await asyncio.sleep(0.2)
+        assert not pools.pools["customers"].sessions
+
+        async with mcp_server(port):
+            try:
+                tools = await pools.get_tools(server_name="customers")
+                result = await tools[0].ainvoke({"a": 1, "b": 2})
+            finally:
+                # The sessions are closed before the server shuts down, which waits for them
+                await pools.close()
+    finally:
+        await pools.close()
+
+    assert result == "3"
+    assert (
+        registry.get_sample_value(
+            "mcp_session_disconnects_total", {"server": "customers"}
+        )
+        >= 1
+    )
+
+
+async def test_session_pool_waits_while_drained():
+    pool = MCPSessionPool(
+        None,
+        pooled_mcp(free_port(), timeout=timedelta(seconds=0.2)),
+        MCPSessionMetrics(registry=CollectorRegistry()),
+    )
+    lost, replacement = SimpleNamespace(), SimpleNamespace()
+
+    waiting = asyncio.create_task(pool.session())
+    await asyncio.sleep(0)
+    # The session is lost before the waiting request resumes
+    pool._add(lost)
+    pool._remove(lost)
+    await asyncio.sleep(0.05)
+    assert not waiting.done()
+
+    pool._add(replacement)
+    assert await waiting is replacement
+
+    pool._remove(replacement)
+    with pytest.raises(MCPSessionUnavailableError):
+        await pool.session()
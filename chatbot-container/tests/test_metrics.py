@@ -0,0 +1,90 @@
+import pytest
+from aiohttp import web
+from opentelemetry import trace
+from prometheus_client import Histogram
+
+from chatbot import config_app_create, keys, metrics_app_create
+from chatbot.config import ServiceConfig
+from chatbot.hams import hams_app_create
+from chatbot.metrics import LLM_LATENCY_BUCKETS, current_exemplar, timed
+
+TRACE_ID = 0x0AF7651916CD43DD8448EB211C80319C
+SPAN_ID = 0x00F067AA0BA902B7
+
+
+@pytest.fixture
+def hams_client(aiohttp_client):
+    config: ServiceConfig = ServiceConfig.from_yaml(
+        "tests/test_data/config.yaml", "tests/test_data/secrets_sample"
+    )
+    app = web.Application()
+    config_app_create(app, config)
+    metrics_app_create(app)
+    hams_app_create(app, config.hams)
+
+    latency = Histogram(
+        "test_latency",
+        "Latency",
+        buckets=LLM_LATENCY_BUCKETS,
+        registry=app[keys.metrics],
+    )
+    latency.observe(0.3, {"trace_id": format(TRACE_ID, "032x")})
+
+    return aiohttp_client(app[keys.hams].hams_app)
+
+
+async def test_custom_metrics_from_one_registry(hams_client):
+    client = await hams_client
+
+    resp = await client.get("/hams/custommetrics")
+    text = await resp.text()
+
+    assert resp.status == 200
+    assert resp.headers["Content-Type"].startswith("text/plain")
+    # Process and runtime metrics come from the service registry, once
+    assert text.count("# TYPE python_info gauge") == 1
+    assert "python_gc_objects_collected_total" in text
+    assert 'test_latency_bucket{le="0.5"} 1.0' in text
+    assert "trace_id" not in text
+
+
+async def test_custom_metrics_openmetrics_exemplars(hams_client):
+    client = await hams_client
+
+    resp = await client.get(
+        "/hams/custommetrics", headers={"Accept": "application/openmetrics-text"}
+    )
+    text = await resp.text()
+
+    assert resp.headers["Content-Type"].startswith("application/openmetrics-text")
+    assert (
+        f'test_latency_bucket{{le="0.5"}} 1.0 # {{trace_id="{TRACE_ID:032x}"}} 0.3'
+        in text
+    )
+    assert text.endswith("# EOF\n")
+
+
+def test_timed_observes_with_current_trace():
+    histogram = Histogram("latency", "Latency", buckets=LLM_LATENCY_BUCKETS)
+
+    assert current_exemplar() is None
+    span = trace.NonRecordingSpan(
+        trace.SpanContext(
+            trace_id=TRACE_ID,
+            span_id=SPAN_ID,
+            is_remote=False,
+            trace_flags=trace.TraceFlags(trace.TraceFlags.SAMPLED),
+        )
+    )
+    with trace.use_span(span), timed(histogram):
+        pass
+
+    (bucket,) = [
+        sample
+        for sample in histogram.collect()[0].samples
+        if sample.exemplar is not None
+    ]
+    assert bucket.exemplar.labels == {
+        "trace_id": f"{TRACE_ID:032x}",
+        "span_id": f"{SPAN_ID:016x}",
+    }
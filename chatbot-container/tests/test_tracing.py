@@ -0,0 +1,78 @@
+import json
+
+import pytest
+from prometheus_client import CollectorRegistry
+
+from chatbot.config import TracingConfig
+from chatbot.tracing import NULL_SPAN, Tracer
+
+
+def test_tracer_records_span_latency():
+    registry = CollectorRegistry()
+    tracer = Tracer(registry=registry)
+
+    with tracer.span("llm", **{"llm.model": "small"}) as span:
+        span.set_attribute("llm.tool_calls", 0)
+    with pytest.raises(ValueError):
+        with tracer.span("llm"):
+            raise ValueError("failed call")
+
+    assert span is NULL_SPAN
+    assert registry.get_sample_value("turn_span_latency_count", {"span": "llm"}) == 2
+
+
+def test_tracer_uses_global_tracer_provider():
+    tracer = Tracer(TracingConfig(exporter="global"), registry=CollectorRegistry())
+
+    with tracer.span("turn") as span:
+        span.set_attribute("chat.conversation", "conversation-1")
+
+    assert tracer.otel is not None
+    assert span is not NULL_SPAN
+
+
+def test_tracer_exports_nested_spans_to_file(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    tracer = Tracer(
+        TracingConfig(exporter="file", path=path), registry=CollectorRegistry()
+    )
+
+    with tracer.span("turn"):
+        with tracer.span("tool", **{"tool.name": "sum_numbers"}):
+            pass
+    tracer.shutdown()
+
+    assert tracer.span_file.closed
+    tool, turn = [json.loads(line) for line in path.read_text().splitlines()]
+    assert (tool["name"], turn["name"]) == ("tool", "turn")
+    assert tool["attributes"] == {"tool.name": "sum_numbers"}
+    assert tool["parent_id"] == turn["context"]["span_id"]
+    assert tool["context"]["trace_id"] == turn["context"]["trace_id"]
+
+
+def test_tracing_config_requires_path_for_file_exporter():
+    with pytest.raises(ValueError):
+        TracingConfig(exporter="file")
+
+
+def test_tracer_span_latency_has_trace_exemplar(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    tracer = Tracer(
+        TracingConfig(exporter="file", path=path), registry=CollectorRegistry()
+    )
+
+    with tracer.span("turn"):
+        pass
+    tracer.shutdown()
+
+    (turn,) = [json.loads(line) for line in path.read_text().splitlines()]
+    (bucket,) = [
+        sample
+        for sample in tracer.span_metric.collect()[0].samples
+        if sample.exemplar is not None
+    ]
+    assert bucket.labels["span"] == "turn"
+    assert bucket.exemplar.labels == {
+        "trace_id": turn["context"]["trace_id"].removeprefix("0x"),
+        "span_id": turn["context"]["span_id"].removeprefix("0x"),
+    }
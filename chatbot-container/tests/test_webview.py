@@ -1,8 +1,12 @@
 import os
+from types import SimpleNamespace
 from aiohttp import web
 from chatbot import config_app_create, metrics_app_create
 from chatbot.service import service_app_create
 from chatbot.config import ServiceConfig
+from chatbot import keys
+from chatbot.llmconversationhandler.ratelimit import RateLimitExceededError
+from chatbot.llmconversationhandler.turnqueue import ConversationBusyError
 import pytest
 
 
@@ -117,3 +121,106 @@ async def test_chunks(service_client):
 
     chunks = await resp.json()
     assert chunks == {"chunks": 0}  # Adjust based on actual expected response
+
+
+async def test_chat_rejected_when_over_capacity(service_client, service_app):
+    events = service_app[keys.events]
+
+    with events.turn():
+        assert events.turns == 1
+        events.turns = events.config.maxTurns
+        resp = await service_client.get("/pie/v0/llm/chat", params={"prompt": "hi"})
+        assert resp.status == 503
+        assert resp.headers["Retry-After"] == "1"
+        data = await resp.json()
+        assert data["reason"] == "turns"
+        events.turns = 1
+    assert events.turns == 0
+
+    resp = await service_client.get("/pie/v0/llm/chat/stream", params={"prompt": "hi"})
+    assert resp.status != 503
+
+
+async def test_overloaded_reasons(service_app):
+    events = service_app[keys.events]
+
+    assert events.spareCapacity()
+    assert events.overloaded(queuedRequests=events.config.maxQueuedRequests) == (
+        "queued_requests"
+    )
+
+    events.loopLag.lag = events.config.maxLoopLag.total_seconds()
+    assert events.overloaded() == "loop_lag"
+    events.loopLag.lag = 0
+
+    events.addChunks(events.config.maxChunks + 1)
+    assert not events.spareCapacity()
+
+
+async def test_chat_rate_limited(service_client, service_app):
+    async def chat(conversation, identity, prompt):
+        raise RateLimitExceededError(10, 2.5)
+
+    async def chat_stream(conversation, identity, prompt):
+        raise RateLimitExceededError(10, 2.5)
+        yield
+
+    service_app[keys.llmhandler] = SimpleNamespace(
+        chat=chat,
+        chat_stream=chat_stream,
+        usage=SimpleNamespace(check=len),
+        rate_limiter=SimpleNamespace(queued=0),
+    )
+
+    resp = await service_client.get("/pie/v0/llm/chat", params={"prompt": "hi"})
+    assert resp.status == 429
+    assert resp.headers["Retry-After"] == "3"
+
+    resp = await service_client.get("/pie/v0/llm/chat/stream", params={"prompt": "hi"})
+    assert resp.status == 429
+    assert resp.headers["Retry-After"] == "3"
+
+
+async def test_chat_stream_rate_limited_part_way(service_client, service_app):
+    async def chat_stream(conversation, identity, prompt):
+        yield "Looking up"
+        raise RateLimitExceededError(10, 2.5)
+
+    service_app[keys.llmhandler] = SimpleNamespace(
+        chat_stream=chat_stream,
+        usage=SimpleNamespace(check=len),
+        rate_limiter=SimpleNamespace(queued=0),
+    )
+
+    resp = await service_client.get("/pie/v0/llm/chat/stream", params={"prompt": "hi"})
+    text = await resp.text()
+
+    assert resp.status == 200
+    assert text.startswith('data: {"delta": "Looking up"}')
+    assert (
+        'event: error\ndata: {"error": "Too many model calls waiting, try again shortly", "retry_after": 3}'
+        in text
+    )
+
+
+async def test_chat_rejected_when_conversation_busy(service_client, service_app):
+    async def chat(conversation, identity, prompt):
+        raise ConversationBusyError("2 prompts are already waiting")
+
+    async def chat_stream(conversation, identity, prompt):
+        raise ConversationBusyError("2 prompts are already waiting")
+        yield
+
+    service_app[keys.llmhandler] = SimpleNamespace(
+        chat=chat,
+        chat_stream=chat_stream,
+        usage=SimpleNamespace(check=len),
+        rate_limiter=SimpleNamespace(queued=0),
+    )
+
+    for path in ("/pie/v0/llm/chat", "/pie/v0/llm/chat/stream"):
+        resp = await service_client.get(path, params={"prompt": "hi"})
+        assert resp.status == 429
+        assert await resp.json() == {
+            "error": "Too many messages waiting in the conversation"
+        }